@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Benchmark the row engine used by datacleaner.parse_file.
+
+Compares rows/s of the previous per-line parser (a StringIO, UnicodeReader
+and csv reader built for every line) with RowParser, which reuses a single
+reader for the whole stream. A test file is generated when PATH is missing.
+
+Usage:
+    bench_row_engine.py [-h] [--size=MB] [--columns=NUM] PATH
+
+Options:
+    --size=MB                       Size of the generated file [default: 1024]
+    --columns=NUM                   Number of columns [default: 3]
+    -h, --help                      This help output
+
+Examples:
+    bench_row_engine.py --size=4096 /tmp/bench.csv
+"""
+from __future__ import print_function, division
+
+import csv
+import os
+import StringIO
+import sys
+import time
+
+from docopt import docopt
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def generate(path, size, columns):
+    """Write a comma separated file of about size bytes."""
+    row = 0
+    with open(path, 'wb') as f:
+        while f.tell() < size:
+            lines = []
+            for _ in range(10000):
+                fields = ['"user{}@mail.com"'.format(row)]
+                fields.extend(' value{}_{} '.format(row, c)
+                              for c in range(1, columns))
+                if row % 50 == 0:
+                    fields.pop()
+                lines.append(','.join(fields) + '\n')
+                row += 1
+            f.write(''.join(lines))
+
+
+def old_parse_row(dc, line, csv_column_count, dialect):
+    """Per-line parser used before RowParser."""
+    line = dc.re.sub(r'(?:(?<=\%s) | (?=\%s))' % (
+        dialect.delimiter, dialect.delimiter), '', line)
+    line_buffer = StringIO.StringIO()
+    line_buffer.write(line)
+    line_buffer.seek(0)
+    row_escaped = dc.UnicodeReader(line_buffer, dialect=dialect).next()
+    if len(row_escaped) == csv_column_count:
+        return row_escaped, None
+    return None, line
+
+
+def run(path, parse):
+    rows = 0
+    start = time.time()
+    with open(path, 'rb') as f:
+        for line in f:
+            parse(line)
+            rows += 1
+    return rows, time.time() - start
+
+
+def main(args):
+    path = args['PATH']
+    columns = int(args['--columns'])
+    if not os.path.exists(path):
+        print('Generating {}'.format(path))
+        generate(path, int(args['--size']) * 1024 * 1024, columns)
+
+    # datacleaner parses the command line when imported
+    sys.argv = sys.argv[:1]
+    sys.path.insert(0, BASE_DIR)
+    import datacleaner as dc
+
+    dialect = csv.excel
+    row_parser = dc.RowParser(dialect, columns)
+    engines = (
+        ('per-line reader', lambda line: old_parse_row(
+            dc, line, columns, dialect)),
+        ('RowParser', lambda line: row_parser.parse(
+            row_parser.spaces.sub('', line))),
+    )
+    size = os.path.getsize(path) / (1024 * 1024)
+    print('{}: {:.0f} MB'.format(path, size))
+    for name, parse in engines:
+        rows, elapsed = run(path, parse)
+        print('{:<16} {:>12} rows {:>8.1f} s {:>12.0f} rows/s'.format(
+            name, rows, elapsed, rows / elapsed))
+
+
+if __name__ == '__main__':
+    """Executed if called from CLI directly."""
+    args = docopt(__doc__)
+    main(args)
@@ -1,31 +1,43 @@
 #!/usr/bin/env python
-import StringIO
 import argparse
 import cStringIO
 import codecs
 import csv
-import io
 import json
 import os
 import re
 import sys
 import glob
-import subprocess
 import socket
 import struct
 import datetime
+import multiprocessing
 
-from shutil import copyfile
-from collections import Counter
+from shutil import copyfileobj
+from collections import Counter, OrderedDict
 from validate_email import validate_email
-from copy import deepcopy
-from hashid import HashID
 
 import parse_sql
-from dc import gather_files, move, c_failure, c_success, c_action, c_action_info, c_action_system, c_sys_success,\
+from dc import file_fingerprint, gather_files, move, c_failure, c_success, c_action, c_action_info, c_action_system, c_sys_success,\
     c_warning, c_darkgray, c_darkgreen, c_lightgreen, c_lightgray, c_lightblue, c_blue,\
     TqdmUpTo
+from dc.asciifilter import AsciiFile, filter_ascii
+from dbtools.checkpoint import Checkpoint
+from dc.dedup import DEDUP_FIELDS, RecordSet
+from dc.detect import column_counts, detect_dialect, sample_lines
+from dc.hashes import HashTyper
+from dc.jobs import file_size, run_jobs
+from dc.lineindex import INDEX_DIR, LineIndex
+from dc.lines import LineFeed, utf8_lines
+from dc.memo import DetectionMemo, line_signature
+from dc.plan import Plan
+from dc.releases import ReleaseCache
+from dc.parallel import COPY_BUFFER, concat_files, iter_range, line_ranges
 from dc.sampling import create_sample
+from dbtools.fileio import EXTENSIONS, compressed_bytes, compression, open_file, \
+    open_output, read_position, strip_compression
+from dbtools.jsonio import JsonLinesWriter
+from headers.resolver import HeaderResolver
 
 # Full path to directories used
 DIRS = {
@@ -44,7 +56,7 @@ DIRS = {
     'sample':
     'samples',
     'skipped': ('completed', 'error', 'failed', 'fail', 'done', 'success',
-                'headers_skip'),
+                'headers_skip', INDEX_DIR),
     'sql_fail':
     'sql_fail',
     'sql_success':
@@ -55,6 +67,13 @@ DIRS = {
 # match entries that are surrounded by a single charactor (#, <>, etc)
 JSON_ENTRIES_SKIP = ('null', 'blank', 'xxx', 'N')
 
+# Matches any entry of JSON_ENTRIES_SKIP
+SKIPPED_ENTRY = re.compile(
+    '[<#]?(?:{})[#>]?$'.format('|'.join(JSON_ENTRIES_SKIP)), re.IGNORECASE)
+
+# Misc headers (x[0-9]) not written to JSON
+MISC_HEADER = re.compile(r'^x(?:\d+)?$')
+
 # Parts of filename to be removed when cleaned
 UNWANTED = ('_cleaned', '_dump')
 
@@ -99,12 +118,22 @@ HEADER2ABBR = {
     for header in headers
 }
 
+# Resolves header names to abbreviations
+HEADER_RESOLVER = HeaderResolver(HEADERS)
+
 # for refactoring the json
 EMAILS = ['e', 'e1', 'e2', 'e3', 'e4', 'e5', 'e6', 'e7', 'e8', 'e9']
 IPS = ['i', 'i1', 'i2', 'i3', 'i4', 'i5', 'i6', 'i7', 'i8', 'i9']
 TELEPHONES = ['t', 't1', 't2', 't3', 't4', 't5', 't6', 't7', 't8', 't9']
 ADDRESS = ['address', 'a1', 'a2', 'a3', 'a4', 'a5', 'a6', 'a7']
 HASHES = ['h', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'h7', 'h8', 'h9']
+KEY_KINDS = dict(
+    [(key, 'hash') for key in HASHES] +
+    [(key, 'address') for key in ADDRESS] +
+    [(key, 'telephone') for key in TELEPHONES] +
+    [(key, 'ip') for key in IPS] +
+    [(key, 'email') for key in EMAILS]
+)
 MAPPER = {
     "a": "address",
     "n": "name",
@@ -152,6 +181,24 @@ exclusive_args.add_argument(
 parser.add_argument("-d", type=str, help="Delimiter")
 exclusive_args.add_argument(
     "-j", help="Write JSON file. No file cleaning.", action="store_true")
+exclusive_args.add_argument(
+    "-cj",
+    help="Clean files and write their JSON file in one pass",
+    action="store_true")
+parser.add_argument(
+    "--keep-csv",
+    help="Also write the cleaned CSV with -cj",
+    action="store_true")
+parser.add_argument(
+    "--dedup",
+    help="Skip duplicate records with -j, -cj and -jm",
+    action="store_true")
+parser.add_argument(
+    "--dedup-fields",
+    type=str,
+    default=','.join(DEDUP_FIELDS),
+    help="Fields identifying duplicate records, separated by commas "
+         "[default: all but the import date]")
 
 def valid_date(s):
     try:
@@ -160,6 +207,18 @@ def valid_date(s):
         msg = "Not a valid date: '{0}'".format(s) + " - Valid format: YYYY-MM-DD"
         raise argparse.ArgumentTypeError(msg)
 
+def line_range(s):
+    try:
+        first, _, last = s.partition('-')
+        first = int(first)
+        last = int(last) if last else first
+    except ValueError:
+        first = last = 0
+    if not 1 <= first <= last:
+        msg = "Not a valid line range: '{0}'".format(s) + " - Valid format: FIRST-LAST"
+        raise argparse.ArgumentTypeError(msg)
+    return first, last
+
 parser.add_argument(
     "--importdate", type=valid_date, help="Add import date to each line of the resulting json - Valid format YYYY-MM-DD")
 parser.add_argument(
@@ -181,6 +240,11 @@ exclusive_args.add_argument(
     "-s",
     help="Create sample of csv(s). No file cleaning.",
     action="store_true")
+parser.add_argument(
+    "-sa",
+    help="Sample from random offsets, estimating the line count from the "
+         "file size",
+    action="store_true")
 parser.add_argument(
     "-sci",
     type=float,
@@ -195,22 +259,87 @@ exclusive_args.add_argument(
     "-sh",
     type=str,
     help="Specify headers to use for multiple files. No file cleaning.")
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes used to clean or parse a single file "
+         "[default: 1]")
+parser.add_argument(
+    "--jobs",
+    type=int,
+    help="Number of files processed at the same time "
+         "[default: 1, number of CPUs with -s]")
+parser.add_argument(
+    "--compress",
+    choices=sorted(kind for kind in EXTENSIONS.values() if kind != 'zip'),
+    help="Compress the cleaned CSV and JSON files written")
+parser.add_argument(
+    "--resume",
+    help="Resume the cleaning, JSON or SQL parsing of files from their "
+         "last checkpoint",
+    action="store_true")
+parser.add_argument(
+    "--no-memo",
+    help="Don't reuse or remember delimiter and header decisions",
+    action="store_true")
+exclusive_args.add_argument(
+    "--index",
+    help="Index the line offsets of files for --lines and -s. No file "
+         "cleaning.",
+    action="store_true")
+exclusive_args.add_argument(
+    "--lines",
+    type=line_range,
+    metavar="FIRST-LAST",
+    help="Print lines FIRST to LAST of files, counted from 1 with the "
+         "headers. No file cleaning.")
+plan_args = parser.add_mutually_exclusive_group()
+plan_args.add_argument(
+    "--plan",
+    type=str,
+    help="Ask delimiter and header questions for all files and write them "
+         "to a plan file. No file cleaning.")
+plan_args.add_argument(
+    "--execute",
+    type=str,
+    help="Process files with the decisions of a plan file, without asking")
 args = parser.parse_args()
 
 if (args.c and (not args.d)) or (not args.c and args.d):
     print "Warning: Argument -c and -d should be used together"
     sys.exit(0)
 
-if (args.importdate and (not args.j)) or (not args.importdate and args.j):
-    print "Warning: Arg --importdate and -j should be used together"
+if bool(args.importdate) != bool(args.j or args.cj):
+    print "Warning: Arg --importdate and -j or -cj should be used together"
     sys.exit(0)
 
+if args.jobs is None:
+    # Sampling asks no questions, so files are sampled in parallel
+    args.jobs = multiprocessing.cpu_count() if args.s else 1
+
 guess = True
 if args.c and args.d:
     guess = False
 
 delims = ('\t', ' ', ';', ',', '|', ':')
 
+# Dialect attributes needed to rebuild a dialect inside a worker process
+DIALECT_ATTRS = ('delimiter', 'quotechar', 'escapechar', 'doublequote',
+                 'skipinitialspace', 'lineterminator', 'quoting')
+
+# Number of shards given to each worker when cleaning a file in parallel
+SHARDS_PER_WORKER = 4
+
+# Lines cleaned between progress updates and checkpoint checks
+PROGRESS_LINES = 1000
+
+# Decisions remembered between runs, opened on first use
+memo = None
+
+# Decisions read from the plan file given with --execute
+plan = None
+
 
 def valid_ip(address):
     try:
@@ -226,6 +355,8 @@ re_phone1 = re.compile('\d{3}-\d{3}-\d{3}')
 re_phone2 = re.compile('\d{9}')
 re_phone3 = re.compile('\+\d{4}-\d{3}-\d{4}')
 
+# Size of the buffer used to write rows in batches
+WRITE_BUFFER = 1024 * 1024
 
 class UTF8Recoder:
     """
@@ -234,12 +365,16 @@ class UTF8Recoder:
 
     def __init__(self, f, encoding):
         self.reader = codecs.getreader(encoding)(f)
+        # UTF-8 bytes of the lines returned
+        self.consumed = 0
 
     def __iter__(self):
         return self
 
     def next(self):
-        return self.reader.next().encode("utf-8")
+        line = self.reader.next().encode("utf-8")
+        self.consumed += len(line)
+        return line
 
 
 class UnicodeReader:
@@ -249,30 +384,118 @@ class UnicodeReader:
     """
 
     def __init__(self, f, dialect=csv.excel, encoding="utf-8", **kwds):
-        f = UTF8Recoder(f, encoding)
-        self.reader = csv.reader(f, dialect=dialect, **kwds)
+        self.start = f.tell()
+        self.recoder = UTF8Recoder(f, encoding)
+        self.reader = csv.reader(self.recoder, dialect=dialect, **kwds)
 
     def next(self):
-        row = self.reader.next()
-        unicode_row = list()
-        for r in row:
-            match = HEX_IP_PATTERN.findall(r)
-            if not match or not match[0]:
-                unicode_row.append(unicode(r, "utf-8"))
-            else:
-                try:
-                    addr_long = int(match[0], 16)
-                    ip_addrress = socket.inet_ntoa(
-                        struct.pack("!L", addr_long))
-                    unicode_row.append(unicode(ip_addrress, "utf-8"))
-                except Exception:
-                    unicode_row.append(unicode(r, "utf-8"))
-        return unicode_row
+        return decode_row(self.reader.next())
+
+    def __iter__(self):
+        return self
+
+    def tell(self):
+        """Return the offset of the end of the last row read, for UTF-8
+        files."""
+        return self.start + self.recoder.consumed
+
+
+class ByteReader:
+    """
+    A CSV reader for UTF-8 files which keeps fields as UTF-8 encoded str,
+    without decoding and reencoding every line and field.
+    """
+
+    def __init__(self, f, dialect=csv.excel, **kwds):
+        self.reader = csv.reader(utf8_lines(f), dialect=dialect, **kwds)
+
+    def next(self):
+        return convert_row(self.reader.next())
 
     def __iter__(self):
         return self
 
 
+def csv_reader(f, dialect=csv.excel, encoding="utf-8", **kwds):
+    """Return a reader of UTF-8 str rows for UTF-8 files, otherwise a
+    transcoding reader of unicode rows."""
+    if codecs.lookup(encoding).name == 'utf-8':
+        return ByteReader(f, dialect=dialect, **kwds)
+    return UnicodeReader(f, dialect=dialect, encoding=encoding, **kwds)
+
+
+def convert_row(row):
+    """Convert UNHEX() encoded ips in a row of str fields."""
+    converted_row = list()
+    for r in row:
+        if "UNHEX('" not in r:
+            converted_row.append(r)
+            continue
+        match = HEX_IP_PATTERN.findall(r)
+        if not match or not match[0]:
+            converted_row.append(r)
+        else:
+            try:
+                addr_long = int(match[0], 16)
+                converted_row.append(socket.inet_ntoa(
+                    struct.pack("!L", addr_long)))
+            except Exception:
+                converted_row.append(r)
+    return converted_row
+
+
+def decode_row(row):
+    """Decode UTF-8 fields to unicode, converting UNHEX() encoded ips."""
+    return [unicode(r, "utf-8") for r in convert_row(row)]
+
+
+class RowParser:
+    """
+    Parses lines into rows of a fixed column count with one csv reader.
+
+    Lines are read as UTF-8 and rows are returned as str fields, ready
+    for a ByteWriter.
+    """
+
+    def __init__(self, dialect, csv_column_count):
+        self.dialect = dialect
+        self.csv_column_count = csv_column_count
+        self.line_feed = LineFeed()
+        self.reader = csv.reader(self.line_feed, dialect=dialect)
+        # Spaces before and after the delimiter
+        self.spaces = re.compile(r'(?:(?<=\%s) | (?=\%s))' % (
+            dialect.delimiter, dialect.delimiter))
+
+    def parse(self, line):
+        """Parses line and returns a cleaned or failed row."""
+        self.line_feed.feed(line)
+        row_escaped = convert_row(self.reader.next())
+
+        if len(row_escaped) == self.csv_column_count:
+            return row_escaped, None
+        if args.m and self.csv_column_count > 1:
+            lx = row_escaped[:self.csv_column_count - 1]
+            lt = self.dialect.delimiter.join(
+                row_escaped[self.csv_column_count - 1:])
+            lx.append(lt)
+            return lx, None
+        return None, line
+
+    def clean(self, line, clean_writer, error_file):
+        """Write line to the clean writer, or to the error file if it fails."""
+        # Remove Spaces before and afer delimeter
+        line = self.spaces.sub('', line)
+
+        cleaned_row, failed_row = self.parse(line)
+
+        if failed_row:
+            error_file.write(failed_row)
+        else:
+            clean_writer.writerow(
+                remove_quote(cleaned_row)
+            )
+
+
 class UnicodeWriter:
     """
     A CSV writer which will write rows to CSV file "f",
@@ -305,6 +528,48 @@ class UnicodeWriter:
         for row in rows:
             self.writerow(row)
 
+    def flush(self):
+        pass
+
+
+class ByteWriter:
+    """
+    A CSV writer which will write rows of UTF-8 encoded str to CSV file "f"
+    without transcoding them. Rows are collected in a buffer that is written
+    to the file once it is larger than buffer_size.
+    """
+
+    def __init__(self, f, dialect=csv.excel, buffer_size=WRITE_BUFFER,
+                 **kwds):
+        self.queue = cStringIO.StringIO()
+        self.writer = csv.writer(self.queue, dialect=dialect, **kwds)
+        self.stream = f
+        self.buffer_size = buffer_size
+
+    def tell(self):
+        return self.stream.tell() + self.queue.tell()
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        if self.queue.tell() >= self.buffer_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        self.stream.write(self.queue.getvalue())
+        self.queue.truncate(0)
+
+
+def csv_writer(f, dialect=csv.excel, encoding="utf-8", **kwds):
+    """Return a batching writer of str rows for UTF-8 output, otherwise a
+    transcoding writer of unicode rows."""
+    if codecs.lookup(encoding).name == 'utf-8':
+        return ByteWriter(f, dialect=dialect, **kwds)
+    return UnicodeWriter(f, dialect=dialect, encoding=encoding, **kwds)
+
 
 class myDialect(csv.Dialect):
     delimiter = ','
@@ -327,52 +592,10 @@ def process_dialect_row(row):
 
 
 def find_column_count(f, dialect=csv.excel, show_freq=False):
-    """Find the column count with the most occurences in 1000 lines."""
-    row_lengths = []
-
-    # Test 1000 first row
-    index = 0
-    while index < 1000:
-        try:
-            line = f.readline()
-            line_buffer = StringIO.StringIO()
-            line_buffer.write(line)
-            line_buffer.seek(0)
-            reader = UnicodeReader(line_buffer, dialect=dialect)
-            row = reader.next()
-            row_lengths.append(len(row))
-            index += 1
-        except Exception as err:
-            break
-
-    counts = Counter(row_lengths)
-    column_count = counts.most_common()[0][0]
-    column_freq = counts.most_common()[0][1]
-    if column_count == 0:
-        try:
-            column_count = counts.most_common(2)[1][0]
-            column_freq = counts.most_common(2)[1][1]
-        except (ValueError, AttributeError, TypeError, IndexError):
-
-            # If not found test the whole file
-            while True:
-                try:
-                    line = f.readline()
-                    line_buffer = StringIO.StringIO()
-                    line_buffer.write(line)
-                    line_buffer.seek(0)
-                    reader = UnicodeReader(line_buffer, dialect=dialect)
-                    row = reader.next()
-                    row_lengths.append(len(row))
-                except Exception as err:
-                    break
-
-            counts = Counter(row_lengths)
-            column_count = counts.most_common()[0][0]
-            column_freq = counts.most_common()[0][1]
-            if column_count == 0:
-                column_count = counts.most_common(2)[-1][0]
-                column_freq = counts.most_common(2)[-1][1]
+    """Find the column count with the most occurences in a sample of lines
+    from the start, middle and end of the file."""
+    counts = column_counts(sample_lines(f), dialect)
+    column_count, column_freq = counts.most_common(1)[0]
 
     if show_freq:
         return column_count, column_freq
@@ -380,79 +603,6 @@ def find_column_count(f, dialect=csv.excel, show_freq=False):
     return column_count
 
 
-def guess_delimeter_by_csv(F):
-
-    # Init stuffs
-    sniffer = csv.Sniffer()
-
-    first_read = True
-    sample_delims = deepcopy(delims)
-    while True:
-        F.seek(0)
-
-        if first_read:
-            sample_text = F.read(1024 * 100)
-        else:
-            sample_text = F.read()
-
-        # Try sniff quote all
-        all_dialect_variables = [None, 0, 0]
-        try:
-            all_dialect = sniffer.sniff(sample_text, delimiters=sample_delims)
-            F.seek(0)
-            all_column_count, all_column_freq = find_column_count(F, all_dialect, show_freq=True)
-            all_dialect_variables = [all_dialect, all_column_count, all_column_freq]
-        except Exception as err:
-            pass
-
-        # Try sniff quote all
-        none_dialect_variables = [None, 0, 0]
-        try:
-            none_dialect = sniffer.sniff(sample_text, delimiters=sample_delims)
-            none_dialect.quoting = csv.QUOTE_NONE
-            F.seek(0)
-            none_column_count, none_column_freq = find_column_count(F, none_dialect, show_freq=True)
-            none_dialect_variables = [none_dialect, none_column_count, none_column_freq]
-        except Exception as err:
-            pass
-
-        if (not first_read
-                and all_dialect_variables[0] is None
-                and none_dialect_variables[0] is None):
-            return
-
-        if none_dialect_variables[1] <=1 and all_dialect_variables[1] <=1:
-            # Total ignore delims pool
-            ignore_delims = []
-            if all_dialect_variables[0]:
-                ignore_delims.append(all_dialect_variables[0].delimiter)
-            if none_dialect_variables[0]:
-                ignore_delims.append(none_dialect_variables[0].delimiter)
-
-            # Reload sample delims
-            sample_delims = [
-                delim for delim in sample_delims
-                if delim not in ignore_delims
-            ]
-
-            if not sample_delims:
-                return
-
-            first_read = False
-
-            continue
-
-        break
-
-    if all_dialect_variables[0] is None and none_dialect_variables[0] is None:
-        return
-
-    if float(all_column_freq + all_column_count)/2 >= float(none_column_count + none_column_freq)/2:
-        return all_dialect_variables
-
-    return none_dialect_variables
-
-
 def ask_user_for_delimeter():
 
     csv_delimeter = raw_input(
@@ -462,93 +612,22 @@ def ask_user_for_delimeter():
     return csv_delimeter, int(csv_column_count)
 
 
-def strip_delimeter(ls, csv_delimeter):
-
-    while True:
-        if ls:
-            if ls[0] == csv_delimeter:
-                ls = ls[1:]
-            else:
-                break
-        break
-
-    while True:
-        if ls:
-            if ls[-1] == csv_delimeter:
-                ls = ls[:-1]
-            else:
-                break
-        else:
-            break
-
-    return ls
-
-
 def guess_delimeter(F):
 
-    # Load sniff guess for compare
-    sniff_guess = guess_delimeter_by_csv(F)
-
-    # Load normal algorithm delimiter check for compare
-    delim_counts_list = {}
-    delim_freq = {}
-    for d in delims:
-        delim_counts_list[d] = []
-        delim_freq[d] = {}
-
-    x = 0
-
-    F.seek(0)
-
-    for l in F:
-        if x >= 1000:
-            break
-        for d in delims:
-            ls = l.strip()
-            ls = strip_delimeter(ls, d)
-            cnt = ls.count(d)
-            delim_counts_list[d].append(cnt)
-            x += 1
-
-    most_frequent = (None, 0, 0)
-
-    for d in delims:
-        for c in delim_counts_list[d]:
-            if c:
-                if c in delim_freq[d]:
-                    delim_freq[d][c] += 1
-                else:
-                    delim_freq[d][c] = 1
-
-    for d in delim_freq:
-        for c in delim_freq[d]:
-            delim_average = (c + delim_freq[d][c]) / 2
-            freq_average = (most_frequent[1] + most_frequent[2]) / 2
-            if delim_average > freq_average:
-                most_frequent = (d, delim_freq[d][c], c)
-
-    csv_delimeter = most_frequent[0]
-    rdialect = excelDialect()
-    rdialect.delimiter = csv_delimeter
-
-    if (sniff_guess
-            and ((((sniff_guess[1] + sniff_guess[2])/2) > ((most_frequent[1] + most_frequent[2])/2))
-                 or (most_frequent[1] == 0))):
-
-        csv_delimeter = sniff_guess[0].delimiter
-        rdialect = sniff_guess[0]
-
-    F.seek(0)
-
-    try:
-        csv_column_count = find_column_count(F, rdialect)
-    except IndexError:
+    # Score all delimiters on one bounded sample of the file
+    lines = sample_lines(F)
+    if not any(line.strip() for line in lines):
         raise ValueError("Blank file, ignoring.")
 
-    if csv_delimeter:
+    detection = detect_dialect(lines, delims)
+
+    if detection:
+        rdialect = detection.dialect
+        csv_delimeter = rdialect.delimiter
+        csv_column_count = detection.column_count
 
-        print "\033[38;5;244mGuess method: Custom delimiter -> {}\n".format(
-            csv_delimeter)
+        print "\033[38;5;244mGuess method: Sample histogram -> {} ({:.0%} of lines)\n".format(
+            csv_delimeter, detection.confidence)
     elif not args.p:
         print "\033[38;5;203m Delimiter could not determined"
         csv_delimeter, csv_column_count = ask_user_for_delimeter()
@@ -564,6 +643,7 @@ def guess_delimeter(F):
 
     print "\033[38;5;147m Guessed delimeter -> {}".format(repr(csv_delimeter))
     print "\033[38;5;147m Guessed column number", csv_column_count
+    print "\033[38;5;147m Confidence {:.0%}".format(detection.confidence)
 
     confirmed = confirm()
     if confirmed:
@@ -577,6 +657,69 @@ def guess_delimeter(F):
         return rdialect, csv_column_count
 
 
+def get_memo():
+    """Return the detection memo, None when disabled with --no-memo."""
+    global memo
+    if args.no_memo:
+        return None
+    if memo is None:
+        memo = DetectionMemo()
+    return memo
+
+
+def memo_keys(f):
+    """Return the fingerprint of file f and the signature of its first line."""
+    location = f.tell()
+    f.seek(0)
+    signature = line_signature(f.readline())
+    f.seek(location)
+    return file_fingerprint(f.name), signature
+
+
+def recall_dialect(f):
+    """Return the dialect and column count remembered for file f.
+
+    With --execute the decisions come from the plan only. Returns
+    (None, None) when the file is unknown.
+    """
+    if plan is not None:
+        decision = plan.lookup(f.name)
+        if not decision or not decision.get('dialect'):
+            return None, None
+        dialect = type('PlanDialect', (csv.Dialect, object),
+                       decision['dialect'])
+        print "\033[38;5;244mGuess method: Plan -> {} ({} columns)\n".format(
+            repr(dialect.delimiter), decision['column_count'])
+        return dialect, decision['column_count']
+
+    memo = get_memo()
+    if not memo:
+        return None, None
+    fingerprint, signature = memo_keys(f)
+    # Unconfirmed guesses are reused only when guesses aren't confirmed
+    decision = memo.recall('dialect', fingerprint, signature,
+                           confirmed_only=not args.a)
+    if not decision:
+        return None, None
+
+    dialect = type('MemoDialect', (csv.Dialect, object), decision['dialect'])
+    print "\033[38;5;244mGuess method: Memo -> {} ({} columns)\n".format(
+        repr(dialect.delimiter), decision['column_count'])
+    return dialect, decision['column_count']
+
+
+def remember_dialect(f, dialect, csv_column_count, confirmed):
+    """Store the dialect and column count used for file f."""
+    memo = get_memo()
+    if not memo:
+        return
+    fingerprint, signature = memo_keys(f)
+    memo.remember('dialect', fingerprint, signature, {
+        'dialect': {attr: getattr(dialect, attr) for attr in DIALECT_ATTRS},
+        'column_count': csv_column_count,
+    }, confirmed)
+
+
 def clean(e):
     while True:
         if e:
@@ -607,67 +750,92 @@ def clean_filename(source):
         os.rename(source, new_name)
 
 
-def data_prep(source):
-    """Clean/refactor source dictionary."""
+class RecordPlan:
+    """Rules of data_prep compiled once for the headers of a file.
 
-    # Remove unwanted fields/values
-    for header, value in source.items():
-        # Remove misc headers (x[0-9]) and entries with empty values
-        if re.search('^x(?:\d+)?$', header) or not value:
-            del source[header]
-        # Remove entries that are in JSON_ENTRIES_SKIP
-        elif found_in(value, JSON_ENTRIES_SKIP):
-            del source[header]
-        # Remove extra spaces at start or end
-        else:
-            source[header] = value.strip()
-
-    # Consolidate address entries to 'a' field
-    full_addy = ''
-    for num in xrange(0, 9):
-        addy_header = 'a' + str(num)
-        addy = source.get(addy_header)
-        if addy:
-            full_addy += ' {}'.format(addy.strip())
-            del source[addy_header]
-    if full_addy:
-        source['a'] = full_addy
-
-    # Consolidate name fields
-    if source.get('fn') or source.get('ln'):
-        source['n'] = '{} {}'.format(
-            source.pop('fn', ''), source.pop('ln', '')).strip()
-
-    # Rename 'd' date of birth field to 'dob'
-    if source.get('d'):
-        source['dob'] = source.pop('d').strip()
-
-    # Make the 'dob' field with 'doby', 'dobm', and 'dobd' fields
-    if not source.get('dob'):
-        source['dob'] = '{}-{}-{}'.format(
-            source.pop('doby', ''),
-            source.pop('dobm', '').zfill(2) if source.get('dobm') else '',
-            source.pop('dobd', '').zfill(2) if source.get('dobd') else ''
-        ).strip('-').strip()
-
-    # Split out domain from email address
-    if source.get('e'):
-        email = source.get('e')
-        if '@@' in email:
-            email = '@'.join(email.split('@@'))
-        if validate_email(email):
-            source['e'] = email
-            source['d'] = email.split('@')[-1]
-        else:
-            del source['e']
-    return source
+    Lists the headers dropped (misc), the address headers merged into 'a'
+    and which name, date of birth and email rules apply, so rows are
+    prepared without regex compiles or lookups of absent headers. Keys
+    are added to and removed from the row dict in the same order as
+    before, so the JSON written is unchanged.
+    """
 
+    def __init__(self, headers):
+        # Each header once, a row dict holds one value per header
+        self.headers = list(set(headers))
+        self.misc = set(
+            header for header in self.headers if MISC_HEADER.search(header))
+        self.addresses = [
+            'a' + str(num) for num in xrange(0, 9)
+            if 'a' + str(num) in self.headers]
+        self.names = 'fn' in self.headers or 'ln' in self.headers
+        self.dob_parts = any(
+            part in self.headers for part in ('doby', 'dobm', 'dobd'))
+
+    def prep(self, source):
+        """Clean/refactor source dictionary."""
+
+        # Remove unwanted fields/values
+        for header in self.headers:
+            if header not in source:
+                continue
+            value = source[header]
+            # Remove misc headers (x[0-9]) and entries with empty values
+            if header in self.misc or not value:
+                del source[header]
+            # Remove entries that are in JSON_ENTRIES_SKIP
+            elif SKIPPED_ENTRY.match(value):
+                del source[header]
+            # Remove extra spaces at start or end
+            else:
+                source[header] = value.strip()
+
+        # Consolidate address entries to 'a' field
+        full_addy = ''
+        for addy_header in self.addresses:
+            addy = source.get(addy_header)
+            if addy:
+                full_addy += ' {}'.format(addy.strip())
+                del source[addy_header]
+        if full_addy:
+            source['a'] = full_addy
+
+        # Consolidate name fields
+        if self.names and (source.get('fn') or source.get('ln')):
+            source['n'] = '{} {}'.format(
+                source.pop('fn', ''), source.pop('ln', '')).strip()
+
+        # Rename 'd' date of birth field to 'dob'
+        if source.get('d'):
+            source['dob'] = source.pop('d').strip()
+
+        # Make the 'dob' field with 'doby', 'dobm', and 'dobd' fields
+        if not source.get('dob'):
+            if self.dob_parts:
+                source['dob'] = '{}-{}-{}'.format(
+                    source.pop('doby', ''),
+                    source.pop('dobm', '').zfill(2) if source.get('dobm') else '',
+                    source.pop('dobd', '').zfill(2) if source.get('dobd') else ''
+                ).strip('-').strip()
+            else:
+                source['dob'] = ''
+
+        # Split out domain from email address
+        if source.get('e'):
+            email = source.get('e')
+            if '@@' in email:
+                email = '@'.join(email.split('@@'))
+            if validate_email(email):
+                source['e'] = email
+                source['d'] = email.split('@')[-1]
+            else:
+                del source['e']
+        return source
 
-def found_in(value, array):
-    for item in array:
-        if re.match('[<#]?{}[#>]?$'.format(item), value, flags=re.IGNORECASE):
-            return True
-    return False
+
+def data_prep(source):
+    """Clean/refactor source dictionary."""
+    return RecordPlan(source.keys()).prep(source)
 
 
 def wrap_fields(l, wrapper='"'):
@@ -675,24 +843,28 @@ def wrap_fields(l, wrapper='"'):
 
 
 def refactor_data(data):
-    temp_data = deepcopy(data['_source'])
+    # Copy the keys the way deepcopy does, they are put back in its order
+    temp_data = {}
+    for key, value in data['_source'].iteritems():
+        temp_data[key] = value
     email = list()
     ip = list()
     telephone = list()
     address = dict()
     hash_ = list()
-    for key, value in temp_data.items():
+    for key, value in temp_data.iteritems():
         data['_source'].pop(key)
         if value and value != "0" and value != "null":
-            if key in EMAILS:
+            kind = KEY_KINDS.get(key)
+            if kind == 'email':
                 email.append(value)
-            elif key in IPS:
+            elif kind == 'ip':
                 ip.append(value)
-            elif key in TELEPHONES:
+            elif kind == 'telephone':
                 telephone.append(value)
-            elif key in ADDRESS:
+            elif kind == 'address':
                 address.update({key: value})
-            elif key in HASHES:
+            elif kind == 'hash':
                 hash_.append(value)
             else:
                 new_key = MAPPER.get(key, key)
@@ -731,20 +903,11 @@ def tuplelist_to_json(source):
 
     return result
 
-def write_json(source):
-    print "Writing json file for", source
-    fbasename = os.path.basename(source)
+def json_name(source):
+    """Return the name of the JSON file written for a cleaned file."""
+    fbasename = os.path.basename(strip_compression(source))
     json_file = os.path.splitext(fbasename)[0] + '.json'
 
-    if not os.path.exists(DIRS['json_success']):
-        os.mkdir(DIRS['json_success'])
-
-    out_reader = UnicodeReader(open(source), dialect=myDialect)
-
-    # grab the first line as headers
-    headers = out_reader.next()
-    headers = clean_headers(headers)
-
     # remove string in brackets from file name
     json_file = re.sub("[\(\[].*?[\)\]]", "", json_file)
     json_file = re.sub(r"\s*{.*}\s*", "", json_file)
@@ -752,47 +915,184 @@ def write_json(source):
     # remove unwanted string from filename
     for undesirable in UNWANTED_RELEASE:
         json_file = json_file.replace(undesirable, '')
-    json_file = os.path.splitext(json_file)[0].strip("_").strip("-") + '.json'
+    return os.path.splitext(json_file)[0].strip("_").strip("-") + '.json'
+
 
-    with open(os.path.join(DIRS['json_success'], json_file), 'a+') as outfile:
-        # Add first line of json
-        line_count = 0
-        pbar = TqdmUpTo(desc='Writing JSON', unit=' row')
+class JsonWriter:
+    """
+    Writes the rows of a cleaned file as JSON records to the JSON file of
+    its release. The first row holds the headers.
 
-        for row in out_reader:
-            # If this is not the first row, add a new line
-            if line_count > 0:
-                outfile.write('\n')
+    Rows of str fields given to writerow(), as to the CSV writers, are also
+    written to csv_writer when one is given.
+    """
 
-            source = data_prep(dict(zip(headers, row)))
+    def __init__(self, source, csv_writer=None):
+        self.csv_writer = csv_writer
+        self.json_path = os.path.join(DIRS['json_success'], json_name(source))
+        if args.compress:
+            self.json_path += '.' + args.compress
+        self.release = release_name(source)
+        if args.importdate:
+            self.importdate = str(args.importdate)[:10]
+        else:
+            self.importdate = None
+        self.headers = None
+        self.source_headers = None
+        self.outfile = None
+        self.line_count = 0
+        self.records = None
+
+        if not os.path.exists(DIRS['json_success']):
+            try:
+                os.mkdir(DIRS['json_success'])
+            except OSError:
+                # Created meanwhile by another job
+                if not os.path.isdir(DIRS['json_success']):
+                    raise
+
+    def set_headers(self, headers):
+        self.source_headers = list(headers)
+        self.headers = clean_headers(headers)
+        # Rules of data_prep for the headers of this file
+        self.plan = RecordPlan(self.headers)
+        if args.dedup:
+            # Records already in the JSON file count as seen
+            self.records = RecordSet.for_json(
+                self.json_path, dedup_fields())
+        # Jobs appending to the same file lock it, for as long as the file
+        # is open when it's compressed since streams can't be interleaved
+        locked = args.jobs > 1
+        self.outfile = open_output(self.json_path, append=True,
+                                   lock=locked and bool(args.compress))
+        # Records are encoded and written in large blocks, one per line
+        self.writer = JsonLinesWriter(
+            self.outfile, lock=locked and not args.compress)
+
+    def add(self, row):
+        """Write a row of unicode fields."""
+        if self.headers is None:
+            self.set_headers(row)
+            return
+        source = self.plan.prep(dict(zip(self.headers, row)))
 
-            # Set Import Date
-            if args.importdate:
-                source['importdate'] = str(args.importdate)[:10]
+        # Set Import Date
+        if self.importdate:
+            source['importdate'] = self.importdate
 
-            # Set release name
-            if args.r:
-                source['r'] = args.r
-            # Use filename without extension as release name
-            else:
-                filename = os.path.splitext(fbasename)[0]
-                for undesirable in UNWANTED_RELEASE:
-                    filename = filename.replace(undesirable, '')
-                filename = filename.replace('_', ' ')
-
-                # remove string in brackets from file name
-                filename = re.sub("[\(\[].*?[\)\]]", "", filename)
-                filename = re.sub(r"\s*{.*}\s*", "", filename)
-                source['r'] = filename
-            data = {'_source': source}
-            refactor_data(data)
-            outfile.write(json.dumps(data))
-            line_count += 1
-            pbar.update(1)
-
-        # Write final newline (no comma) and close json brackets
-        outfile.write('\n')
-        pbar.close()
+        source['r'] = self.release
+        data = {'_source': source}
+        refactor_data(data)
+        if self.records and not self.records.add(data['_source']):
+            return
+        self.writer.write(data)
+        self.line_count += 1
+
+    def writerow(self, row):
+        """Write a row of str fields."""
+        if self.csv_writer:
+            self.csv_writer.writerow(row)
+        self.add(decode_row(row))
+
+    def flush(self):
+        if self.csv_writer:
+            self.csv_writer.flush()
+
+    def write_out(self):
+        """Write the buffered records to the JSON file, for a checkpoint.
+
+        Returns the paths of the files written.
+        """
+        self.flush()
+        if self.outfile is not None:
+            self.writer.flush()
+            self.outfile.flush()
+        return [self.json_path]
+
+    def close(self):
+        self.flush()
+        if self.outfile is None:
+            return
+        self.writer.flush()
+        # An empty file still ends with a newline
+        if not self.line_count:
+            self.outfile.write('\n')
+        self.outfile.close()
+        if self.records:
+            self.records.close(self.json_path)
+            report_duplicates(self.release, self.records)
+
+
+def dedup_fields():
+    """Return the fields identifying duplicate records, none for all."""
+    return tuple(field for field in args.dedup_fields.split(',') if field)
+
+
+def report_duplicates(release, records):
+    c_action_info('{}: {} duplicate record(s) skipped of {}'.format(
+        release, records.duplicates, records.records))
+
+
+def release_name(source):
+    """Return the release name of the records of a cleaned file."""
+    if args.r:
+        return args.r
+
+    # Use filename without extension as release name
+    filename = os.path.splitext(os.path.basename(strip_compression(source)))[0]
+    for undesirable in UNWANTED_RELEASE:
+        filename = filename.replace(undesirable, '')
+    filename = filename.replace('_', ' ')
+
+    # remove string in brackets from file name
+    filename = re.sub("[\(\[].*?[\)\]]", "", filename)
+    filename = re.sub(r"\s*{.*}\s*", "", filename)
+    return filename
+
+
+def write_json(source):
+    print "Writing json file for", source
+    json_writer = JsonWriter(source)
+
+    # Appends to uncompressed JSON files save checkpoints to resume from
+    checkpoint = None
+    resumed = None
+    if not args.compress:
+        checkpoint = Checkpoint(source, 'json')
+        if args.resume:
+            # The JSON file is truncated before it's opened
+            resumed = checkpoint.resume()
+            if not resumed:
+                c_warning('{}: No checkpoint to resume from'.format(source))
+
+    source_file = open_file(source)
+    out_reader = UnicodeReader(source_file, dialect=myDialect)
+
+    # grab the first line as headers
+    json_writer.set_headers(out_reader.next())
+
+    pbar = TqdmUpTo(desc='Writing JSON', unit=' row')
+    if resumed:
+        c_action_info('{}: Resuming from byte {}'.format(
+            source, resumed['offset']))
+        source_file.seek(resumed['offset'])
+        out_reader = UnicodeReader(source_file, dialect=myDialect)
+        json_writer.line_count = resumed['records']
+        pbar.update(resumed['records'])
+
+    for row in out_reader:
+        json_writer.add(row)
+        pbar.update(1)
+        if checkpoint and not json_writer.line_count % PROGRESS_LINES and \
+                checkpoint.due():
+            checkpoint.save(out_reader.tell(), json_writer.write_out(),
+                            records=json_writer.line_count)
+
+    json_writer.close()
+    source_file.close()
+    pbar.close()
+    if checkpoint:
+        checkpoint.remove()
 
 def check_hash(identified_modes, hashcatMode=False, johnFormat=False, extended=False):
     """Check hash"""
@@ -821,29 +1121,41 @@ def validate_ip(s):
             return False
     return True
 
+# Hash test memoized across files
+HASH_TYPER = HashTyper()
+
+
 def detect_hash_columns(csv_file, delimiter, num_of_lines):
-    """Return hash columns """
-    hash_columns = []
-    hashID = HashID()
-    for x in range(num_of_lines):
-        line = csv_file.readline()
-        lowerrow = [
-            cc.lower().replace('\n', '').replace('"', '') for cc in line.split(delimiter)
-        ]
-        for i in range(len(lowerrow)):
-            if check_hash(hashID.identifyHash(lowerrow[i])) and not validate_ip(lowerrow[i]):
-                if (i+1) not in hash_columns:
-                    hash_columns.append(i+1)
+    """Return hash columns.
+
+    Reads up to num_of_lines lines from the start, middle and end of the
+    file, a column holds hashes when at least half of its values are.
+    """
+    hashes = Counter()
+    values = Counter()
+    for line in sample_lines(csv_file, max_lines=num_of_lines):
+        row = line.replace('\n', '').replace('"', '').split(delimiter)
+        for column, value in enumerate(row, 1):
+            value = value.strip()
+            if not value:
+                continue
+            values[column] += 1
+            if HASH_TYPER.is_hash(value) and not validate_ip(value):
+                hashes[column] += 1
 
     csv_file.seek(0)
-    return hash_columns
+    return sorted(
+        column for column, count in hashes.items()
+        if count * 2 >= values[column])
 
-def get_headers(csv_file, delimiter, column_count):
+def get_headers(csv_file, delimiter, column_count, with_confidence=False):
     """Reads file and tries to determine if headers are present.
 
-    Returns a list of headers.
+    Returns a list of headers, with the list of their confidences if
+    with_confidence is True.
     """
     headers = []
+    confidences = []
     starting_location = csv_file.tell()
 
     while True:
@@ -852,63 +1164,44 @@ def get_headers(csv_file, delimiter, column_count):
         if line.startswith('#'):
             continue
 
-        lowerrow = [
-            cc.lower().replace('\n', '') for cc in line.split(delimiter)
-        ]
+        fields = line.replace('\n', '').split(delimiter)
+        resolutions = HEADER_RESOLVER.resolve_row(fields)
+        if len(resolutions) < len(fields):
+            csv_file.seek(starting_location)
 
         # Set them enumerated headers to zero
         tracked = {}
         for track in ENUMERATED:
             tracked[track] = 0
 
-        for i in lowerrow:
-            i = i.strip()
-            # Match headers in double quotes on both sides or no double quotes
-            matches = re.search('"(\w+)"|\'(\w+)\'|^(\w+)$', i)
-
-            if matches or i in ["", "\"\"", "''"]:
-                # Take whichever one matched
-                try:
-                    field_name = matches.group(1) or matches.group(2) or matches.group(3)
-                except Exception as err:
-                    field_name = "x"
-
-                # match if this is an enumerated field
-                enumerated = re.search('^([a-z])\d+', field_name)
-                if enumerated:
-                    header = enumerated.group(1)
-                # match if it is a known abbreviation for a header
-                elif ABBR2HEADER.get(field_name):
-                    header = field_name
+        for header, confidence in resolutions:
+            if header in ENUMERATED:
+                if tracked[header]:
+                    header_format = '{}{}'.format(header, tracked[header])
+                    tracked[header] += 1
+                    header = header_format
                 else:
-                    # Make it the header abbreviation or make it misc (x)
-                    header = HEADER2ABBR.get(field_name, 'x')
-
-                if header in ENUMERATED:
-                    if tracked[header]:
-                        header_format = '{}{}'.format(header, tracked[header])
-                        tracked[header] += 1
-                        header = header_format
-                    else:
-                        tracked[header] += 1
+                    tracked[header] += 1
 
-                headers.append(header)
-            else:
-                csv_file.seek(starting_location)
-                break
+            headers.append(header)
+            confidences.append(confidence)
         # Only check the first non-comment row
         break
 
     if len(headers) + 1 == column_count:
         headers.append("x")
+        confidences.append(0.0)
 
-    if len(headers) == column_count:
-        if 's' in headers and 'p' in headers:
-            idx = headers.index('p')
-            headers[idx] = 'h'
-        return headers
-    else:
-        return []
+    if len(headers) != column_count:
+        headers = []
+        confidences = []
+    elif 's' in headers and 'p' in headers:
+        idx = headers.index('p')
+        headers[idx] = 'h'
+
+    if with_confidence:
+        return headers, confidences
+    return headers
 
 
 def ask_headers(column_count):
@@ -998,33 +1291,36 @@ def remove_quote(values):
     return final_values
 
 
-def clean_ascii(source, target):
-    # Load ascii clean bash script
-    clean_ascii_path = os.path.join(
-        os.path.dirname(
-            os.path.realpath(__file__)
-        ),
-        "clean_ascii.sh"
-    )
+def find_dialect(F):
+    """Return the dialect and column count of file F.
 
-    # Provide permission for bash script
-    subprocess.call(
-        ["chmod", "+x", clean_ascii_path],
-    )
-
-    # Clean ascii
-    subprocess.call(
-        [clean_ascii_path, source, target],
-    )
+    Uses the plan or the memo, otherwise guesses them and asks for
+    confirmation unless -a is given. Returns (None, None) when no dialect
+    is found.
+    """
+    dialect, csv_column_count = recall_dialect(F)
+    if dialect or plan is not None:
+        return dialect, csv_column_count
 
-    print(
-        "Done remove ascii char on file %s, new file %s generated." % (
-            source, target
-        )
-    )
+    #c_action_system('   Guessing delimiter \n')
+    try:
+        dialect, csv_column_count = guess_delimeter(F)
+    except TypeError as e:
+        print "Guessing delimiter failed, aborting."
+    except ValueError as e:
+        print "Blank file, aborting."
+    if dialect:
+        # Guesses are confirmed by the user unless -a is given
+        remember_dialect(F, dialect, csv_column_count,
+                         confirmed=not args.a)
+    return dialect, csv_column_count
 
 
 def parse_file(tfile):
+    """Clean one file.
+
+    Returns the list of (path, directory) moves to make once it's cleaned.
+    """
 
     org_tfile = tfile
 
@@ -1035,38 +1331,48 @@ def parse_file(tfile):
 
     os.rename(org_tfile, tfile)
 
-    f_name, f_ext = os.path.splitext(tfile)
-
-    c_action_system('   Escaping garbage characters')
-
-    gc_file = "{0}_gc~".format(tfile)
-
-    # Convert gc file without none ascii chars
-    clean_ascii(tfile, gc_file)
-
-    if not os.path.exists(gc_file):
-        raise ValueError("Not finish clean file.")
-
-    # Load gc file
-
-    F = open(gc_file, 'rb')
-    dialect = None
-
-    if guess:
-        #c_action_system('   Guessing delimiter \n')
-        try:
-            dialect, csv_column_count = guess_delimeter(F)
-        except TypeError as e:
-            print "Guessing delimiter failed, aborting."
-        except ValueError as e:
-            print "Blank file, aborting."
-
-    if not dialect and args.p:
-        return
-    elif not dialect:
-        dialect = csv.excel
-        dialect.delimiter = args.d.decode('string_escape')
-        csv_column_count = args.c
+    f_name, f_ext = os.path.splitext(strip_compression(tfile))
+
+    # Garbage characters are removed while reading, compressed files are
+    # decompressed
+    F = AsciiFile(open_file(tfile))
+    compressed = compressed_bytes(F) is not None
+    # Compressed files can only be read from the start, so aren't sharded
+    sharded = args.workers > 1 and not compressed
+
+    # Serial runs to uncompressed outputs save checkpoints to resume from
+    checkpoint = None
+    resumed = None
+    if not sharded and not args.compress:
+        checkpoint = Checkpoint(tfile, 'clean')
+        if args.resume:
+            resumed = checkpoint.resume()
+            if not resumed:
+                c_warning('{}: No checkpoint to resume from'.format(tfile))
+
+    if resumed:
+        c_action_info('{}: Resuming from byte {}'.format(
+            tfile, resumed['offset']))
+        dialect = type('ResumedDialect', (csv.Dialect, object),
+                       resumed['dialect'])
+        csv_column_count = resumed['column_count']
+    else:
+        dialect = None
+
+        if guess:
+            dialect, csv_column_count = find_dialect(F)
+
+        if guess and not dialect and plan is not None:
+            c_warning('{} has no delimiter in the plan, passing'.format(tfile))
+            F.close()
+            return []
+        elif not dialect and args.p:
+            F.close()
+            return []
+        elif not dialect:
+            dialect = csv.excel
+            dialect.delimiter = args.d.decode('string_escape')
+            csv_column_count = args.c
 
     c_sys_success('Using column number [{}] and delimiter [{}]\n'.format(
         csv_column_count, repr(dialect.delimiter)))
@@ -1074,69 +1380,138 @@ def parse_file(tfile):
     F.seek(0)
 
     out_file_csv_name = f_name + '_cleaned.csv'
+    if args.compress:
+        out_file_csv_name += '.' + args.compress
     out_file_csv_temp = out_file_csv_name + '~'
     out_file_err_name = f_name + '_error.csv'
     out_file_err_temp = out_file_err_name + '~'
 
-    out_file_csv_file = open(out_file_csv_temp, 'wb')
-
-    l_count = 0
-    headers = set_headers(F, dialect, csv_column_count)
-    headers = clean_headers(headers)
-    if headers:
-        write_headers(out_file_csv_file, headers)
-        l_count += 1
+    # With -cj, cleaned rows go straight to JSON and the cleaned CSV is
+    # only written when asked for. Shards are cleaned to CSV first.
+    fused = args.cj and not sharded
+    keep_csv = not fused or args.keep_csv
+    if keep_csv:
+        # Resumed outputs were truncated to the checkpoint
+        out_file_csv_file = open_output(out_file_csv_temp, append=bool(resumed),
+                                        kind=args.compress)
+
+    if resumed:
+        headers = resumed['headers']
+        l_count = resumed['lines']
+        F.seek(resumed['offset'])
+    else:
+        l_count = 0
+        headers = set_headers(F, dialect, csv_column_count)
+        headers = clean_headers(headers)
+        if headers:
+            if keep_csv:
+                write_headers(out_file_csv_file, headers)
+            l_count += 1
 
     pbar = TqdmUpTo(
-        desc='Writing ', unit=' bytes ', total=os.path.getsize(gc_file))
-
-    # Load result files
-    error_file = io.open(out_file_err_temp, 'w', encoding='utf-8')
-
-    # Load clean dialect
-    clean_dialect = myDialect()
-
-    # Init clean write
-    clean_writer = UnicodeWriter(out_file_csv_file, dialect=clean_dialect)
-
-    # Loop line
-    for line in F:
-        # Remove Spaces before and afer delimeter
-        line = re.sub(r'(?:(?<=\%s) | (?=\%s))' % (dialect.delimiter, dialect.delimiter),'',line)
-        l_count += 1
-
-        cleaned_row, failed_row = parse_row(line, csv_column_count, dialect)
-
-        if failed_row:
-            error_file.write(unicode(failed_row))
-        else:
-            clean_writer.writerow(
-                remove_quote(cleaned_row)
-            )
-
-        pbar.update_to(clean_writer.tell() + error_file.tell())
+        desc='Writing ', unit=' bytes ', total=os.path.getsize(tfile))
+    pbar.update_to(F.tell())
+
+    if sharded:
+        # Clean newline aligned shards of the file in parallel and merge
+        # the outputs back in order
+        start = F.tell()
+        F.close()
+        out_file_csv_file.close()
+        parse_shards(tfile, start, out_file_csv_temp, out_file_err_temp,
+                     csv_column_count, dialect, pbar)
+    else:
+        # Load result files
+        error_file = open(out_file_err_temp, 'ab' if resumed else 'wb')
+
+        # Load clean dialect
+        clean_dialect = myDialect()
+
+        # Init clean write
+        clean_writer = None
+        if keep_csv:
+            clean_writer = csv_writer(out_file_csv_file, dialect=clean_dialect)
+
+        # Init row parser
+        row_parser = RowParser(dialect, csv_column_count)
+
+        json_writer = None
+        if fused:
+            print "Writing json file for", out_file_csv_name
+            json_writer = JsonWriter(out_file_csv_name, clean_writer)
+            if resumed:
+                json_writer.line_count = resumed['records']
+                if resumed['json_headers'] is not None:
+                    json_writer.set_headers(resumed['json_headers'])
+            elif headers:
+                json_writer.set_headers(headers)
+
+        def save_checkpoint():
+            """Save how far the file is cleaned, once outputs are written."""
+            error_file.flush()
+            outputs = [out_file_err_temp]
+            if keep_csv:
+                clean_writer.flush()
+                out_file_csv_file.flush()
+                outputs.append(out_file_csv_temp)
+            records = None
+            json_headers = None
+            if json_writer:
+                outputs.extend(json_writer.write_out())
+                records = json_writer.line_count
+                json_headers = json_writer.source_headers
+            checkpoint.save(
+                F.tell(), outputs, lines=l_count, headers=headers,
+                column_count=csv_column_count, records=records,
+                json_headers=json_headers,
+                dialect={attr: getattr(dialect, attr)
+                         for attr in DIALECT_ATTRS})
+
+        # Rows go straight to JSON with -cj
+        row_writer = json_writer or clean_writer
+
+        # Loop line
+        for line in F:
+            l_count += 1
+            row_parser.clean(line, row_writer, error_file)
+            if not l_count % PROGRESS_LINES:
+                if fused or compressed or args.compress:
+                    pbar.update_to(read_position(F))
+                else:
+                    pbar.update_to(clean_writer.tell() + error_file.tell())
+                if checkpoint and checkpoint.due():
+                    save_checkpoint()
+
+        if json_writer:
+            json_writer.close()
+        F.close()
+        if keep_csv:
+            clean_writer.flush()
+            out_file_csv_file.close()
+        error_file.close()
+        pbar.update_to(pbar.total)
+        if checkpoint:
+            checkpoint.remove()
 
     pbar.close()
 
-    F.close()
-    out_file_csv_file.close()
-    error_file.close()
-
-    output_stats = os.stat(out_file_csv_temp)
     errors_stats = os.stat(out_file_err_temp)
 
-    c_action_info('Output file {} had {} bytes written/'.format(
-        out_file_csv_temp, output_stats.st_size))
+    if keep_csv:
+        output_stats = os.stat(out_file_csv_temp)
+        c_action_info('Output file {} had {} bytes written/'.format(
+            out_file_csv_temp, output_stats.st_size))
     c_action_info('Error file {} had {} bytes written/'.format(
         out_file_err_temp, errors_stats.st_size))
 
+    moves = []
     if headers:
-        move(tfile, DIRS['headers_success'])
+        moves.append((tfile, DIRS['headers_success']))
     else:
-        move(tfile, DIRS['clean_success'])
+        moves.append((tfile, DIRS['clean_success']))
 
     if errors_stats.st_size > 0:
-        move(out_file_err_temp, DIRS['clean_fail'])
+        moves.append((out_file_err_temp, DIRS['clean_fail']))
     else:
         os.remove(out_file_err_temp)
 
@@ -1151,31 +1526,76 @@ def parse_file(tfile):
         # Move cleaned file to success
         #move(out_file_csv_name, DIRS['json_success'])
 
-    if args.j:
+    if args.cj and not fused:
         write_json(out_file_csv_name)
+        if not args.keep_csv:
+            os.remove(out_file_csv_name)
 
-    # Print "Removing", gc_file
-    os.remove(gc_file)
+    return moves
 
 
-def parse_row(line, csv_column_count, dialect):
-    """Parses row and returns a cleaned or failed row."""
-    line_buffer = StringIO.StringIO()
-    line_buffer.write(line)
-    line_buffer.seek(0)
+def clean_shard(task):
+    """Clean one byte range of a file into its own output and error files.
 
-    orig_reader = UnicodeReader(line_buffer, dialect=dialect)
+    Runs inside a worker process, returns the number of bytes processed.
+    """
+    (path, start, end, csv_name, err_name, csv_column_count,
+     attrs) = task
+    # Sniffed dialects can't be pickled, so rebuild it from its attributes
+    dialect = type('ShardDialect', (csv.Dialect, object), attrs)
+
+    with open(path, 'rb') as F, open(csv_name, 'wb') as out_file, \
+            open(err_name, 'wb') as error_file:
+        clean_writer = csv_writer(out_file, dialect=myDialect())
+        row_parser = RowParser(dialect, csv_column_count)
+        for line in iter_range(F, start, end):
+            line = filter_ascii(line)
+            # A last line made only of garbage has nothing left to clean
+            if not line:
+                continue
+            row_parser.clean(line, clean_writer, error_file)
+        clean_writer.flush()
+    return end - start
 
-    row_escaped = orig_reader.next()
 
-    if len(row_escaped) == csv_column_count:
-        return row_escaped, None
-    if args.m and csv_column_count > 1:
-        lx = row_escaped[:csv_column_count - 1]
-        lt = dialect.delimiter.join(row_escaped[csv_column_count - 1:])
-        lx.append(lt)
-        return lx, None
-    return None, line
+def parse_shards(path, start, out_file_csv_temp, out_file_err_temp,
+                 csv_column_count, dialect, pbar):
+    """Clean a file from the "start" offset with a pool of workers.
+
+    The output of every shard is appended to the cleaned and error files in
+    the same order as the source, so the result is identical to a serial run.
+    """
+    ranges = line_ranges(path, start, args.workers * SHARDS_PER_WORKER)
+    attrs = {attr: getattr(dialect, attr) for attr in DIALECT_ATTRS}
+    tasks = [
+        (path, begin, end,
+         '{}.{}~'.format(out_file_csv_temp, index),
+         '{}.{}~'.format(out_file_err_temp, index),
+         csv_column_count, attrs)
+        for index, (begin, end) in enumerate(ranges)
+    ]
+
+    pool = multiprocessing.Pool(args.workers)
+    try:
+        for processed in pool.imap(clean_shard, tasks):
+            pbar.update(processed)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    with open_output(out_file_csv_temp, append=True,
+                     kind=args.compress) as out_file_csv_file:
+        concat_files(out_file_csv_file, [task[3] for task in tasks])
+    with open(out_file_err_temp, 'wb') as error_file:
+        concat_files(error_file, [task[4] for task in tasks])
+
+
+def parse_row(line, csv_column_count, dialect):
+    """Parses row and returns a cleaned or failed row."""
+    return RowParser(dialect, csv_column_count).parse(line)
 
 
 def write_headers(f, headers):
@@ -1214,20 +1634,52 @@ def print_hash_columns(columns):
     for column in columns:
         c_warning('Hash Detected: Column #{}'.format(column))
 
+def print_header_confidences(headers, confidences):
+    for column, (header, confidence) in enumerate(
+            zip(headers, confidences), 1):
+        if confidence < 1:
+            c_warning('Header Uncertain: Column #{} {} ({:.0%})'.format(
+                column, header, confidence))
+
 def set_headers(f, dialect, csv_column_count=0):
     headers = []
     if args.sh:
         headers = args.sh.split(',')
+    elif (args.ah or args.fh) and plan is not None:
+        decision = plan.lookup(f.name)
+        if decision and 'headers' in decision:
+            headers = decision['headers']
+            if headers:
+                c_warning('Headers to be used: {}'.format(' '.join(headers)))
+        else:
+            c_warning('Headers not found in the plan for {}\n'.format(f.name))
     elif args.ah or args.fh:
+        memo = get_memo()
+        if memo:
+            fingerprint, signature = memo_keys(f)
+            # Headers forced with -fh are reused without confirmation
+            decision = memo.recall('headers', fingerprint, signature,
+                                   confirmed_only=not args.fh)
+            if decision is not None:
+                c_success('Headers remembered for {}\n'.format(f.name))
+                print_hash_columns(decision['hash_columns'])
+                if decision['headers']:
+                    c_warning('Headers to be used: {}'.format(
+                        ' '.join(decision['headers'])))
+                f.seek(0)
+                return decision['headers']
+
         if not csv_column_count:
             csv_column_count = find_column_count(f)
         f.seek(0)
-        headers = get_headers(f, dialect.delimiter, csv_column_count)
+        headers, confidences = get_headers(
+            f, dialect.delimiter, csv_column_count, with_confidence=True)
         headers = clean_headers(headers)
         print_lines(f, 30)
+        print_header_confidences(headers, confidences)
 
         # Detect hash columns
-        hash_columns = detect_hash_columns(f, dialect.delimiter, 30)
+        hash_columns = detect_hash_columns(f, dialect.delimiter, 100)
         print_hash_columns(hash_columns)
 
         if args.fh:
@@ -1252,6 +1704,12 @@ def set_headers(f, dialect, csv_column_count=0):
                     headers = ask_headers(csv_column_count)
                     headers = clean_headers(headers)
                     break
+
+        if memo:
+            memo.remember('headers', fingerprint, signature, {
+                'headers': headers,
+                'hash_columns': hash_columns,
+            }, confirmed=not args.fh)
     return headers
 
 
@@ -1277,7 +1735,7 @@ def is_sqldump(file_path):
     )
 
     try:
-        with open(file_path, 'rb') as file:
+        with open_file(file_path) as file:
             text = file.read(100000)
     except IOError:
         return
@@ -1309,66 +1767,279 @@ def scan_json_merge(source_folder, dest_folder):
         )
     )
 
-    # Init release pool
-    release_pool = {}
+    # Init release pool, release names are cached in the source folder
+    releases = ReleaseCache(source_folder)
+    release_pool = OrderedDict()
     for file_path in all_files:
-        with open(file_path, "rb") as file:
-            item = json.loads(file.readline())
+        release_name = releases.release(file_path)
 
-            # Load release name
-            release_name = item.get("_source").get("r").replace(" ", "_")
+        # Add to release pool
+        release_pool.setdefault(release_name, []).append(file_path)
+    releases.save()
 
-            # Add to release pool
-            if release_pool.get(release_name):
-                release_pool[release_name].append(file_path)
-            else:
-                release_pool[release_name] = [file_path]
-
-    # Start merging or copy
+    # Start merging or copy, releases are independent of each other
+    tasks = []
     for release_name, list_file in release_pool.items():
         if len(list_file) == 1:
             # Load copy path
-            copy_path = os.path.join(
+            dest_path = os.path.join(
                 dest_folder,
                 os.path.basename(list_file[0])
             )
-            # Do copy
-            copyfile(list_file[0],copy_path)
-            print("Finish copy %s into %s" % (list_file[0], copy_path))
         else:
             # Load release path
-            release_path = os.path.join(
+            dest_path = os.path.join(
                 dest_folder,
                 "%s.json" % release_name
             )
+        tasks.append((dest_path, release_name) + tuple(list_file))
+    run_files(merge_task, tasks, merge_size)
+
+
+def merge_task(dest_path, release_name, *paths):
+    """Copy the JSON files of a release into one file at dest_path."""
+    records = None
+    if args.dedup:
+        records_path = os.path.join(
+            os.path.dirname(dest_path), '.{}.seen~'.format(release_name))
+        if os.path.exists(records_path):
+            os.remove(records_path)
+        records = RecordSet(records_path, dedup_fields())
+
+    with open(dest_path, "wb") as release_file:
+        for file_path in paths:
+            with open(file_path, "rb") as file:
+                if records:
+                    # Records are read one by one to skip duplicates
+                    release_file.writelines(
+                        line for line in file
+                        if not line.strip() or
+                        records.add(json.loads(line)['_source']))
+                else:
+                    copyfileobj(file, release_file, COPY_BUFFER)
 
-            # If release path exist than remove
-            if os.path.exists(release_path):
-                os.remove(release_path)
-
-            # Start merging
-            for file_path in list_file:
-                with open(file_path, "rb") as file:
-                    with open(release_path, "a+") as release_file:
-                        file.seek(0)
-                        while True:
-                            line = file.readline()
-                            if not line:
-                                break
-                            release_file.write(line)
-
+            if len(paths) == 1:
+                print("Finish copy %s into %s" % (file_path, dest_path))
+            else:
                 print(file_path)
                 print(release_name)
                 print("Finish merge %s into %s" % (file_path, release_name))
 
+    if records:
+        records.close()
+        os.remove(records_path)
+        report_duplicates(release_name, records)
+    return []
+
+
+def merge_size(task):
+    return sum(file_size((path,)) for path in task[2:])
+
+
+def run_files(function, tasks, size=file_size):
+    """Run function(*task) for every task and make the moves it returns.
+
+    Tasks run in order in this process, or largest first in a pool of
+    --jobs processes. Files of failed tasks are left in place.
+    """
+    if args.jobs > 1:
+        results = run_jobs(function, tasks, args.jobs, size)
+    else:
+        results = ((task[0], True, function(*task)) for task in tasks)
+
+    for path, success, result in results:
+        if not success:
+            c_failure('{}: {}'.format(path, result))
+            continue
+        for moved_path, dest_dir in result:
+            move(moved_path, dest_dir)
+
+
+def clean_task(filename, number, total):
+    """Clean file number "number" of "total" files."""
+    fdirname = os.path.dirname(filename)
+    fbasename = os.path.basename(filename)
+    clean_name = []
+
+    for char in fbasename:
+        if char in "&+@'":
+            clean_name.append('_')
+        else:
+            clean_name.append(char)
+    new_basename = ''.join(clean_name)
+
+    if new_basename != fbasename:
+        new_filename = os.path.join(fdirname, new_basename)
+        os.rename(filename, new_filename)
+        filename = new_filename
+
+    c_darkgray('------------------------------------------')
+
+    c_action_info('File {}/{}'.format(number, total))
+    c_action('Processing {}'.format(filename))
+
+    if os.path.exists(filename):
+        if os.stat(filename).st_size > 0:
+            return parse_file(filename)
+        else:
+            print "File {} is empty, passing".format(filename)
+    else:
+        c_warning('Unable to find file {}'.format(filename))
+    return []
+
+
+def headers_task(filepath):
+    """Write a file with headers added in front of it."""
+    headers = []
+    c_action_info('{}: Checking for headers'.format(filepath))
+    with open_file(filepath) as cf:
+        headers = set_headers(cf, myDialect())
+        if headers:
+            c_sys_success(
+                '{}: Headers found, writing new file'.format(filepath))
+            pbar = TqdmUpTo(
+                total=os.path.getsize(filepath), unit=' bytes')
+            # Compressed files are written back compressed the same way
+            with open_output(filepath + '~',
+                             kind=compression(filepath)) as new_csv:
+                write_headers(new_csv, headers)
+                pbar.update_to(new_csv.tell())
+                for line in cf:
+                    new_csv.write(line)
+                    pbar.update_to(new_csv.tell())
+            pbar.close()
+            c_action_info('{}: New file written'.format(filepath))
+    if headers:
+        c_action_info('{}: Moving to {}/'.format(
+            filepath, DIRS['headers_success']))
+        os.rename(filepath + '~', filepath)
+        return [(filepath, DIRS['headers_success'])]
+    c_warning('{}: Skipping setting headers, moving to {}/'.format(
+        filepath, DIRS['headers_skip']))
+    return [(filepath, DIRS['headers_skip'])]
+
+
+def json_task(*paths):
+    """Write the JSON of cleaned files, in order."""
+    moves = []
+    for path in paths:
+        write_json(path)
+        moves.append((path, DIRS['json_done']))
+    return moves
+
+
+def json_size(task):
+    return sum(file_size((path,)) for path in task)
+
+
+def organize_task(path):
+    """Find the directory of a file by its number of columns."""
+    with open_file(path) as f:
+        column_count = find_column_count(f)
+    if column_count <= 10:
+        existing_dir = os.path.dirname(path)
+        new_dir = '{}col'.format(column_count)
+        new_path = os.path.join(existing_dir, new_dir)
+        c_action_system('Moving {} to {}'.format(path, new_path))
+        return [(path, new_path)]
+    c_warning('{} has {} columns, skipping'.format(path, column_count))
+    return []
+
+
+def sample_task(path):
+    c_action_info('\nSampling {}'.format(path))
+    create_sample(path, args.scl, args.sci, DIRS['sample'],
+                  approximate=args.sa)
+    return []
+
+
+def index_task(path):
+    """Build the line index of a file, unless it has one."""
+    c_action_info('{}: Indexing lines'.format(path))
+    pbar = TqdmUpTo(desc='Indexing', unit=' bytes',
+                    total=os.path.getsize(path))
+    index = LineIndex.for_file(path, pbar)
+    pbar.close()
+    c_sys_success('{}: {} lines indexed'.format(path, index.line_count))
+    return []
+
+
+def show_lines(path, first, last):
+    """Print lines first to last (counted from 1) of a file, seeking to
+    them with its line index."""
+    index = LineIndex.for_file(path)
+    c_action_info('{}: Lines {} to {} of {}'.format(
+        path, first, min(last, index.line_count), index.line_count))
+    c_darkgray('-' * 20)
+    with open_file(path) as f:
+        for _, line in index.read_lines(f, xrange(first - 1, last)):
+            sys.stdout.write(line)
+    c_darkgray('-' * 20)
+
+
+def sql_task(sf):
+    try:
+        # Garbage characters are removed while parsing
+        parse_sql.parse(sf, ascii_only=True, resume=args.resume,
+                        workers=args.workers)
+    except Exception as error:
+        c_failure('ERROR: {}'.format(str(error)))
+        return [(sf, DIRS['sql_fail'])]
+    return [(sf, DIRS['sql_success'])]
+
+
+def plan_files(files, plan_path):
+    """Ask the questions for every file and write the answers to a plan.
+
+    Cleaning plans have the dialect and column count of the files, -ah and
+    -fh plans their headers.
+    """
+    new_plan = Plan()
+    nf = len(files)
+    for fc, filepath in enumerate(files, 1):
+        c_darkgray('------------------------------------------')
+        c_action_info('File {}/{}'.format(fc, nf))
+        c_action('Planning {}'.format(filepath))
+        if args.ah or args.fh:
+            with open_file(filepath) as cf:
+                headers = set_headers(cf, myDialect())
+            new_plan.plan_file(filepath, headers=headers)
+            continue
+
+        F = AsciiFile(open_file(filepath))
+        dialect, csv_column_count = find_dialect(F)
+        F.close()
+        if dialect:
+            new_plan.plan_file(filepath, dialect={
+                attr: getattr(dialect, attr) for attr in DIALECT_ATTRS
+            }, column_count=csv_column_count)
+        else:
+            c_warning('{}: No delimiter, not planned'.format(filepath))
+
+    new_plan.save(plan_path)
+    c_sys_success('Plan for {} file(s) written to {}'.format(
+        len(new_plan.entries), plan_path))
+
 
 def main():
-    dialect = myDialect()
+    global plan
+
+    if args.execute:
+        plan = Plan.load(args.execute)
+        # Files of the plan are processed when no path is given
+        if not args.path:
+            args.path = [path for path in plan.paths()
+                         if os.path.exists(path)]
 
     if len(args.path) == 0 and not args.jm:
         help_message = """
-            usage: datacleaner.py [-h] [-a] [-ah] [-fh] [-c C] [-cl] [-d D] [-j] [--importdate DATE] [-m] [-o] [-p]
-                                  [-jm] [-r R] [-s] [-sci SCI] [-scl SCL] [-sh SH]
+            usage: datacleaner.py [-h] [-a] [-ah] [-fh] [-c C] [-cl] [-d D] [-j] [-cj] [--keep-csv]
+                                  [--importdate DATE] [-m] [-o] [-p] [-jm] [-r R] [-s] [-sa] [-sci SCI] [-scl SCL]
+                                  [-sh SH] [--workers WORKERS]
+                                  [--jobs JOBS] [--no-memo] [--plan PLAN | --execute PLAN]
+                                  [--dedup] [--dedup-fields FIELDS]
+                                  [--compress {bz2,gz,xz,zst}] [--index | --lines FIRST-LAST]
+                                  [--resume]
                                   [path [path ...]]
 
             positional arguments:
@@ -1383,6 +2054,8 @@ def main():
               -cl                   Cleanse filename(s) of unwanted text. No file cleaning.
               -d D                  Delimiter
               -j                    Write JSON file. No file cleaning.
+              -cj                   Clean files and write their JSON file in one pass
+              --keep-csv            Also write the cleaned CSV with -cj
               --importdate DATE     Add import date to each line of the resulting json - Valid format YYYY-MM-DD
               -m                    Merge remaining columns into last
               -o                    Organize CSVs by column number
@@ -1390,16 +2063,69 @@ def main():
               -jm                   Merge similar csv into list json
               -r R                  Release Name
               -s                    Create sample of csv(s). No file cleaning.
+              -sa                   Sample from random offsets, estimating the line count from the file size
               -sci SCI              Sampling Confidence interval (float) [default: 3.0]
               -scl SCL              Sampling Confidence level required (percent) [default: 95]
               -sh SH                Specify headers to use for multiple files. No file cleaning.
+              --workers WORKERS     Number of processes used to clean or parse a single file [default: 1]
+              --jobs JOBS           Number of files processed at the same time [default: 1, number of CPUs with -s]
+              --no-memo             Don't reuse or remember delimiter and header decisions
+              --plan PLAN           Ask delimiter and header questions for all files and write them to a plan file. No file cleaning.
+              --execute PLAN        Process files with the decisions of a plan file, without asking
+              --dedup               Skip duplicate records with -j, -cj and -jm
+              --dedup-fields FIELDS Fields identifying duplicate records [default: all but the import date]
+              --compress {bz2,gz,xz,zst}
+                                    Compress the cleaned CSV and JSON files written
+              --index               Index the line offsets of files for --lines and -s. No file cleaning.
+              --lines FIRST-LAST    Print lines FIRST to LAST of files, counted from 1 with the headers. No file cleaning.
+              --resume              Resume the cleaning, JSON or SQL parsing of files from their last checkpoint
   """
         print(help_message)
         return
 
+    if args.jobs > 1:
+        # Worker processes of the pool can't start pools of their own
+        if args.workers > 1:
+            c_warning('Warning: --workers is ignored with --jobs')
+            args.workers = 1
+    # Only cleaning and -ah/-fh ask questions
+    cleaning = not (args.cl or args.jm or args.sh or args.ah or args.fh
+                    or args.j or args.o or args.s or args.index or args.lines)
+    if args.jobs > 1 and not args.plan and not args.execute:
+        # Questions can't be asked from worker processes
+        if cleaning and guess and not args.a:
+            print "Warning: Argument --jobs needs -a, -c and -d, or --execute"
+            sys.exit(0)
+        if args.ah:
+            print "Warning: Argument -ah with --jobs needs --execute"
+            sys.exit(0)
+    if args.jobs > 1 and args.dedup and args.cj:
+        # Jobs may append to the same JSON file at the same time
+        print "Warning: Argument --dedup with -cj can't be used with --jobs"
+        sys.exit(0)
+    if args.resume:
+        # Resuming truncates outputs, only done for outputs of one writer
+        if args.compress:
+            print "Warning: Argument --resume can't be used with --compress"
+            sys.exit(0)
+        if args.workers > 1:
+            print "Warning: Argument --resume can't be used with --workers"
+            sys.exit(0)
+        if args.jobs > 1 and args.cj:
+            print "Warning: Argument --resume with -cj can't be used with --jobs"
+            sys.exit(0)
+
     files = gather_files(args.path, DIRS['skipped'])
     nonsql_files = [x for x in files if not is_sqldump(x)]
 
+    if args.plan:
+        if not (cleaning or args.ah or args.fh):
+            print "Warning: Argument --plan is for cleaning, -ah and -fh"
+            sys.exit(0)
+        plan_files([x for x in nonsql_files if '_cleaned' not in x],
+                   args.plan)
+        return
+
     if args.cl:
         print 'Cleaning filenames...'
         for file in files:
@@ -1427,100 +2153,41 @@ def main():
 
         scan_json_merge(source_folder, dest_folder)
     elif args.sh or args.ah or args.fh:
-        for filepath in nonsql_files:
-            headers = []
-            c_action_info('{}: Checking for headers'.format(filepath))
-            with open(filepath, 'rb') as cf:
-                headers = set_headers(cf, dialect)
-                if headers:
-                    c_sys_success(
-                        '{}: Headers found, writing new file'.format(filepath))
-                    pbar = TqdmUpTo(
-                        total=os.path.getsize(filepath), unit=' bytes')
-                    with open(filepath + '~', 'wb') as new_csv:
-                        write_headers(new_csv, headers)
-                        pbar.update_to(new_csv.tell())
-                        for line in cf:
-                            new_csv.write(line)
-                            pbar.update_to(new_csv.tell())
-                    pbar.close()
-                    c_action_info('{}: New file written'.format(filepath))
-            if headers:
-                c_action_info('{}: Moving to {}/'.format(
-                    filepath, DIRS['headers_success']))
-                os.rename(filepath + '~', filepath)
-                move(filepath, DIRS['headers_success'])
-            else:
-                c_warning('{}: Skipping setting headers, moving to {}/'.format(
-                    filepath, DIRS['headers_skip']))
-                move(filepath, DIRS['headers_skip'])
+        run_files(headers_task, [(filepath,) for filepath in nonsql_files])
     elif args.j:
         if not nonsql_files:
             c_failure('No non-sql files found to write json for')
-        for cf in nonsql_files:
-            write_json(cf)
-            move(cf, DIRS['json_done'])
+        if args.jobs > 1:
+            # Files appended to the same JSON file are written by one job
+            groups = OrderedDict()
+            for cf in nonsql_files:
+                groups.setdefault(json_name(cf), []).append(cf)
+            tasks = [tuple(paths) for paths in groups.values()]
+        else:
+            tasks = [(cf,) for cf in nonsql_files]
+        run_files(json_task, tasks, json_size)
     elif args.o:
-        for path in nonsql_files:
-            with open(path, 'rb') as f:
-                column_count = find_column_count(f)
-            if column_count <= 10:
-                existing_dir = os.path.dirname(path)
-                new_dir = '{}col'.format(column_count)
-                new_path = os.path.join(existing_dir, new_dir)
-                c_action_system('Moving {} to {}'.format(path, new_path))
-                move(path, new_path)
-            else:
-                c_warning('{} has {} columns, skipping'.format(
-                    path, column_count))
+        run_files(organize_task, [(path,) for path in nonsql_files])
     elif args.s:
         c_action_system('Creating samples of CSV(s)\n')
-        for path in nonsql_files:
-            c_action_info('\nSampling {}'.format(path))
-            create_sample(path, args.scl, args.sci, DIRS['sample'])
+        run_files(sample_task, [(path,) for path in nonsql_files])
+    elif args.index:
+        run_files(index_task, [(path,) for path in files])
+    elif args.lines:
+        for path in files:
+            show_lines(path, *args.lines)
     elif files:
         if nonsql_files:
             print
             c_lightgray('PARSING TXT and CSV FILES')
             c_darkgray('-------------------------')
 
-            fc = 0
-            nf = len(nonsql_files)
-        for filename in nonsql_files:
-            # Skip files with _cleaned in filename
-            if '_cleaned' in filename:
-                continue
-            # print "\n \033[1;34mProcessing", f
-            # print "\033[0m"
-            fdirname = os.path.dirname(filename)
-            fbasename = os.path.basename(filename)
-            clean_name = []
-
-            for char in fbasename:
-                if char in "&+@'":
-                    clean_name.append('_')
-                else:
-                    clean_name.append(char)
-            new_basename = ''.join(clean_name)
-
-            if new_basename != fbasename:
-                new_filename = os.path.join(fdirname, new_basename)
-                os.rename(filename, new_filename)
-                filename = new_filename
-
-            fc += 1
-            c_darkgray('------------------------------------------')
-
-            c_action_info('File {}/{}'.format(fc, nf))
-            c_action('Processing {}'.format(filename))
-
-            if os.path.exists(filename):
-                if os.stat(filename).st_size > 0:
-                    parse_file(filename)
-                else:
-                    print "File {} is empty, passing".format(filename)
-            else:
-                c_warning('Unable to find file {}'.format(filename))
+        # Skip files with _cleaned in filename
+        tasks = [filename for filename in nonsql_files
+                 if '_cleaned' not in filename]
+        nf = len(nonsql_files)
+        run_files(clean_task, [
+            (filename, fc, nf) for fc, filename in enumerate(tasks, 1)])
 
         sql_files = [x for x in files if is_sqldump(x)]
         if sql_files:
@@ -1528,31 +2195,11 @@ def main():
             c_action('PARSING SQL FILES')
             c_darkgray('------------------------------------------\n')
 
-        for sf in sql_files:
-
-            # Load file cleaned of ascii
-            gf = os.path.join(
-                os.path.dirname(sf),
-                "~%s" % os.path.basename(sf)
-            )
-            clean_ascii(sf, gf)
-
-            # Clean old ascii file
-            os.remove(sf)
-
-            # Rename gf to sf
-            os.rename(gf, sf)
-
-            try:
-                parse_sql.parse(sf)
-            except KeyboardInterrupt:
-                c_warning('Control-c pressed...')
-                sys.exit(138)
-            except Exception as error:
-                move(sf, DIRS['sql_fail'])
-                c_failure('ERROR: {}'.format(str(error)))
-            else:
-                move(sf, DIRS['sql_success'])
+        try:
+            run_files(sql_task, [(sf,) for sf in sql_files])
+        except KeyboardInterrupt:
+            c_warning('Control-c pressed...')
+            sys.exit(138)
 
 
 if __name__ == "__main__":
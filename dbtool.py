@@ -3,8 +3,8 @@
 
 Usage:
   dbtool.py --showtables <file_path>
-  dbtool.py --extract <file_path> --tables=tables [--encoding=enc]
-  dbtool.py --extract <file_path> --tables=tables [--schema] [--encoding=enc]
+  dbtool.py --extract <file_path> --tables=tables [--encoding=enc] [--resume]
+  dbtool.py --extract <file_path> --tables=tables [--schema] [--encoding=enc] [--resume]
   dbtool.py --mergeuser [--exit-on-error] [--user_id=user_id] [--pm_id=pm_id] [--pm_file_path=pm_file_path] <user_file_path> <csv_file_path>
   dbtool.py --json --type=type [--exit-on-error] [--forum=forum] \
     [--topic=topic] [--recipient=recipient] [--pm=pm] \
@@ -15,6 +15,7 @@ Options:
   --version                 Show version.
   --schema                  Export only schema
   --encoding=enc            Encoding for sql parser
+  --resume                  Resume extracting from the last checkpoint
   --exit-on-error           Exit if error happen
   --input=input             Input for csv to json
   --forum=forum             Input for post csv to json
@@ -29,6 +30,7 @@ import sys
 
 from docopt import docopt
 from tqdm import tqdm
+from dbtools.fileio import compressed_bytes, open_file
 from dbtools.sql_to_csv import parse
 from dbtools.merge_user import (
     read_users,
@@ -240,12 +242,17 @@ def show_tables(**kwargs):
         unit_scale=True
     )
 
-    # Load sql dump
-    with open(filepath, "rb") as f:
+    # Load sql dump, decompressing it if needed
+    with open_file(filepath) as f:
+        compressed = compressed_bytes(f) is not None
         # Iterate over line of sql dump
         for line in f:
-            # Update iteration process over sql dump
-            pbar.update(len(line))
+            # Update iteration process over sql dump, in compressed bytes
+            # for compressed dumps
+            if compressed:
+                pbar.update(compressed_bytes(f) - pbar.n)
+            else:
+                pbar.update(len(line))
 
             # If line not have create table, continue
             if not line.startswith("CREATE TABLE"):
@@ -290,7 +297,8 @@ def main(args):
             filepath=args.get("<file_path>"),
             tables=args.get("--tables"),
             encoding=args.get("--encoding"),
-            schema_only=args.get("--schema")
+            schema_only=args.get("--schema"),
+            resume=args.get("--resume")
         )
 
     # Handle merge user csv
@@ -0,0 +1,165 @@
+"""Detection of the encoding of dumps while they are read.
+
+Dumps are mostly ASCII, with their text in UTF-8 or in a single byte
+encoding, sometimes in both when tables were dumped at different times.
+Russian dumps often hold cp1251 text read as latin1 and saved in UTF-8,
+mojibake where Cyrillic letters show as accented latin letters, which the
+README converts with iconv.
+
+Every chunk of bytes is decoded on its own, with one of the READINGS:
+as UTF-8 when it's valid UTF-8, repaired when its text reads as cp1251
+mojibake, or in the single byte encoding its bytes look the most like.
+Letters are the evidence: words of at least three cp1251 letters, read
+as cp1251 or latin1, count for cp1251, and accented latin1 letters alone
+between other characters count for latin1. Chunks with too little evidence
+of their own are decoded with the reading with the best score, the
+evidence of the chunks decoded before them.
+"""
+from __future__ import division
+
+import re
+
+# Ways of decoding chunks, and their descriptions
+READINGS = (
+    ('utf-8', 'utf-8'),
+    ('mojibake', 'cp1251 read as latin1 in utf-8'),
+    ('iso-8859-1', 'iso-8859-1'),
+    ('cp1251', 'cp1251'),
+)
+
+# Letters a chunk needs to be decoded on its own evidence
+EVIDENCE = 3
+
+# cp1251 letters in a row, in cp1251 bytes or decoded as latin1. Words of
+# at least three are rare in languages using latin1, and letters alone are
+# rare in Russian.
+LETTERS = re.compile(r'[\xa8\xb8\xc0-\xff]+')
+
+# Characters latin1 can't encode
+NOT_LATIN1 = re.compile(u'[^\x00-\xff]')
+
+# Words with Cyrillic letters, with the latin letters mixed in them
+CYRILLIC_WORDS = re.compile(
+    u'[a-zA-Z]*[\u0400-\u04ff]+(?:[a-zA-Z]+[\u0400-\u04ff]+)*[a-zA-Z]*')
+NOT_CYRILLIC = re.compile(u'[^\u0400-\u04ff]+')
+
+# Share of Cyrillic letters in the repaired words with some for mojibake,
+# accented latin text repairs to words mixing latin and Cyrillic letters
+CYRILLIC_SHARE = 0.9
+
+# Bytes of non ASCII characters, removed by str.translate
+HIGH = ''.join(chr(c) for c in range(0x80, 0x100))
+
+
+def incomplete_utf8(data):
+    """Return the length of the incomplete UTF-8 sequence ending data."""
+    for length in range(1, min(4, len(data)) + 1):
+        byte = ord(data[-length])
+        if byte < 0x80:
+            return 0
+        if byte >= 0xc0:
+            needed = 2 if byte < 0xe0 else 3 if byte < 0xf0 else 4
+            return length if length < needed else 0
+    return 0
+
+
+def cyrillic(text):
+    """Return whether the words of text with Cyrillic letters are almost
+    only made of them."""
+    words = u''.join(CYRILLIC_WORDS.findall(text))
+    found = len(NOT_CYRILLIC.sub(u'', words))
+    return bool(words) and found >= CYRILLIC_SHARE * len(words)
+
+
+def letters(text):
+    """Return the letters of text in cp1251 words, and the letters alone."""
+    runs = map(len, LETTERS.findall(text))
+    return sum(length for length in runs if length >= 3), runs.count(1)
+
+
+class ChunkDecoder(object):
+    """Decodes the chunks of a dump, each one with the reading the most
+    likely for it.
+
+    scores holds the evidence found for every reading, counted in letters,
+    and can be given to go on with the scores of an earlier run. Chunks
+    can end in the middle of a character when they aren't final, the end
+    of the character being at the start of the next chunk.
+
+    Valid UTF-8 is only repaired when its repaired words are almost only
+    Cyrillic and the scores agree, so a chunk of accented latin names
+    can't override the UTF-8 read before it.
+    """
+
+    def __init__(self, scores=None):
+        self.scores = dict((name, 0) for name, _ in READINGS)
+        self.scores.update(scores or {})
+        self.pending = ''
+
+    def decode(self, chunk, final=True):
+        """Return the text of chunk (str)."""
+        data = self.pending + chunk
+        self.pending = ''
+        if not final:
+            length = incomplete_utf8(data)
+            if length:
+                data, self.pending = data[:-length], data[-length:]
+        try:
+            return data.decode('ascii')
+        except UnicodeDecodeError:
+            pass
+
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            cp1251, latin1 = letters(data)
+            votes = {'cp1251': cp1251, 'iso-8859-1': latin1}
+            reading = self.choose(votes, ('iso-8859-1', 'cp1251'))
+            # cp1251 leaves one byte undefined
+            return data.decode(reading, 'replace')
+
+        # Text latin1 can't encode can only be UTF-8
+        votes = {'utf-8': len(text) - len(data.translate(None, HIGH))}
+        readings = ('utf-8',)
+        if not NOT_LATIN1.search(text):
+            repaired = self.repair(text)
+            if repaired is not None and cyrillic(repaired):
+                mojibake, utf8 = letters(text)
+                votes = {'utf-8': utf8, 'mojibake': mojibake}
+                readings = ('utf-8', 'mojibake')
+        if self.choose(votes, readings) == 'mojibake' and \
+                self.scores['mojibake'] >= self.scores['utf-8']:
+            return repaired
+        return text
+
+    def repair(self, text):
+        """Return the cp1251 text of mojibake text, None when it isn't
+        cp1251."""
+        try:
+            return text.encode('iso-8859-1').decode('cp1251')
+        except UnicodeDecodeError:
+            return None
+
+    def choose(self, votes, readings):
+        """Return the reading for a chunk with votes, one of readings."""
+        for name, count in votes.items():
+            self.scores[name] += count
+        best = max(readings, key=votes.get)
+        if votes[best] >= EVIDENCE:
+            return best
+        # The first of readings is the default, when none has evidence
+        return max(readings, key=self.scores.get)
+
+    def reset(self):
+        """Forget the incomplete character at the end of the last chunk,
+        when the next chunk doesn't follow it."""
+        self.pending = ''
+
+    def describe(self):
+        """Return the readings with evidence and their share of it."""
+        total = sum(self.scores.values())
+        if not total:
+            return 'ascii'
+        return ', '.join(
+            '{} {:.0%}'.format(description, self.scores[name] / total)
+            for name, description in READINGS if self.scores[name])
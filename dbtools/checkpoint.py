@@ -0,0 +1,107 @@
+"""Checkpoints of long runs over one input file, to resume them.
+
+A checkpoint records how far the input was read, the size of every output
+file at that point and the counters of the run. Runs save one every
+INTERVAL seconds, at points where all the output of the input read so far
+has been written. Resuming truncates the outputs to their recorded sizes,
+so nothing written after the checkpoint is duplicated, and reads the input
+on from the recorded offset.
+
+Checkpoints are kept next to their input as .<name>.<stage>.checkpoint,
+are only used for the input they were saved for, by fingerprint, and are
+removed once the run completes. Outputs are flushed but not synced, so a
+checkpoint survives the process dying, not the machine: outputs found
+shorter than recorded can't be resumed.
+"""
+import json
+import os
+import time
+
+from fileio import file_fingerprint
+from jsonio import to_str
+
+# Seconds between two checkpoints
+INTERVAL = 30
+
+
+def checkpoint_path(path, stage):
+    """Return the path of the checkpoint of a stage run on the file at
+    path."""
+    folder, name = os.path.split(path)
+    return os.path.join(folder, '.{}.{}.checkpoint'.format(name, stage))
+
+
+def output_size(path):
+    """Return the size of an output file, 0 when it isn't created yet."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class Checkpoint(object):
+    """Checkpoints of one stage run on one input file.
+
+    Parameters:
+        path: input file path (str)
+        stage: name of the run, as several can be run on a file (str)
+    """
+
+    def __init__(self, path, stage):
+        self.path = checkpoint_path(path, stage)
+        self.fingerprint = file_fingerprint(path)
+        self.saved = time.time()
+
+    def load(self):
+        """Return the state saved for the input, None when there is none."""
+        try:
+            with open(self.path, 'rb') as f:
+                state = to_str(json.load(f))
+        except (IOError, ValueError):
+            return None
+        if state.get('fingerprint') != self.fingerprint:
+            return None
+        return state
+
+    def resume(self):
+        """Truncate the outputs to the last checkpoint and return its state,
+        None when there is no checkpoint it can be resumed from."""
+        state = self.load()
+        if state is None:
+            return None
+        for path, size in state['outputs'].items():
+            if output_size(path) < size:
+                return None
+        for path, size in state['outputs'].items():
+            if os.path.exists(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+        return state
+
+    def due(self):
+        """Return True when the next checkpoint should be saved."""
+        return time.time() - self.saved >= INTERVAL
+
+    def save(self, offset, outputs, **state):
+        """Save a checkpoint.
+
+        Parameters:
+            offset: offset of the input up to which outputs are written
+            outputs: paths of the output files, flushed, or not created yet
+                (list of str)
+            state: counters and decisions needed to resume (JSON values)
+        """
+        state.update(
+            fingerprint=self.fingerprint,
+            offset=offset,
+            outputs={path: output_size(path) for path in outputs})
+        temp_path = self.path + '~'
+        with open(temp_path, 'wb') as f:
+            json.dump(state, f)
+        os.rename(temp_path, self.path)
+        self.saved = time.time()
+
+    def remove(self):
+        """Remove the checkpoint once the run is complete."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,452 @@
+"""Transparent reading and writing of compressed files.
+
+Compressed inputs (gzip, bzip2, xz, zstd, zip) are recognised by their
+first bytes and decompressed while they are read, by the command line tool
+in its own process when installed (pigz, lbzip2, xz, zstd...), otherwise by
+the Python module in a helper thread. The compressed file is fed to the
+decompressor by a thread counting the compressed bytes consumed, which is
+what progress bars should show since the decompressed size isn't known.
+
+Decompressed files support seek() by skipping forward, or by decompressing
+again from the start when seeking backward, so detection code can still
+rewind to the start of a file.
+
+Outputs are compressed according to their extension, or to the kind given.
+Runs writing to many outputs keep them open in a pool of bounded size.
+"""
+import bz2
+import collections
+import fcntl
+import gzip
+import hashlib
+import io
+import os
+import subprocess
+import threading
+import zipfile
+import zlib
+from distutils.spawn import find_executable
+
+# First bytes of compressed files, bzip2 ones are checked further by
+# is_bzip2 since they are printable text
+MAGIC = (
+    ('\x1f\x8b', 'gz'),
+    ('BZh', 'bz2'),
+    ('\xfd7zXZ\x00', 'xz'),
+    ('\x28\xb5\x2f\xfd', 'zst'),
+    ('PK\x03\x04', 'zip'),
+)
+
+# Magic of the first block of a bzip2 stream, or of its end when empty
+BZIP2_BLOCKS = ('1AY&SY', '\x17rE8P\x90')
+
+# Extensions of compressed files
+EXTENSIONS = {
+    '.gz': 'gz',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.zst': 'zst',
+    '.zip': 'zip',
+}
+
+# Commands decompressing stdin to stdout, the first one installed is used
+DECOMPRESSORS = {
+    'gz': (('pigz', '-dc'), ('gzip', '-dc')),
+    'bz2': (('lbzip2', '-dc'), ('pbzip2', '-dc'), ('bzip2', '-dc')),
+    'xz': (('xz', '-dc'),),
+    'zst': (('zstd', '-dcq'),),
+}
+
+# Commands compressing stdin to stdout
+COMPRESSORS = {
+    'gz': (('pigz', '-c'), ('gzip', '-c')),
+    'bz2': (('lbzip2', '-c'), ('pbzip2', '-c'), ('bzip2', '-c')),
+    'xz': (('xz', '-c'),),
+    'zst': (('zstd', '-cq'),),
+}
+
+# Size of the blocks fed to decompressors
+BLOCK_SIZE = 1024 * 1024
+
+# Output files kept open by a pool
+POOL_SIZE = 128
+
+
+def find_command(commands):
+    """Return the first of commands which is installed, None if none is."""
+    for command in commands:
+        if find_executable(command[0]):
+            return list(command)
+    return None
+
+
+def compression(path):
+    """Return the compression of the file at path, None when it's plain."""
+    with open(path, 'rb') as f:
+        head = f.read(10)
+    for magic, kind in MAGIC:
+        if head.startswith(magic):
+            if kind == 'bz2' and not is_bzip2(path, head):
+                continue
+            return kind
+    return None
+
+
+def is_bzip2(path, head):
+    """Return whether the file at path starting with head, which starts
+    like bzip2, is bzip2: "BZh" is followed by the block size, 1 to 9, and
+    the magic of a block, or the file has the bzip2 extension."""
+    if len(head) < 4 or head[3] not in '123456789':
+        return False
+    return head[4:10] in BZIP2_BLOCKS or \
+        EXTENSIONS.get(os.path.splitext(path)[1].lower()) == 'bz2'
+
+
+def file_fingerprint(path, size=64 * 1024):
+    """Identify the content of a file without reading all of it.
+
+    Combines size, modification time and a hash of the first and last
+    "size" bytes, so renamed or moved files keep their fingerprint.
+    """
+    stat = os.stat(path)
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        digest.update(f.read(size))
+        if stat.st_size > size:
+            f.seek(max(size, stat.st_size - size))
+            digest.update(f.read(size))
+    return '{}-{}-{}'.format(
+        stat.st_size, int(stat.st_mtime), digest.hexdigest())
+
+
+def strip_compression(path):
+    """Return path without the extension of a compressed file."""
+    base, ext = os.path.splitext(path)
+    if ext.lower() in EXTENSIONS:
+        return base
+    return path
+
+
+class DecompressedFile(io.RawIOBase):
+    """Decompressed content of a compressed file, read sequentially.
+
+    Parameters:
+        path: compressed file path (str)
+        kind: compression, one of the values of EXTENSIONS (str)
+    """
+
+    def __init__(self, path, kind):
+        self.name = path
+        self.kind = kind
+        self.command = find_command(DECOMPRESSORS.get(kind, ()))
+        if not self.command and kind not in ('gz', 'bz2', 'zip'):
+            raise IOError('{}: No {} decompressor installed'.format(
+                path, kind))
+        self._open()
+
+    def _open(self):
+        self.consumed = 0
+        self.position = 0
+        self.error = None
+        self.process = None
+        self.source = open(self.name, 'rb')
+        if self.command:
+            self.process = subprocess.Popen(
+                self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                close_fds=True)
+            self.fd = self.process.stdout.fileno()
+            target, sink = self._feed, self.process.stdin
+        else:
+            self.fd, write_fd = os.pipe()
+            target, sink = self._decompress, os.fdopen(write_fd, 'wb')
+        self.thread = threading.Thread(target=target, args=(sink,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _blocks(self):
+        """Yield the blocks of the compressed file, counting them."""
+        while True:
+            block = self.source.read(BLOCK_SIZE)
+            if not block:
+                return
+            self.consumed += len(block)
+            yield block
+
+    def _feed(self, sink):
+        """Copy the compressed file to the decompressor process."""
+        try:
+            for block in self._blocks():
+                sink.write(block)
+        except IOError:
+            # The reader was closed before the end of the file
+            pass
+        finally:
+            try:
+                sink.close()
+            except IOError:
+                pass
+
+    def _decompress(self, sink):
+        """Decompress the file with the Python modules."""
+        try:
+            if self.kind == 'zip':
+                with zipfile.ZipFile(self.source) as archive:
+                    member = archive.open(archive.namelist()[0])
+                    while True:
+                        data = member.read(BLOCK_SIZE)
+                        if not data:
+                            break
+                        self.consumed = self.source.tell()
+                        sink.write(data)
+            else:
+                decompressor = None
+                for block in self._blocks():
+                    # Concatenated streams are decompressed one after another
+                    while block:
+                        if decompressor is None:
+                            decompressor = self._decompressor()
+                        sink.write(decompressor.decompress(block))
+                        block = decompressor.unused_data
+                        if block or self._ended(decompressor):
+                            decompressor = None
+        except IOError:
+            pass
+        except Exception as error:
+            self.error = error
+        finally:
+            try:
+                sink.close()
+            except IOError:
+                pass
+
+    def _decompressor(self):
+        if self.kind == 'gz':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return bz2.BZ2Decompressor()
+
+    def _ended(self, decompressor):
+        if self.kind == 'gz':
+            return False
+        try:
+            decompressor.decompress('')
+        except EOFError:
+            return True
+        return False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        data = os.read(self.fd, len(b))
+        if not data:
+            self._check()
+        b[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def _check(self):
+        """Raise the error of the decompressor once all is read."""
+        if self.process and self.process.wait():
+            raise IOError('{}: {} failed with status {}'.format(
+                self.name, self.command[0], self.process.returncode))
+        if self.error:
+            raise IOError('{}: {}'.format(self.name, self.error))
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            raise IOError('Seeking from the end of a compressed file')
+        if offset < self.position:
+            self._close()
+            self._open()
+        while self.position < offset:
+            data = os.read(self.fd, min(BLOCK_SIZE, offset - self.position))
+            if not data:
+                break
+            self.position += len(data)
+        return self.position
+
+    def _close(self):
+        if self.process:
+            self.process.stdout.close()
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process.wait()
+        else:
+            os.close(self.fd)
+        self.thread.join()
+        self.source.close()
+
+    def close(self):
+        if not self.closed:
+            self._close()
+        super(DecompressedFile, self).close()
+
+
+def open_file(path, buffer_size=BLOCK_SIZE):
+    """Open a file for reading in binary mode, decompressing it if needed."""
+    kind = compression(path)
+    if not kind:
+        return open(path, 'rb')
+    return io.BufferedReader(DecompressedFile(path, kind), buffer_size)
+
+
+def compressed_bytes(f):
+    """Return the compressed bytes read from f, None when it isn't
+    compressed. f can be wrapped in text or filtering file objects."""
+    while f is not None:
+        if isinstance(f, DecompressedFile):
+            return f.consumed
+        f = getattr(f, 'buffer', None) or getattr(f, 'raw', None) or \
+            getattr(f, 'f', None)
+    return None
+
+
+def read_position(f):
+    """Return the bytes read from file f, compressed bytes when it's
+    compressed, to compare with its size."""
+    consumed = compressed_bytes(f)
+    if consumed is None:
+        return f.tell()
+    return consumed
+
+
+class CompressedOutput(object):
+    """File object compressing what is written to file f.
+
+    Parameters:
+        f: file opened for writing the compressed data
+        kind: compression, one of the values of EXTENSIONS (str)
+    """
+
+    def __init__(self, f, kind):
+        self.f = f
+        self.name = f.name
+        command = find_command(COMPRESSORS.get(kind, ()))
+        self.process = None
+        if command:
+            self.process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=f, close_fds=True)
+            self.stream = self.process.stdin
+        elif kind == 'gz':
+            self.stream = gzip.GzipFile(fileobj=f, mode='wb')
+        elif kind == 'bz2':
+            self.stream = CompressorStream(f, bz2.BZ2Compressor())
+        else:
+            raise IOError('{}: No {} compressor installed'.format(
+                self.name, kind))
+
+    def write(self, data):
+        self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def tell(self):
+        return self.f.tell()
+
+    def close(self):
+        self.stream.close()
+        if self.process and self.process.wait():
+            raise IOError('{}: compression failed with status {}'.format(
+                self.name, self.process.returncode))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CompressorStream(object):
+    """Writes data compressed by a compressor object to file f."""
+
+    def __init__(self, f, compressor):
+        self.f = f
+        self.compressor = compressor
+
+    def write(self, data):
+        self.f.write(self.compressor.compress(data))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.f.write(self.compressor.flush())
+
+
+def open_output(path, append=False, kind=None, lock=False):
+    """Open a file for writing in binary mode.
+
+    The data is compressed when kind is given, or when the extension of path
+    is the one of a compression. Appending to a compressed file adds a
+    stream after the existing ones, which decompressors read in turn.
+    With lock, the file is locked until closed, so processes appending to
+    the same file don't mix their streams.
+    """
+    kind = kind or EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    f = open(path, 'ab' if append else 'wb')
+    if lock:
+        fcntl.flock(f, fcntl.LOCK_EX)
+    if not kind:
+        return f
+    return CompressedOutput(f, kind)
+
+
+class OutputPool(object):
+    """Output files kept open for writing, at most size of them at a time.
+
+    Files are opened by opener(path, append), which returns a file object,
+    the least recently used one is closed when too many are open. A file is
+    created the first time it's opened and appended to afterwards, files of
+    written are appended to from the first time.
+
+    Parameters:
+        opener: function opening a file for writing
+        size: most files open at a time (int)
+        written: paths of files already written to (iterable of str)
+    """
+
+    def __init__(self, opener, size=POOL_SIZE, written=()):
+        self.opener = opener
+        self.size = size
+        self.written = set(written)
+        self.files = collections.OrderedDict()
+
+    def get(self, path):
+        """Return the file at path, opened for writing."""
+        f = self.files.pop(path, None)
+        if f is None:
+            if len(self.files) >= self.size:
+                _, oldest = self.files.popitem(last=False)
+                oldest.close()
+            f = self.opener(path, path in self.written)
+            self.written.add(path)
+        self.files[path] = f
+        return f
+
+    def flush(self):
+        """Flush the open files, for their size to be the size written."""
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        while self.files:
+            self.files.popitem()[1].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
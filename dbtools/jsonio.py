@@ -0,0 +1,94 @@
+"""Buffered writing of newline delimited JSON records.
+
+Records are encoded with ujson when it is installed and compact separators
+are asked for, otherwise with one encoder of the json module built once for
+all records. Encoded records are written to the file in large blocks.
+Decoded records can be converted back to str with to_str().
+"""
+import fcntl
+import json
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# Separators without spaces, the only ones ujson writes
+COMPACT = (',', ':')
+
+# Bytes of encoded records kept before writing them to the file
+WRITE_BUFFER = 1024 * 1024
+
+
+def to_str(value):
+    """Encode the unicode strings of a decoded JSON value to UTF-8 str."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [to_str(v) for v in value]
+    if isinstance(value, dict):
+        return {to_str(k): to_str(v) for k, v in value.items()}
+    return value
+
+
+def make_encoder(separators=None):
+    """Return a function encoding a record as a JSON str.
+
+    The json module encoder writes the same str as json.dumps(record,
+    separators=separators), ujson writes the same JSON.
+    """
+    if ujson is not None and separators is not None and \
+            tuple(separators) == COMPACT:
+        return lambda record: ujson.dumps(
+            record, ensure_ascii=True, escape_forward_slashes=False)
+    return json.JSONEncoder(separators=separators).encode
+
+
+class JsonLinesWriter(object):
+    """Writes one JSON record per line to file f.
+
+    Parameters:
+        f: file opened for writing
+        separators: item and key separators, as for json.dumps (tuple)
+        buffer_size: bytes kept before writing them to f (int)
+        lock: lock f while writing, for files appended to by several
+            processes at once (bool)
+    """
+
+    def __init__(self, f, separators=None, buffer_size=WRITE_BUFFER,
+                 lock=False):
+        self.f = f
+        self.encode = make_encoder(separators)
+        self.buffer_size = buffer_size
+        self.lock = lock
+        self.queue = []
+        self.queued = 0
+
+    def write(self, record):
+        line = self.encode(record) + '\n'
+        self.queue.append(line)
+        self.queued += len(line)
+        if self.queued >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.queue:
+            return
+        if self.lock:
+            # Blocks of other processes go before or after this one
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+            try:
+                self.f.write(''.join(self.queue))
+                self.f.flush()
+            finally:
+                fcntl.flock(self.f, fcntl.LOCK_UN)
+        else:
+            self.f.write(''.join(self.queue))
+        self.queue = []
+        self.queued = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
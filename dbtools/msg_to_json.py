@@ -19,7 +19,6 @@ Examples:
 from __future__ import division, print_function
 
 import io
-import json
 import os
 import re
 import sys
@@ -27,6 +26,7 @@ from collections import Counter
 
 from docopt import docopt
 
+from jsonio import JsonLinesWriter
 from utils import csv_reader, replace_quotes
 
 __version__ = '0.1.0'
@@ -148,7 +148,8 @@ def msg_to_json(filepath, forum, topics):
         user_no = fieldnames.index(users[0])
 
         basepath = os.path.splitext(filepath)[0]
-        with open(basepath + '.json', 'wb') as outfile:
+        with open(basepath + '.json', 'wb') as outfile, \
+                JsonLinesWriter(outfile, separators=(',', ':')) as writer:
             for row in reader:
                 row = map(replace_quotes, row)
                 pid = row[pid_no]
@@ -158,7 +159,7 @@ def msg_to_json(filepath, forum, topics):
                 else:
                     topic = row[topic_name_no]
 
-                outfile.write(json.dumps({
+                writer.write({
                     "_type":"forums",
                     "_source": {
                         "type":"post",
@@ -170,7 +171,7 @@ def msg_to_json(filepath, forum, topics):
                         "pid": replace_quotes(pid),
                         "cid": post_comments[pid]
                     }
-                }, separators=(',', ':')) + '\n')
+                })
                 post_comments[pid] += 1
 
 
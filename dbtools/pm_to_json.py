@@ -21,7 +21,6 @@ Examples:
 from __future__ import division, print_function
 
 import io
-import json
 import os
 import re
 import sys
@@ -29,6 +28,7 @@ from collections import Counter
 
 from docopt import docopt
 
+from jsonio import JsonLinesWriter
 from utils import csv_reader, replace_quotes
 
 __version__ = '0.1.0'
@@ -180,7 +180,8 @@ def msg_to_json(filepath, pm_recipients, pmtext_pms):
         user_no = fieldnames.index(users[0])
 
         basepath = os.path.splitext(filepath)[0]
-        with open(basepath + '.json', 'wb') as outfile:
+        with open(basepath + '.json', 'wb') as outfile, \
+                JsonLinesWriter(outfile, separators=(',', ':')) as writer:
             for row in reader:
                 row = map(replace_quotes, row)
                 pid = row[pid_no]
@@ -193,7 +194,7 @@ def msg_to_json(filepath, pm_recipients, pmtext_pms):
                 # if not recipients:
                 #     print('WARN: Recipient not found for pm_id {}'.format(pid))
 
-                outfile.write(json.dumps({
+                writer.write({
                     "_type": "forums",
                     "_source": {
                         "type":"pm",
@@ -205,7 +206,7 @@ def msg_to_json(filepath, pm_recipients, pmtext_pms):
                         "pid": replace_quotes(pid),
                         "cid": post_comments[pid]
                     }
-                }, separators=(',', ':')) + '\n')
+                })
                 post_comments[pid] += 1
 
 
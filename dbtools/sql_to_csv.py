@@ -5,13 +5,14 @@ Will output CSV file for each found table in utf-8 encoding with comma
 separator. File names argument can be a list of files or wildcard.
 
 Usage:
-    sql_to_csv.py [-hV] [--encoding=ENC] [--tables=RE] SQLFILES...
+    sql_to_csv.py [-hV] [--encoding=ENC] [--tables=RE] [--resume] SQLFILES...
 
 Options:
     -h, --help                    This help output
     -V, --version                 Print version and exit
     --encoding=ENC                Encoding [default: latin1]
     --tables=RE                   RegExp for matching table names
+    --resume                      Resume from the last checkpoint
 
 Examples:
     sql_to_csv.py mysql.sql
@@ -30,6 +31,9 @@ from sqlparse import tokens
 from sqlparse.lexer import tokenize
 from tqdm import tqdm
 
+from checkpoint import Checkpoint
+from fileio import compressed_bytes, open_file, strip_compression
+from sqlsplit import LinePieces, split_values
 from utils import pair_quotes, replace_quotes, splitlines
 
 __version__ = '0.1.0'
@@ -43,6 +47,12 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+# Statements longer than this are parsed by batches of rows
+STREAM_SIZE = 10 * 1024 * 1024
+# Bytes read at a time from long statements
+CHUNK_SIZE = 1024 * 1024
+
+
 class CreateTable():
     table = 0
     columns = 1
@@ -185,9 +195,14 @@ def csv_line(row):
     return line.replace('\r', '\\r').replace('\n', '\\n') + '\n'
 
 
+def csv_path(sqlpath, table):
+    """Return the path of the CSV file of a table of a dump."""
+    path = os.path.splitext(strip_compression(sqlpath))[0]
+    return '%s.%s.csv' % (path, table)
+
+
 def write_csv(sqlpath, table, columns, values, encoding='utf-8'):
-    path = os.path.splitext(sqlpath)[0]
-    filepath = '%s.%s.csv' % (path, table)
+    filepath = csv_path(sqlpath, table)
 
     if columns:
         with io.open(filepath, 'w', encoding=encoding) as f:
@@ -202,7 +217,7 @@ def write_csv(sqlpath, table, columns, values, encoding='utf-8'):
     return lines
 
 
-def parse(filepath, tables, encoding, schema_only=False):
+def parse(filepath, tables, encoding, schema_only=False, resume=False):
     if tables:
         tables_re = re.compile(
             r'.*?(%s).*?' % tables.replace(",", "|"),
@@ -214,14 +229,69 @@ def parse(filepath, tables, encoding, schema_only=False):
     statement = None
     total_tables = 0
     total_lines = 0
+    # Bytes of the dump read, decompressed
+    offset = 0
+    # CSV files written, truncated when resuming
+    outputs = set()
+
+    checkpoint = Checkpoint(filepath, 'csv')
+    if resume:
+        state = checkpoint.resume()
+        if state:
+            offset = state['offset']
+            outputs.update(state['outputs'])
+            total_tables = state['tables']
+            total_lines = state['lines']
+            print('  Resuming from byte %d' % offset)
+        else:
+            print('  No checkpoint to resume from')
+
+    def save(start):
+        """Save a checkpoint at the "start" offset, where all statements
+        before it are written."""
+        checkpoint.save(start, sorted(outputs), tables=total_tables,
+                        lines=total_lines)
+
+    def before_write(table):
+        """Checkpoint before the first write to the CSV file of a table, so
+        its size before is known when resuming."""
+        path = csv_path(filepath, table)
+        if path not in outputs:
+            outputs.add(path)
+            save(offset - len(lines))
+
+    def write_rows(parser):
+        """Write the rows of an insert or copy to the CSV file of its
+        table, if selected."""
+        table, columns = next(parser)
+        if not tables or tables_re.match(table):
+            before_write(table)
+            return write_csv(filepath, table, None, parser)
+        return 0
+
+    def progress():
+        if compressed:
+            pbar.update(compressed_bytes(f) - pbar.n)
+        else:
+            pbar.update(pieces.position - pbar.n)
 
     pbar = tqdm(desc='Parsing %s' % filepath, total=os.path.getsize(filepath),
                 unit='b', unit_scale=True)
-    with open(filepath, 'rb') as f:
-        for line in f:
-            pbar.update(len(line))
+    with open_file(filepath) as f:
+        # Compressed dumps show the progress of the compressed bytes read
+        compressed = compressed_bytes(f) is not None
+        if offset:
+            f.seek(offset)
+        # Long lines are read by pieces
+        pieces = LinePieces(f, STREAM_SIZE, offset)
+        progress()
+        for line in pieces:
+            offset = pieces.position
+            progress()
 
             if statement is None:
+                if not pieces.starts_line:
+                    continue
                 if line.startswith('CREATE TABLE'):
                     statement = CreateTable
                 else:
@@ -238,44 +308,60 @@ def parse(filepath, tables, encoding, schema_only=False):
 
             if statement == InsertInto:
                 if not line.endswith((');\n', ');\r\n')):
-                    continue
-                prev_quote = pair_quotes(line, prev_quote)
-                if prev_quote:
-                    continue
-                parser = InsertInto.parse(lines, encoding)
-
-                table, columns = next(parser)
-                if not tables or tables_re.match(table):
-                    total_lines += write_csv(filepath, table, None, parser)
+                    if len(lines) < STREAM_SIZE:
+                        continue
+                    # The rest of a long insert is read by chunks and its
+                    # rows are parsed by batches
+                    chunks = pieces.chunks(CHUNK_SIZE)
+                    for batch in split_values(lines, chunks):
+                        total_lines += write_rows(
+                            InsertInto.parse(batch, encoding))
+                        progress()
+                    offset = pieces.skip_line()
+                    prev_quote = None
+                else:
+                    prev_quote = pair_quotes(line, prev_quote)
+                    if prev_quote:
+                        continue
+                    total_lines += write_rows(
+                        InsertInto.parse(lines, encoding))
 
             elif statement == Copy:
                 if not line.startswith('\\.'):
+                    if len(lines) >= STREAM_SIZE and pieces.ends_line:
+                        # Rows of long copies are parsed by batches, after
+                        # the line of the statement
+                        head = lines[:lines.index('\n') + 1]
+                        total_lines += write_rows(
+                            Copy.parse(lines + '\\.\n', encoding))
+                        lines = head
                     continue
-                parser = Copy.parse(lines, encoding)
-                table, columns = next(parser)
-
-                if not tables or tables_re.match(table):
-                    total_lines += write_csv(filepath, table, None, parser)
+                total_lines += write_rows(Copy.parse(lines, encoding))
 
             elif statement == CreateTable:
                 if not line.endswith((';\n', ';\r\n')):
                     continue
                 table, columns = CreateTable.parse(lines, encoding)
                 if not tables or tables_re.match(table):
+                    before_write(table)
                     write_csv(filepath, table, columns, None)
                     total_tables += 1
 
             lines = ''
             statement = None
+            if checkpoint.due():
+                save(offset)
 
     pbar.close()
+    checkpoint.remove()
     print('  Found %d table(s), %d value line(s).' %
           (total_tables, total_lines))
 
 
 def main(args):
     for filepath in args['SQLFILES']:
-        parse(filepath, args['--tables'], args['--encoding'])
+        parse(filepath, args['--tables'], args['--encoding'],
+              resume=args['--resume'])
 
 
 if __name__ == '__main__':
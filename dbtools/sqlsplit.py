@@ -0,0 +1,178 @@
+"""Splitting of SQL dumps into statements.
+
+Statements end at the first semicolon outside of quoted strings. Quoted
+strings are skipped whole, with their backslash escapes, by a regular
+expression, so a statement is found at the speed of the regular
+expression engine whatever its length and the number of lines it spans.
+Doubled quotes need no special case: they read as two strings in a row.
+
+Works on str, buffer or mmap data of dumps in encodings where ASCII
+characters are single bytes that never appear inside other characters.
+
+Long inserts are split in batches of their value tuples, read from chunks
+of text, so the memory used depends on the size of the batches and of the
+largest tuple instead of the size of the statement.
+"""
+import re
+
+# Whitespace between tokens
+WHITESPACE = r'[ \t\r\n]*'
+
+# Characters of WHITESPACE
+SPACES = ' \t\r\n'
+
+# Quoted strings with their backslash escapes
+QUOTED = r''''[^'\\]*(?:\\.[^'\\]*)*'|"[^"\\]*(?:\\.[^"\\]*)*"'''
+
+# A value tuple: other characters, quoted strings and parenthesis nested
+# once, such as the ones of function calls
+TUPLE = r'''\( [^'"()]* (?:
+    (?: {0} | \( [^'"()]* (?: (?:{0}) [^'"()]* )* \) )
+    [^'"()]*
+)* \)'''.format(QUOTED)
+
+# Value tuples each followed by a comma and the start of the next one, a
+# bounded number at a time like STATEMENT_TEXT
+TUPLES = re.compile(r'(?:{0}{1},{1}(?=\()){{0,1000}}'.format(
+    TUPLE, WHITESPACE), re.DOTALL | re.VERBOSE)
+
+# The last value tuple of an insert and its semicolon
+LAST_TUPLE = re.compile(r'{0}{1};'.format(TUPLE, WHITESPACE),
+                        re.DOTALL | re.VERBOSE)
+
+# Start of the first value tuple of an insert
+VALUES_START = re.compile(r'\bVALUES{0}(?=\()'.format(WHITESPACE))
+
+# Characters of the value tuples in a batch of split_values
+BATCH_SIZE = 1024 * 1024
+
+# Text of a statement up to its semicolon or to a quote left open: other
+# characters and whole quoted strings, a bounded number of strings at a
+# time to keep the memory used by the regular expression engine bounded
+STATEMENT_TEXT = re.compile(r'''[^'";]*(?:
+    (?:
+        '[^'\\]*(?:\\.[^'\\]*)*'
+      | "[^"\\]*(?:\\.[^"\\]*)*"
+    )
+    [^'";]*
+){0,1000}''', re.DOTALL | re.VERBOSE)
+
+
+def statement_end(data, pos):
+    """Return the offset after the semicolon ending the statement at pos
+    in data, -1 when the statement doesn't end before the end of data."""
+    size = len(data)
+    while pos < size:
+        end = STATEMENT_TEXT.match(data, pos).end()
+        if end < size and data[end] == ';':
+            return end + 1
+        if end == pos:
+            # A quoted string isn't closed
+            return -1
+        pos = end
+    return -1
+
+
+def split_values(head, chunks):
+    """Yield the value tuples of a long insert by batches, each one as an
+    insert of its own.
+
+    head is the start of the insert and chunks an iterator of the parts of
+    its text following it. Batches are the start of the insert up to its
+    first tuple, about BATCH_SIZE characters of tuples and a semicolon.
+    Chunks are read up to the one with the end of the insert, text after
+    it in that chunk is ignored. Tuples which can't be read, such as tuples
+    nesting parenthesis more than once, are left to the parser of the
+    batches with the rest of the insert.
+    """
+    match = VALUES_START.search(head)
+    # Without tuples, the whole insert is left to the parser
+    start = match.end() if match else 0
+    prefix = head[:start]
+    text = head[start:]
+    pos = 0
+    # Tuples of the batch, with the separator after them
+    batch = []
+    length = 0
+    exhausted = False
+    while True:
+        end = TUPLES.match(text, pos).end()
+        if end > pos:
+            batch.append(text[pos:end])
+            length += end - pos
+            pos = end
+            if length >= BATCH_SIZE:
+                yield prefix + ''.join(batch).rstrip(SPACES)[:-1] + ';'
+                batch = []
+                length = 0
+            continue
+        match = LAST_TUPLE.match(text, pos)
+        if match:
+            batch.append(text[pos:match.end()])
+            yield prefix + ''.join(batch)
+            return
+        end = statement_end(text, pos)
+        if end >= 0 or exhausted:
+            # Not a tuple, or an insert without end
+            batch.append(text[pos:end] if end >= 0 else text[pos:])
+            yield prefix + ''.join(batch)
+            return
+        # The tuple isn't complete, the text read is doubled, so long tuples
+        # are matched a bounded number of times, but not past a semicolon
+        # which can end the insert
+        parts = [text[pos:]]
+        missing = len(parts[0])
+        for chunk in chunks:
+            parts.append(chunk)
+            missing -= len(chunk)
+            if missing <= 0 or ';' in chunk:
+                break
+        else:
+            exhausted = True
+        text = ''.join(parts)
+        pos = 0
+
+
+class LinePieces(object):
+    """Lines of file f, long lines read by pieces of at most size
+    characters, so reading a line doesn't depend on its length.
+
+    position is the offset after the last piece read, counted from the
+    position given, starts_line and ends_line tell whether the last piece
+    starts and ends a line.
+    """
+
+    def __init__(self, f, size, position=0):
+        self.f = f
+        self.size = size
+        self.position = position
+        self.starts_line = True
+        self.ends_line = True
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        piece = self.read(self.size)
+        if not piece:
+            raise StopIteration
+        return piece
+
+    def read(self, size):
+        """Return the next piece of at most size characters."""
+        piece = self.f.readline(size)
+        self.position += len(piece)
+        self.starts_line = self.ends_line
+        self.ends_line = piece.endswith('\n')
+        return piece
+
+    def chunks(self, size):
+        """Return an iterator of the next pieces of at most size
+        characters."""
+        return iter(lambda: self.read(size), '')
+
+    def skip_line(self):
+        """Skip the rest of the current line and return the position."""
+        while not self.ends_line and self.read(self.size):
+            pass
+        return self.position
@@ -0,0 +1,76 @@
+"""Fast scanning of the value tuples of INSERT statements.
+
+The scanner reads the literals of MySQL and Postgres dumps with regular
+expressions: numbers, bare words such as NULL, and single or double quoted
+strings with backslash escapes and doubled quotes. It returns the values
+as the VALUES grammar of parse_sql does, strings without their quotes and
+with their escapes kept, and rejects anything else (expressions, function
+calls, exponents, missing commas...) so the caller parses those statements
+with the grammar instead.
+"""
+import re
+
+# Whitespace skipped between tokens, as by pyparsing
+WHITESPACE = r'[ \t\r\n]*'
+
+# Body of a quoted string, matched as far as it goes like pyparsing's
+# quotedString does (a lookahead can't be backtracked into), then closed
+STRING = r'''(?=(?P<{1}>(?:[^{0}\n\r\\]+|{0}{0}|\\(?:[^x]|x[0-9a-fA-F]+))*))
+    (?P={1}){0}'''
+
+# A value followed by the comma or parenthesis after it, and by the start
+# of the next tuple after a parenthesis. The groups are the whole match,
+# the value (bare, single or double quoted), the end and the next tuple.
+VALUE = re.compile(r"""({ws}(?:
+    (?P<bare>
+        [+-]?(?:[0-9]+\.[0-9]*|\.[0-9]+|[0-9]+)
+      | [A-Za-z][A-Za-z0-9]*
+    )
+  | '{single}
+  | "{double}
+){ws}(?P<end>,|\)(?P<next>{ws},{ws}\()?))""".format(
+    ws=WHITESPACE,
+    single=STRING.format("'", 'single'),
+    double=STRING.format('"', 'double')), re.VERBOSE)
+
+# Start of the first tuple
+VALUES_START = re.compile(r'VALUES' + WHITESPACE + r'\(')
+
+# Characters of WHITESPACE
+SPACES = ' \t\r\n'
+
+
+def scan_values(statement):
+    """Return the value tuples of statement, "VALUES (...),(...);", as
+    lists of strings, None when it uses syntax the scanner doesn't read.
+    """
+    match = VALUES_START.match(statement)
+    if not match:
+        return None
+    start = match.end()
+    # The tuples end before the final semicolon and whitespace
+    end = statement.rfind(';')
+    if end < start or statement[end + 1:].strip(SPACES):
+        return None
+    while statement[end - 1] in SPACES:
+        end -= 1
+
+    rows = []
+    row = []
+    length = 0
+    for text, bare, single, double, close, next_tuple in \
+            VALUE.findall(statement, start, end):
+        if row is None:
+            # A value after the last tuple
+            return None
+        length += len(text)
+        # Only one of them matched, quoted strings can be empty
+        row.append(bare or single or double)
+        if close != ',':
+            rows.append(row)
+            row = [] if next_tuple else None
+    # Values are found anywhere, they must follow each other from the start
+    # and the last tuple must be closed at the end
+    if row is not None or length != end - start:
+        return None
+    return rows
@@ -5,9 +5,24 @@ import colored
 from colored import stylize
 from tqdm import tqdm
 
+from dbtools.fileio import file_fingerprint
+
+
+# First line of the progress bars of this process, set in worker processes
+# so that every worker draws its bars on its own lines
+PROGRESS_POSITION = None
+
 
 class TqdmUpTo(tqdm):
     """Provides `update_to(n)` which uses `tqdm.update(delta_n)`."""
+    def __init__(self, *args, **kwargs):
+        if PROGRESS_POSITION is not None:
+            # Bars opened together go on the lines below each other
+            kwargs.setdefault(
+                'position', PROGRESS_POSITION + len(self._instances))
+            kwargs.setdefault('leave', False)
+        super(TqdmUpTo, self).__init__(*args, **kwargs)
+
     def update_to(self, b=1, bsize=1, tsize=None):
         """
         b  : int, optional
@@ -55,7 +70,12 @@ def move(src_path, dest_dir):
         dest_dir = dest_dir
 
     if not os.path.exists(dest_dir):
-        os.makedirs(dest_dir)
+        try:
+            os.makedirs(dest_dir)
+        except OSError:
+            # Created meanwhile by another process
+            if not os.path.isdir(dest_dir):
+                raise
 
     new_path = os.path.join(dest_dir, filename)
     if src_path != new_path:
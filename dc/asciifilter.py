@@ -0,0 +1,76 @@
+"""Streaming removal of non printable characters.
+
+Keeps tab, newline, carriage return and printable ascii, the same set of
+characters that `tr -cd '\\11\\12\\15\\40-\\176'` keeps.
+"""
+
+# Characters kept when filtering
+KEEP = '\t\n\r' + ''.join(chr(c) for c in range(0x20, 0x7f))
+
+# Characters removed by str.translate
+DELETE = ''.join(chr(c) for c in range(256) if chr(c) not in KEEP)
+
+# Translation table for unicode text decoded from a single byte encoding
+DELETE_TABLE = {ord(c): None for c in DELETE}
+
+
+def filter_ascii(data):
+    """Return data (str) without the non printable characters."""
+    return data.translate(None, DELETE)
+
+
+class AsciiFile(object):
+    """Read-only file wrapper that filters every chunk it reads.
+
+    Offsets used by seek() and tell() are those of the wrapped file, so
+    positions can be saved and restored as with a normal file. They are
+    counted from the bytes read, so tell() is exact and cheap even while
+    iterating over lines, when files read ahead.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = f.tell()
+
+    @property
+    def name(self):
+        return self.f.name
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.offset += len(data)
+        return data.translate(None, DELETE)
+
+    def readline(self, size=-1):
+        line = self.f.readline(size)
+        self.offset += len(line)
+        return line.translate(None, DELETE)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while True:
+            line = self.f.next()
+            self.offset += len(line)
+            line = line.translate(None, DELETE)
+            # A last line made only of garbage has nothing left to return
+            if line:
+                return line
+
+    def seek(self, offset, whence=0):
+        self.f.seek(offset, whence)
+        self.offset = self.f.tell()
+        return self.offset
+
+    def tell(self):
+        return self.offset
+
+    def close(self):
+        return self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
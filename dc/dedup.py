@@ -0,0 +1,149 @@
+"""Skipping of duplicate JSON records.
+
+Records are identified by a hash of the whole record without its import
+date, so records differing in any field, such as their password, are all
+kept. They can instead be identified by a few fields, or by the whole
+record when they have none of them. Values are normalized (stripped, lists
+sorted, lower case for the fields whose case doesn't matter). Hashes are
+kept in a SQLite table on disk, so memory use stays bounded by the SQLite
+page cache however many records are seen.
+
+The hashes of the records of a JSON file are kept next to it with the
+size of the file they describe. A file changed by anything else is scanned
+again before records are appended to it.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+from dbtools.fileio import open_file
+
+# Fields identifying a record, all of them when empty
+DEDUP_FIELDS = ()
+
+# Fields left out when a record is identified by all its fields
+IGNORED_FIELDS = ('importdate',)
+
+# Fields compared in lower case
+CASELESS_FIELDS = ('email', 'hash', 'username')
+
+# Version of the keys of record_key, sets of other versions are rebuilt
+KEY_VERSION = '2'
+
+# Pages of the SQLite cache, in KB
+CACHE_SIZE = 64 * 1024
+
+
+def normalize(value, caseless=False):
+    """Return a field value as stripped unicode, in lower case when
+    caseless."""
+    if isinstance(value, list):
+        return u'\x1f'.join(sorted(normalize(v, caseless) for v in value))
+    if isinstance(value, str):
+        value = value.decode('utf-8', 'replace')
+    elif not isinstance(value, unicode):
+        value = unicode(value)
+    value = value.strip()
+    return value.lower() if caseless else value
+
+
+def record_key(source, fields=DEDUP_FIELDS):
+    """Return the digest identifying a record (dict)."""
+    values = [normalize(source.get(field) or '', field in CASELESS_FIELDS)
+              for field in fields]
+    if not any(values):
+        values = [
+            u'{}={}'.format(normalize(key, True),
+                            normalize(value, key in CASELESS_FIELDS))
+            for key, value in sorted(source.items())
+            if key not in IGNORED_FIELDS
+        ]
+    return hashlib.md5(u'\x1e'.join(values).encode('utf-8')).digest()
+
+
+def seen_path(json_path):
+    """Return the path of the record hashes of a JSON file."""
+    folder, name = os.path.split(json_path)
+    return os.path.join(folder, '.{}.seen'.format(name))
+
+
+class RecordSet(object):
+    """Disk backed set of records, counting the duplicates found.
+
+    Parameters:
+        path: SQLite file of the record hashes (str)
+        fields: fields identifying a record (sequence of str)
+    """
+
+    def __init__(self, path, fields=DEDUP_FIELDS):
+        self.path = path
+        self.fields = fields
+        self.records = 0
+        self.duplicates = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.text_factory = str
+        # Hashes can be rebuilt, so they aren't synced to disk
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('PRAGMA cache_size=-{}'.format(CACHE_SIZE))
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS seen (digest BLOB PRIMARY KEY) '
+            'WITHOUT ROWID')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, '
+            'value TEXT)')
+        self.cursor = self.conn.cursor()
+
+    @classmethod
+    def for_json(cls, json_path, fields=DEDUP_FIELDS):
+        """Open the record set of a JSON file records will be appended to.
+
+        The set is rebuilt from the file when it doesn't match the file.
+        """
+        path = seen_path(json_path)
+        size = os.path.getsize(json_path) if os.path.exists(json_path) else 0
+        record_set = cls(path, fields)
+        if record_set.get_meta('size') == str(size) and \
+                record_set.get_meta('fields') == ','.join(fields) and \
+                record_set.get_meta('key') == KEY_VERSION:
+            return record_set
+
+        record_set.close()
+        os.remove(path)
+        record_set = cls(path, fields)
+        if size:
+            with open_file(json_path) as f:
+                for line in f:
+                    if line.strip():
+                        record_set.add(json.loads(line)['_source'])
+        record_set.records = record_set.duplicates = 0
+        return record_set
+
+    def get_meta(self, key):
+        found = self.conn.execute(
+            'SELECT value FROM meta WHERE key=?', (key,)).fetchone()
+        return found[0] if found else None
+
+    def set_meta(self, key, value):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    def add(self, source):
+        """Add a record, returns False when it was seen before."""
+        self.records += 1
+        self.cursor.execute(
+            'INSERT OR IGNORE INTO seen VALUES (?)',
+            (sqlite3.Binary(record_key(source, self.fields)),))
+        if self.cursor.rowcount == 1:
+            return True
+        self.duplicates += 1
+        return False
+
+    def close(self, json_path=None):
+        """Store the set, as describing the JSON file when one is given."""
+        if json_path:
+            self.set_meta('size', str(os.path.getsize(json_path)))
+            self.set_meta('fields', ','.join(self.fields))
+            self.set_meta('key', KEY_VERSION)
+        self.conn.commit()
+        self.conn.close()
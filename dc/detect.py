@@ -0,0 +1,175 @@
+"""Delimiter and column count detection from a bounded sample of a file."""
+from __future__ import division
+
+import csv
+import re
+from collections import Counter, namedtuple
+
+from dc.lines import LineFeed
+
+# Bytes read from each of the start, middle and end of a file
+SAMPLE_SIZE = 64 * 1024
+
+# Lines kept from each part of the sample
+SAMPLE_LINES = 1000
+
+# Characters that need the csv reader to count the fields of a line
+SPECIAL = re.compile('["\\\\\r]')
+
+# Delimiters also found inside fields, such as names, only used when no
+# other delimiter splits the lines consistently
+WEAK_DELIMITERS = (' ',)
+
+# Share of the lines a delimiter must split the same way to be consistent
+CONSISTENT = 0.9
+
+Detection = namedtuple(
+    'Detection', ['dialect', 'column_count', 'confidence'])
+
+
+def make_dialect(delimiter, quoted=True):
+    """Return a dialect class for delimiter.
+
+    Quoted dialects read fields in double quotes, others keep quotes as part
+    of the field and use backslash as escape character.
+    """
+    attrs = {
+        'delimiter': delimiter,
+        'doublequote': True,
+        'lineterminator': '\r\n',
+        'skipinitialspace': False,
+    }
+    if quoted:
+        attrs.update(quotechar='"', escapechar=None,
+                     quoting=csv.QUOTE_MINIMAL)
+    else:
+        attrs.update(quotechar='', escapechar='\\', quoting=csv.QUOTE_NONE)
+    return type('DetectedDialect', (csv.Dialect, object), attrs)
+
+
+def sample_lines(f, size=SAMPLE_SIZE, max_lines=SAMPLE_LINES):
+    """Read complete lines from the start, middle and end of file f.
+
+    Reads at most 3 * size bytes whatever the size of the file, and
+    leaves f at its start.
+    """
+    try:
+        f.seek(0, 2)
+        total = f.tell()
+    except IOError:
+        # Compressed files can't seek from their end, only their start is
+        # read
+        total = None
+    if total is None:
+        offsets = [0]
+        size = size * 3
+    elif total <= size * 3:
+        offsets = [0]
+        size = total
+    else:
+        offsets = [0, (total - size) // 2, total - size]
+
+    lines = []
+    for offset in offsets:
+        f.seek(offset)
+        chunk = f.read(size).split('\n')
+        if offset:
+            # Drop the line cut by the start of the chunk
+            chunk = chunk[1:]
+        if total is None:
+            cut = bool(f.read(1))
+        else:
+            cut = offset + size < total
+        if cut:
+            # Drop the line cut by the end of the chunk
+            chunk = chunk[:-1]
+        part = [line + '\n' for line in chunk[:-1]]
+        if chunk[-1:] and chunk[-1]:
+            part.append(chunk[-1])
+        lines.extend(part[:max_lines])
+    f.seek(0)
+    return lines
+
+
+class FieldCounter:
+    """
+    Counts the fields of single lines for one dialect, reusing one reader.
+    """
+
+    def __init__(self, dialect):
+        self.delimiter = dialect.delimiter
+        self.line_feed = LineFeed()
+        self.reader = csv.reader(self.line_feed, dialect=dialect)
+        # Spaces before and after the delimiter
+        self.spaces = re.compile(r'(?:(?<=\%s) | (?=\%s))' % (
+            self.delimiter, self.delimiter))
+
+    def count(self, line):
+        """Return the number of fields in line, None if it can't be read."""
+        line = self.spaces.sub('', line)
+        if not SPECIAL.search(line.rstrip('\r\n')):
+            return line.count(self.delimiter) + 1
+        try:
+            self.line_feed.feed(line)
+            return len(self.reader.next())
+        except (csv.Error, StopIteration, UnicodeDecodeError):
+            return None
+
+
+def column_counts(lines, dialect):
+    """Return a Counter of the number of fields in non blank lines."""
+    counter = FieldCounter(dialect)
+    counts = Counter()
+    for line in lines:
+        if line.strip():
+            counts[counter.count(line)] += 1
+    counts.pop(None, None)
+    return counts
+
+
+def detect_dialect(lines, delimiters):
+    """Score every delimiter on the same sample of lines.
+
+    A candidate scores the share of non blank lines that have its most
+    common field count, it must split lines into at least two fields. Ties
+    go to the quoted dialect, then to the first of delimiters. WEAK_DELIMITERS
+    are only candidates when no other delimiter is CONSISTENT.
+
+    Returns a Detection with the share as confidence, or None when no
+    delimiter splits the lines.
+    """
+    total = sum(1 for line in lines if line.strip())
+    if not total:
+        return None
+
+    strong = [d for d in delimiters if d not in WEAK_DELIMITERS]
+    weak = [d for d in delimiters if d in WEAK_DELIMITERS]
+    best = best_detection(lines, strong, total)
+    if best and best.confidence >= CONSISTENT:
+        return best
+    fallback = best_detection(lines, weak, total)
+    if fallback and (not best or fallback.confidence > best.confidence):
+        return fallback
+    return best
+
+
+def best_detection(lines, delimiters, total):
+    """Return the Detection of the best of delimiters for detect_dialect,
+    None when none splits the lines."""
+    best = None
+    best_key = None
+    for delimiter in delimiters:
+        for quoted in (True, False):
+            dialect = make_dialect(delimiter, quoted)
+            counts = column_counts(lines, dialect)
+            if not counts:
+                continue
+            column_count, freq = counts.most_common(1)[0]
+            if column_count < 2:
+                continue
+            confidence = freq / total
+            key = (confidence, quoted)
+            if best_key is None or key > best_key:
+                best_key = key
+                best = Detection(dialect, column_count, confidence)
+    return best
@@ -0,0 +1,106 @@
+"""Typing of field values as password hashes.
+
+hashID tries every one of its prototypes on a value in turn, so values are
+first filtered on length, characters and known prefixes, then on one
+alternation of all the prototypes before hashID is asked. Values made only
+of letters, digits and "/.+=_" are matched by the prototypes according to
+their shape alone (length, whether letters are all hex, which symbols they
+contain and where), so the result is memoized per shape.
+"""
+import re
+import string
+
+from hashid import HashID
+
+# Shortest value matched by a hashID prototype
+MIN_LENGTH = 4
+
+# Prefixes of crypt style hashes
+HASH_PREFIXES = (
+    '$1$', '$2$', '$2a$', '$2b$', '$2x$', '$2y$', '$5$', '$6$', '$apr1$',
+    '$H$', '$P$', '$S$', '$md5$', '$sha1$', '$pbkdf2', '{SSHA', '{SHA}',
+)
+
+# Prefixes of prototypes with literal letters, tried on every value
+LITERAL_PREFIXES = ('0x', 'md5', 'grub.')
+
+ALNUM = string.ascii_letters + string.digits
+HEX = string.hexdigits
+SYMBOLS = '/.+=_'
+
+# Values with other characters only match prototypes using one of these
+MATCHABLE = '$:{*('
+
+# Python 2 regular expressions hold at most 100 groups
+MAX_GROUPS = 99
+
+
+def combine(regexes):
+    """Return alternations matching what any of regexes matches."""
+    combined = []
+    patterns = []
+    groups = 0
+    for regex in regexes:
+        if patterns and groups + regex.groups > MAX_GROUPS:
+            combined.append(re.compile('|'.join(patterns), re.IGNORECASE))
+            patterns = []
+            groups = 0
+        patterns.append('(?:{})'.format(regex.pattern))
+        groups += regex.groups
+    if patterns:
+        combined.append(re.compile('|'.join(patterns), re.IGNORECASE))
+    return combined
+
+
+class HashTyper(object):
+    """Memoized hash test of field values.
+
+    Parameters:
+        hash_id: hashID instance (HashID)
+    """
+
+    def __init__(self, hash_id=None):
+        self.hash_id = hash_id or HashID()
+        # Prototypes with only extended modes never identify a hash
+        self.regexes = combine(
+            prototype.regex for prototype in self.hash_id.prototypes
+            if any(not mode.extended for mode in prototype.modes))
+        self.shapes = {}
+
+    def identify(self, value):
+        """Return True when hashID identifies a non extended hash mode."""
+        if not any(regex.match(value) for regex in self.regexes):
+            return False
+        return any(
+            not mode.extended for mode in self.hash_id.identifyHash(value))
+
+    def is_hash(self, value):
+        """Return True when value (str) is a hash."""
+        value = value.strip()
+        if len(value) < MIN_LENGTH:
+            return False
+        if value.startswith(HASH_PREFIXES):
+            return True
+
+        symbols = value.translate(None, ALNUM)
+        if symbols.translate(None, SYMBOLS):
+            # Values like emails or names can't match any prototype
+            if (len(value.translate(None, MATCHABLE)) == len(value) and
+                    not value.lower().startswith(LITERAL_PREFIXES)):
+                return False
+            return self.identify(value)
+        if value.lower().startswith(LITERAL_PREFIXES):
+            return self.identify(value)
+
+        shape = (
+            len(value),
+            len(value.translate(None, HEX)) == len(symbols),
+            symbols,
+            value[0] in SYMBOLS,
+            value[-1] in SYMBOLS,
+        )
+        try:
+            return self.shapes[shape]
+        except KeyError:
+            result = self.shapes[shape] = self.identify(value)
+            return result
@@ -0,0 +1,85 @@
+"""Run one operation on many files with a pool of worker processes.
+
+Files are handed out largest first so one big file started last doesn't
+keep the whole run waiting. Every worker draws its progress bars on its
+own lines below the overall progress bar. Results are returned to the
+parent process, which moves files, so failures of one file don't stop the
+others.
+"""
+import multiprocessing
+import os
+import signal
+
+import dc
+
+# Progress lines kept for each worker
+WORKER_LINES = 2
+
+# Seconds waited for a result, a timeout keeps the wait interruptible
+WAIT_TIMEOUT = 365 * 24 * 60 * 60
+
+
+def init_worker(counter):
+    """Give the worker process its own progress lines."""
+    # Control-C is handled by the parent, which stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    with counter.get_lock():
+        slot = counter.value
+        counter.value += 1
+    # Line 0 is the overall progress bar of the parent
+    dc.PROGRESS_POSITION = 1 + slot * WORKER_LINES
+
+
+def call(job):
+    """Run function on one task inside a worker process.
+
+    Returns (path, True, result), or (path, False, error message) when the
+    function raised.
+    """
+    function, task = job
+    try:
+        return task[0], True, function(*task)
+    except Exception as error:
+        return task[0], False, str(error) or repr(error)
+
+
+def file_size(task):
+    """Return the size of the first path of a task, 0 when it's missing."""
+    try:
+        return os.path.getsize(task[0])
+    except OSError:
+        return 0
+
+
+def run_jobs(function, tasks, jobs, size=file_size):
+    """Run function(*task) for every task with a pool of jobs processes.
+
+    Parameters:
+        function: module level function, called with the items of a task
+        tasks: tuples of arguments, the first one being the file path
+        jobs: number of worker processes (int)
+        size: function returning the size of a task, larger ones run first
+
+    Yields (path, success, result or error message) as tasks finish.
+    """
+    if not tasks:
+        return
+    tasks = sorted(tasks, key=size, reverse=True)
+    counter = multiprocessing.Value('i', 0)
+    pool = multiprocessing.Pool(jobs, init_worker, (counter,))
+    pbar = dc.TqdmUpTo(desc='Files', unit=' file', total=len(tasks),
+                       position=0)
+    try:
+        results = pool.imap_unordered(
+            call, [(function, task) for task in tasks])
+        for _ in tasks:
+            result = results.next(WAIT_TIMEOUT)
+            pbar.update(1)
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pbar.close()
+        pool.join()
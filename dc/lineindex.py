@@ -0,0 +1,123 @@
+"""Indexes of line offsets, for random access into large files.
+
+The index of a file holds the offset of every STEP-th line and the number
+of lines of the file. Indexes are kept in INDEX_DIR of the working
+directory under the fingerprint of their file, so an index is reused for
+as long as its file is unchanged, even once renamed or moved, and ignored
+once it changes. Offsets of compressed files are offsets in their
+decompressed data.
+"""
+import array
+import os
+import struct
+
+from dc import file_fingerprint
+from dbtools.fileio import open_file, read_position
+
+# Folder of the indexes, skipped when gathering files
+INDEX_DIR = '.datacleaner_index'
+
+# Lines between two offsets kept
+STEP = 1000
+
+# Step and line count, followed by the offsets
+HEADER = struct.Struct('<QQ')
+
+# Lines read between progress updates
+PROGRESS_LINES = 100000
+
+
+def index_path(path):
+    """Return the path of the index of the file at path."""
+    return os.path.join(INDEX_DIR, file_fingerprint(path) + '.idx')
+
+
+class LineIndex(object):
+    """Offsets of every step-th line of a file.
+
+    Parameters:
+        offsets: offset of lines 0, step, 2 * step... (array of int)
+        line_count: number of lines of the file (int)
+        step: lines between two offsets (int)
+    """
+
+    def __init__(self, offsets, line_count, step=STEP):
+        self.offsets = offsets
+        self.line_count = line_count
+        self.step = step
+
+    @classmethod
+    def build(cls, f, step=STEP, pbar=None):
+        """Index file f, read from its start."""
+        offsets = array.array('L')
+        offset = 0
+        number = -1
+        for number, line in enumerate(f):
+            if not number % step:
+                offsets.append(offset)
+            offset += len(line)
+            if pbar and not number % PROGRESS_LINES:
+                pbar.update_to(read_position(f))
+        return cls(offsets, number + 1, step)
+
+    @classmethod
+    def load(cls, path):
+        """Return the index of the file at path, None when it has none."""
+        try:
+            with open(index_path(path), 'rb') as f:
+                step, line_count = HEADER.unpack(f.read(HEADER.size))
+                offsets = array.array('L')
+                offsets.fromstring(f.read())
+        except (IOError, struct.error):
+            return None
+        return cls(offsets, line_count, step)
+
+    @classmethod
+    def for_file(cls, path, pbar=None):
+        """Return the index of the file at path, built if needed."""
+        index = cls.load(path)
+        if index is None:
+            with open_file(path) as f:
+                index = cls.build(f, pbar=pbar)
+            index.save(path)
+        return index
+
+    def save(self, path):
+        """Store the index of the file at path."""
+        if not os.path.isdir(INDEX_DIR):
+            try:
+                os.mkdir(INDEX_DIR)
+            except OSError:
+                # Created meanwhile by another job
+                if not os.path.isdir(INDEX_DIR):
+                    raise
+        temp_path = index_path(path) + '~'
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(self.step, self.line_count))
+            self.offsets.tofile(f)
+        os.rename(temp_path, index_path(path))
+
+    def seek(self, f, number):
+        """Move file f to the start of line number (counted from 0)."""
+        mark = min(number // self.step, len(self.offsets) - 1)
+        f.seek(self.offsets[mark])
+        for _ in xrange(number - mark * self.step):
+            f.readline()
+
+    def read_lines(self, f, numbers):
+        """Yield (number, line) for line numbers (sorted) of file f.
+
+        Lines far from the previous one are reached with a seek, so only
+        the parts of the file around the lines are read.
+        """
+        current = None
+        for number in numbers:
+            if number >= self.line_count:
+                return
+            if current is None or not 0 <= number - current < self.step:
+                self.seek(f, number)
+            else:
+                for _ in xrange(number - current):
+                    f.readline()
+            yield number, f.readline()
+            current = number + 1
@@ -0,0 +1,53 @@
+"""Line splitting shared by the csv readers."""
+import re
+
+# Characters that the UTF-8 stream reader would treat as line breaks
+LINE_BREAKS = re.compile('[\r\x0b\x0c\x1c-\x1e\x80-\xff]')
+
+
+def split_line(line):
+    """Split line on unicode line breaks, keeping the line endings."""
+    body = line
+    if body.endswith('\n'):
+        body = body[:-1]
+    if body.endswith('\r'):
+        body = body[:-1]
+    if not LINE_BREAKS.search(body):
+        return [line]
+    return [
+        piece.encode('utf-8')
+        for piece in line.decode('utf-8').splitlines(True)
+    ]
+
+
+def utf8_lines(f):
+    """Iterate over the lines of f as the UTF-8 stream reader splits them."""
+    for line in f:
+        for piece in split_line(line):
+            yield piece
+
+
+class LineFeed:
+    """
+    Iterator that hands the pieces of a single line to a csv reader.
+
+    It runs dry at the end of the line, so one reader can be reused for
+    every line without a quoted field spilling into the next one.
+    """
+
+    def __init__(self):
+        self.pieces = []
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if not self.pieces:
+            raise StopIteration
+        return self.pieces.pop()
+
+    def feed(self, line):
+        # Only the first row of a line split on unicode line breaks is read
+        pieces = split_line(line)
+        pieces.reverse()
+        self.pieces = pieces
@@ -0,0 +1,75 @@
+"""Persistent memo of detection decisions made for files.
+
+Decisions (dialect, column count, headers) are stored in a SQLite file of
+the working directory under two keys: the fingerprint of the file and the
+signature of its first line. A file seen before is recognised by its
+fingerprint, a new file sharing the header line of a confirmed file is
+recognised by its signature.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+
+from dbtools.jsonio import to_str
+
+# Memo file, starts with a dot so gather_files skips it
+MEMO_PATH = '.datacleaner_memo.db'
+
+# Characters ignored when comparing first lines
+SIGNATURE_STRIP = re.compile(r'["\'\s]+')
+
+
+def line_signature(line):
+    """Return the normalized signature of a line, None for blank lines."""
+    line = SIGNATURE_STRIP.sub('', line.lower())
+    if not line:
+        return None
+    return hashlib.md5(line).hexdigest()
+
+
+class DetectionMemo(object):
+    """SQLite store of decisions keyed by file fingerprint and signature."""
+
+    def __init__(self, path=MEMO_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS decisions ('
+            'kind TEXT, key TEXT, value TEXT, confirmed INTEGER, '
+            'PRIMARY KEY (kind, key))')
+        self.conn.commit()
+
+    def _get(self, kind, key):
+        return self.conn.execute(
+            'SELECT value, confirmed FROM decisions WHERE kind=? AND key=?',
+            (kind, key)).fetchone()
+
+    def recall(self, kind, fingerprint, signature=None, confirmed_only=True):
+        """Return the value remembered for a file, None if unknown.
+
+        Decisions made without confirmation are only returned for the same
+        file and when confirmed_only is False. Signatures only match
+        confirmed decisions.
+        """
+        found = self._get(kind, 'file:' + fingerprint)
+        if found and (found[1] or not confirmed_only):
+            return to_str(json.loads(found[0]))
+        if signature:
+            found = self._get(kind, 'line:' + signature)
+            if found:
+                return to_str(json.loads(found[0]))
+        return None
+
+    def remember(self, kind, fingerprint, signature, value, confirmed):
+        """Store the value decided for a file."""
+        keys = ['file:' + fingerprint]
+        if signature and confirmed:
+            keys.append('line:' + signature)
+        value = json.dumps(value)
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO decisions VALUES (?, ?, ?, ?)',
+            [(kind, key, value, int(confirmed)) for key in keys])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,59 @@
+"""Helpers for splitting work on large files across worker processes."""
+import os
+from shutil import copyfileobj
+
+# Size of blocks used when concatenating shard files
+COPY_BUFFER = 16 * 1024 * 1024
+
+
+def line_ranges(path, start=0, parts=1):
+    """Split a file into newline aligned byte ranges.
+
+    Parameters:
+        path: file path (str)
+        start: byte offset where the first range begins (int)
+        parts: wanted number of ranges (int)
+
+    Returns list of (start, end) tuples covering start..EOF in order.
+    """
+    size = os.path.getsize(path)
+    if start >= size:
+        return []
+    step = max(1, (size - start) // max(1, parts))
+
+    ranges = []
+    with open(path, 'rb') as f:
+        begin = start
+        while begin < size:
+            end = begin + step
+            if end >= size:
+                end = size
+            else:
+                # Move the boundary past the end of the current line
+                f.seek(end - 1)
+                f.readline()
+                end = f.tell()
+            ranges.append((begin, end))
+            begin = end
+    return ranges
+
+
+def iter_range(f, start, end):
+    """Iterate over the lines of file "f" between two byte offsets."""
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        line = f.readline()
+        if not line:
+            break
+        remaining -= len(line)
+        yield line
+
+
+def concat_files(dest, paths, remove=True):
+    """Append the content of files at "paths" to the open file "dest"."""
+    for path in paths:
+        with open(path, 'rb') as src:
+            copyfileobj(src, dest, COPY_BUFFER)
+        if remove:
+            os.remove(path)
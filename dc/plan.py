@@ -0,0 +1,54 @@
+"""Plan files of decisions made for files before processing them.
+
+A plan lists for every file its path, its fingerprint and the decisions
+taken while planning (dialect and column count, or headers). It is written
+as indented JSON so it can be reviewed and edited before being executed.
+Decisions are looked up by fingerprint, so files renamed while being
+processed keep their decisions and files changed since planning have none.
+"""
+import json
+
+from dc import file_fingerprint
+from dbtools.jsonio import to_str
+
+
+class Plan(object):
+    """Decisions for files, by fingerprint.
+
+    Parameters:
+        entries: dicts with the path, fingerprint and decisions of a file
+    """
+
+    def __init__(self, entries=()):
+        self.entries = []
+        self.decisions = {}
+        for entry in entries:
+            self.add(entry)
+
+    @classmethod
+    def load(cls, path):
+        """Read a plan written by save()."""
+        with open(path, 'rb') as f:
+            return cls(to_str(json.load(f))['files'])
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            json.dump({'files': self.entries}, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    def add(self, entry):
+        self.entries.append(entry)
+        self.decisions[entry['fingerprint']] = entry
+
+    def plan_file(self, path, **decisions):
+        """Add the decisions taken for the file at path."""
+        entry = dict(decisions, path=path, fingerprint=file_fingerprint(path))
+        self.add(entry)
+        return entry
+
+    def paths(self):
+        return [entry['path'] for entry in self.entries]
+
+    def lookup(self, path):
+        """Return the decisions for the file at path, None if unplanned."""
+        return self.decisions.get(file_fingerprint(path))
@@ -0,0 +1,53 @@
+"""Release names of JSON files, cached between merges.
+
+The release of a JSON file is read from its first record. JSON files are
+only ever appended to, so the release read once is kept for as long as the
+file keeps its inode, and merging a growing folder again only opens the
+files added since.
+"""
+import json
+import os
+
+from dbtools.jsonio import to_str
+
+# Cache file kept in the merged folder, not matched by *.json
+RELEASE_CACHE = '.release_cache.json'
+
+
+class ReleaseCache(object):
+    """Release names of the JSON files of a folder.
+
+    Parameters:
+        folder: folder of the JSON files (str)
+    """
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, RELEASE_CACHE)
+        try:
+            with open(self.path, 'rb') as f:
+                self.releases = to_str(json.load(f))
+        except (IOError, ValueError):
+            self.releases = {}
+        self.seen = {}
+
+    def release(self, path):
+        """Return the release name of the JSON file at path."""
+        name = os.path.basename(path)
+        inode = os.stat(path).st_ino
+        cached = self.releases.get(name)
+        if cached and cached[0] == inode:
+            release = cached[1]
+        else:
+            with open(path, 'rb') as f:
+                item = json.loads(f.readline())
+            source = item.get("_source")
+            # The "r" field is written as "breach" by datacleaner -j
+            release = source.get("r") or source.get("breach")
+            release = to_str(release.replace(" ", "_"))
+        self.seen[name] = [inode, release]
+        return release
+
+    def save(self):
+        """Write the releases of the files seen, forgetting removed ones."""
+        with open(self.path, 'wb') as f:
+            json.dump(self.seen, f)
@@ -5,11 +5,16 @@ Called with path argument for one or more files. Filename argument can be a \
 list of files or wildcard (*).
 
 Usage:
-    sampling.py [-h] [--ci <interval>] [--cl <percent>] PATH...
+    sampling.py [-h] [--sci <interval>] [--scl <percent>] [--approximate]
+                [--jobs <n>] PATH...
 
 Options:
     --sci <interval>                 Confidence interval [default: 2.0]
     --scl <percent>                  Confidence level (percent) [default: 95]
+    --approximate                   Read lines at random offsets, estimating
+                                    the line count from the file size
+    --jobs <n>                      Files sampled at the same time, as many
+                                    as CPUs when not given
     -h, --help                      This help output
 
 Examples:
@@ -19,59 +24,100 @@ Examples:
 from __future__ import print_function, division
 
 import math
+import multiprocessing
 import os
 import random
 
 from docopt import docopt
-from tqdm import tqdm
 
 from dc import gather_files, move, c_failure, c_success, c_action, c_action_info, c_action_system, c_sys_success,\
-    c_warning, c_darkgray, c_darkgreen, c_lightgreen, c_lightgray, c_lightblue, c_blue
+    c_warning, c_darkgray, c_darkgreen, c_lightgreen, c_lightgray, c_lightblue, c_blue,\
+    TqdmUpTo
+from dc.jobs import run_jobs
+from dc.lineindex import LineIndex
+from dbtools.fileio import compressed_bytes, open_file, read_position, \
+    strip_compression
 
 # SUPPORTED CONFIDENCE LEVELS: 50%, 68%, 90%, 95%, and 99%
 CONFIDENCE_LEVELS = {50: .67, 68: .99, 90: 1.64, 95: 1.96, 99: 2.57}
 
+# Lines read between progress updates
+PROGRESS_LINES = 10000
 
-def create_sample(path, con_level, con_interval, dest_dir=None):
+# Bytes read from the start of a file to estimate its line count
+ESTIMATE_BYTES = 1024 * 1024
+
+
+def create_sample(path, con_level, con_interval, dest_dir=None,
+                  num_of_lines=None, approximate=False):
     """Create sample of file.
 
+    The file is read once. Lines are drawn with a reservoir, or by their
+    line numbers when num_of_lines is known. Files with a line index only
+    have the parts around the lines drawn read. With approximate, the line
+    count is estimated from the size of the file and lines are read at
+    random offsets, so only a small part of a large file is read.
+
     Parameters:
         path: file path (str)
         con_level: confidence level (percent int)
         con_interval: confidence interval (float)
         dest_dir: destination directory to write sample (default is same as
                     source file)
+        num_of_lines: number of lines after the headers, when known (int)
+        approximate: sample from random offsets (bool)
 
     Returns path for sample (str).
     """
-    name = path.rstrip('.csv')
+    name = strip_compression(path).rstrip('.csv')
     base_dir = os.path.dirname(path)
     sample_path = os.path.join(base_dir, name + '-sample.csv')
-    num_of_lines = sum(1 for _ in open(path)) - 1
-    sample_size = calc_sample_size(num_of_lines, con_level, con_interval)
-    c_action('{}: Will use sample size of {} from {} total lines for {}% '
-             'confidence'.format(path, sample_size, num_of_lines, con_level))
-    sample_lines = sorted(
-        random.sample(xrange(1, num_of_lines + 1), sample_size))
+    index = None if approximate else LineIndex.load(path)
+
+    with open_file(path) as oc:
+        headers = oc.readline()
+        if approximate and compressed_bytes(oc) is not None:
+            c_warning('{}: Compressed files are sampled in full'.format(path))
+            approximate = False
 
+        pbar = TqdmUpTo(desc='Sampling', unit=' bytes',
+                        total=os.path.getsize(path))
+        if approximate:
+            lines, num_of_lines = seek_sample(
+                oc, os.path.getsize(path), con_level, con_interval, pbar)
+            c_action('{}: Estimated {} total lines'.format(path, num_of_lines))
+        elif index is not None:
+            # The index counts the headers too
+            num_of_lines = max(index.line_count - 1, 0)
+            sample_size = calc_sample_size(num_of_lines, con_level,
+                                           con_interval)
+            lines = index_sample(oc, index, sample_size)
+            pbar.update_to(pbar.total)
+        elif num_of_lines is not None:
+            sample_size = calc_sample_size(num_of_lines, con_level,
+                                           con_interval)
+            lines = selection_sample(oc, num_of_lines, sample_size, pbar)
+        else:
+            lines, num_of_lines = reservoir_sample(
+                oc, calc_sample_size(None, con_level, con_interval), pbar)
+            # The reservoir holds a sample for any number of lines, a
+            # random part of it is a smaller random sample
+            sample_size = calc_sample_size(num_of_lines, con_level,
+                                           con_interval)
+            lines = random.sample(lines, min(sample_size, len(lines)))
+        pbar.close()
+
+    c_action('{}: Using sample size of {} from {} total lines for {}% '
+             'confidence'.format(path, len(lines), num_of_lines, con_level))
     with open(sample_path, 'wb') as sc:
-        with open(path, 'rb') as oc:
-            # Write headers
-            sc.write(oc.readline())
-            c_action_system('{}: Wrote headers to {}'.format(
-                path, sample_path))
-            pbar = tqdm(total=sample_size)
-            line_number = 1
-            lines_written = 0
-            for line in oc:
-                line_number += 1
-                if line_number in sample_lines:
-                    sc.write(line)
-                    lines_written += 1
-                    pbar.update(1)
-    pbar.close()
+        # Write headers
+        sc.write(headers)
+        c_action_system('{}: Wrote headers to {}'.format(path, sample_path))
+        # Lines are written in the order of the file
+        for _, line in sorted(lines):
+            sc.write(line)
     c_action_system('{}: {} of {} lines written to sample'.format(
-        path, lines_written + 1, num_of_lines))
+        path, len(lines) + 1, num_of_lines))
     if dest_dir:
         c_action_system('{}: Moving {} to {}'.format(path, sample_path,
                                                      dest_dir))
@@ -79,7 +125,120 @@ def create_sample(path, con_level, con_interval, dest_dir=None):
     return sample_path
 
 
+def read_lines(f, pbar):
+    """Iterate over the lines of file f, showing its progress on pbar."""
+    for number, line in enumerate(f, 1):
+        if not number % PROGRESS_LINES:
+            pbar.update_to(read_position(f))
+        yield line
+    pbar.update_to(pbar.total)
+
+
+def random_fraction():
+    """Return a random float strictly between 0 and 1."""
+    while True:
+        value = random.random()
+        if value:
+            return value
+
+
+def reservoir_sample(f, size, pbar):
+    """Draw a uniform sample of size lines of file f in a single pass.
+
+    Lines to keep are found by drawing the number of lines to skip
+    (algorithm L), so random numbers are only drawn for lines kept.
+
+    Returns the list of (index, line) kept and the number of lines.
+    """
+    reservoir = []
+    weight = math.exp(math.log(random_fraction()) / size)
+    next_index = size
+    index = -1
+    for index, line in enumerate(read_lines(f, pbar)):
+        if index < size:
+            reservoir.append((index, line))
+        elif index == next_index:
+            reservoir[random.randrange(size)] = (index, line)
+            weight *= math.exp(math.log(random_fraction()) / size)
+        else:
+            continue
+        if index >= size - 1:
+            next_index = index + 1 + int(
+                math.log(random_fraction()) / math.log(1 - weight))
+    return reservoir, index + 1
+
+
+def selection_sample(f, num_of_lines, size, pbar):
+    """Draw a sample of size lines of file f, which has num_of_lines lines.
+
+    Returns the list of (index, line) kept.
+    """
+    chosen = sorted(random.sample(xrange(num_of_lines),
+                                  min(size, num_of_lines)))
+    lines = []
+    if not chosen:
+        return lines
+    position = 0
+    for index, line in enumerate(read_lines(f, pbar)):
+        if index == chosen[position]:
+            lines.append((index, line))
+            position += 1
+            if position == len(chosen):
+                break
+    return lines
+
+
+def index_sample(f, index, size):
+    """Draw a sample of size lines of file f after its headers, seeking to
+    them with its line index.
+
+    Returns the list of (number, line) kept.
+    """
+    chosen = random.sample(xrange(1, index.line_count),
+                           min(size, max(index.line_count - 1, 0)))
+    return list(index.read_lines(f, sorted(chosen)))
+
+
+def seek_sample(f, file_size, con_level, con_interval, pbar):
+    """Draw an approximate sample of file f by reading lines at random
+    offsets after the current one.
+
+    The line count is estimated from the lines of the first
+    ESTIMATE_BYTES. Lines following long lines are a bit more likely to
+    be drawn, which is the price of not reading the whole file.
+
+    Returns the list of (offset, line) kept and the estimated line count.
+    """
+    start = f.tell()
+    head = f.readlines(ESTIMATE_BYTES)
+    if not head:
+        return [], 0
+    average = sum(len(line) for line in head) / len(head)
+    num_of_lines = max(len(head), int(round((file_size - start) / average)))
+    size = min(calc_sample_size(num_of_lines, con_level, con_interval),
+               num_of_lines)
+
+    offsets = sorted(random.randrange(start, file_size) for _ in xrange(size))
+    lines = {}
+    for offset in offsets:
+        if offset == start:
+            f.seek(offset)
+        else:
+            # Skip to the start of the line after the offset
+            f.seek(offset - 1)
+            f.readline()
+        line_offset = f.tell()
+        line = f.readline()
+        if line and line_offset not in lines:
+            lines[line_offset] = line
+        pbar.update_to(offset)
+    pbar.update_to(pbar.total)
+    return lines.items(), num_of_lines
+
+
 def calc_sample_size(num_of_lines, confidence_level, confidence_interval):
+    """Return the sample size for num_of_lines lines, or for any number of
+    lines when it's None."""
     p = 0.5
     e = float(confidence_interval) / 100
     N = num_of_lines
@@ -95,7 +254,12 @@ def calc_sample_size(num_of_lines, confidence_level, confidence_interval):
     n_0 = ((Z**2) * p * (1 - p)) / (e**2)
 
     # Adjust sample size for finite number of lines
-    n = n_0 / (1 + ((n_0 - 1) / float(N)))
+    if N is None:
+        n = n_0
+    elif not N:
+        return 0
+    else:
+        n = n_0 / (1 + ((n_0 - 1) / float(N)))
 
     # Return sample size
     return int(math.ceil(n))
@@ -103,8 +267,12 @@ def calc_sample_size(num_of_lines, confidence_level, confidence_interval):
 
 def main(args):
     file_list = gather_files(args['PATH'])
-    for path in file_list:
-        create_sample(path, args['--scl'], args['--sci'])
+    jobs = int(args['--jobs'] or multiprocessing.cpu_count())
+    tasks = [(path, args['--scl'], args['--sci'], None, None,
+              args['--approximate']) for path in file_list]
+    for path, success, result in run_jobs(create_sample, tasks, jobs):
+        if not success:
+            c_failure('{}: {}'.format(path, result))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,161 @@
+"""Resolve header names to their abbreviation.
+
+Every alias of headers.json is indexed once under its normalized form (case,
+camelCase and separators removed). Names that don't match an alias are
+retried without leading words, numeric suffixes and with common short words
+expanded, then matched within one edit of an alias using an index of
+single character deletions. A lookup costs O(length of the name), so
+resolving a header row is O(fields).
+"""
+import re
+from collections import namedtuple
+
+Resolution = namedtuple('Resolution', ['header', 'confidence'])
+
+# Confidence of each way of resolving a name
+EXACT = 1.0
+NORMALIZED = 0.9
+PARTIAL = 0.8
+FUZZY = 0.6
+UNKNOWN = 0.0
+
+# Short words expanded before looking names up again
+TOKEN_ALIASES = {
+    'addr': 'address',
+    'eml': 'email',
+    'fname': 'first_name',
+    'lname': 'last_name',
+    'mob': 'mobile',
+    'pass': 'password',
+    'passwd': 'password',
+    'pw': 'password',
+    'pwd': 'password',
+    'tel': 'phone',
+    'uname': 'username',
+    'usr': 'user',
+}
+
+# Names made of word characters are always header names
+WORD = re.compile(r'\w+$')
+
+# Other names are header names when they resolve to a known header
+NAME = re.compile(r'[A-Za-z][\w\-. ]*$')
+
+# Enumerated abbreviations like e1 or a2
+ENUMERATED_NAME = re.compile(r'([a-z])\d+')
+
+CAMEL_CASE = re.compile(r'([a-z0-9])([A-Z])')
+SEPARATORS = re.compile(r'[^a-z0-9]+')
+NUMERIC_SUFFIX = re.compile(r'_?\d+$')
+
+# Shortest compact name matched within one edit
+FUZZY_MIN_LENGTH = 5
+
+# Marks deletions shared by aliases of different headers
+AMBIGUOUS = ''
+
+
+def normalize(name):
+    """Return name in lower snake case, camelCase words split."""
+    name = CAMEL_CASE.sub(r'\1_\2', name).lower()
+    return SEPARATORS.sub('_', name).strip('_')
+
+
+def deletions(word):
+    """Return the words made by removing one character of word."""
+    return set(word[:i] + word[i + 1:] for i in range(len(word)))
+
+
+class HeaderResolver(object):
+    """Index of header aliases.
+
+    Parameters:
+        headers: header aliases by abbreviation, as in headers.json (dict)
+    """
+
+    def __init__(self, headers):
+        self.abbreviations = set(abbr.lower() for abbr in headers)
+        self.exact = {
+            alias.lower(): abbr for abbr, names in headers.items()
+            for alias in names
+        }
+        self.normalized = {}
+        self.deleted = {}
+        for alias, abbr in sorted(self.exact.items()):
+            key = normalize(alias)
+            self.normalized.setdefault(key, abbr)
+            self.normalized.setdefault(key.replace('_', ''), abbr)
+        for key, abbr in self.normalized.items():
+            if len(key) < FUZZY_MIN_LENGTH - 1 or '_' in key:
+                continue
+            for deleted in deletions(key):
+                # Deletions shared by aliases of different headers are
+                # ambiguous and never matched
+                if self.deleted.setdefault(deleted, abbr) != abbr:
+                    self.deleted[deleted] = AMBIGUOUS
+
+    def resolve(self, field):
+        """Resolve one header field.
+
+        Returns a Resolution, or None when field isn't a header name.
+        """
+        field = field.strip()
+        if len(field) > 1 and field[0] in '"\'' and field[-1] == field[0]:
+            field = field[1:-1]
+        if not field:
+            return Resolution('x', UNKNOWN)
+
+        resolution = self.lookup(field)
+        if WORD.match(field) or (NAME.match(field) and resolution.confidence):
+            return resolution
+        return None
+
+    def resolve_row(self, fields):
+        """Resolve fields up to the first one which isn't a header name."""
+        resolutions = []
+        for field in fields:
+            resolution = self.resolve(field)
+            if resolution is None:
+                break
+            resolutions.append(resolution)
+        return resolutions
+
+    def lookup(self, name):
+        """Return the Resolution of a header name."""
+        lower = name.lower()
+        enumerated = ENUMERATED_NAME.match(lower)
+        if enumerated:
+            return Resolution(enumerated.group(1), EXACT)
+        if lower in self.abbreviations:
+            return Resolution(lower, EXACT)
+        if lower in self.exact:
+            return Resolution(self.exact[lower], EXACT)
+
+        key = normalize(name)
+        abbr = self.normalized.get(key) or self.normalized.get(
+            key.replace('_', ''))
+        if abbr:
+            return Resolution(abbr, NORMALIZED)
+
+        # Drop numeric suffixes, expand short words, then drop leading words
+        tokens = []
+        for token in NUMERIC_SUFFIX.sub('', key).split('_'):
+            tokens.extend(TOKEN_ALIASES.get(token, token).split('_'))
+        for start in range(len(tokens)):
+            key = '_'.join(tokens[start:])
+            abbr = self.normalized.get(key) or self.normalized.get(
+                key.replace('_', ''))
+            if abbr:
+                return Resolution(abbr, PARTIAL)
+
+        compact = ''.join(tokens)
+        if len(compact) >= FUZZY_MIN_LENGTH:
+            candidates = set([self.deleted.get(compact)])
+            for deleted in deletions(compact):
+                candidates.add(self.normalized.get(deleted))
+                candidates.add(self.deleted.get(deleted))
+            candidates.discard(None)
+            if len(candidates) == 1 and AMBIGUOUS not in candidates:
+                return Resolution(candidates.pop(), FUZZY)
+
+        return Resolution('x', UNKNOWN)
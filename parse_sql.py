@@ -2,14 +2,15 @@
 """Parse user data from SQL.
 
 Called with filename argument for one or more sql files/dumps.  Will output
-csv and move sql source file to completed or failed directories depending on
-if there were any errors.
+a utf-8 csv file for each user table, named after the dump and the table,
+and move sql source file to completed or failed directories depending on if
+there were any errors.
 
 Filename argument can be a list of files or wildcard (*).
 
 Usage:
     parse_sql.py [-hV] [--completed=DIR] [--failed=DIR] [--exit-on-error] \
-[--user-table=NAME] SQLFILE...
+[--user-table=NAME] [--resume] [--workers=N] SQLFILE...
 
 Options:
     --completed=DIR               Directory to store completed sql files \
@@ -18,23 +19,35 @@ Options:
     --failed=DIR                  Directory to store sql files with errors \
 [default: failed]
     -h, --help                    This help output
-    --user-table=NAME             User table name to match
+    --resume                      Resume parsing from the last checkpoint
+    --user-table=NAME             Tables to extract, a regular expression \
+matching whole names or names separated by commas, user and member tables \
+if not given
     -V, --version                 Print version and exit
+    --workers=N                   Processes parsing the inserts \
+[default: 1]
 
 Examples:
     parse_sql.py --completed='~/success' --failed='~/error' test.sql
     parse_sql.py --exit-on-error ~/samples/*.sql
     parse_sql.py --user-table="myfriends" test.sql
+    parse_sql.py --user-table="users,members,customers" test.sql
+    parse_sql.py --workers=8 big.sql
 """
 from __future__ import division, print_function
 
+import collections
+import contextlib
 import io
+import mmap
+import multiprocessing
 import os
 import re
+import signal
+import string
 import sys
 
 import attr
-import magic
 from docopt import docopt
 from pyparsing import alphanums, CaselessKeyword, CaselessLiteral, \
     Combine, Group, NotAny, nums, Optional, oneOf, OneOrMore, \
@@ -44,6 +57,14 @@ from pyparsing import alphanums, CaselessKeyword, CaselessLiteral, \
 from dc import move, TqdmUpTo, c_success, c_action, c_action_info, \
     c_action_system, c_sys_success, c_warning, c_darkgray, c_darkgreen,\
     c_lightgreen, c_lightgray, c_lightblue, c_blue, c_error
+from dc.asciifilter import filter_ascii
+from dc.jobs import WAIT_TIMEOUT
+from dbtools.charset import ChunkDecoder
+from dbtools.checkpoint import Checkpoint
+from dbtools.fileio import OutputPool, compressed_bytes, compression, \
+    open_file, strip_compression
+from dbtools.sqlsplit import LinePieces, split_values, statement_end
+from dbtools.sqlvalues import scan_values
 
 __version__ = '0.5.0'
 __license__ = """
@@ -60,6 +81,27 @@ MAX_FAILURE_RATE = 0.20
 # How many bytes to read at a time
 READ_BUFFER = 10485760
 
+# Whitespace skipped by pyparsing before a keyword
+LEADING_SPACE = re.compile(r'[ \t\r\n]*')
+# Characters read to match the start of a statement with the grammars
+HEAD_SIZE = 1024
+# Escaped quotes around words removed from lines, see read_file
+ESCAPED_QUOTES = '\\\\\\"'
+# Characters of the escaped quotes and of the words they are around
+ESCAPED_CHARS = string.ascii_letters + string.digits + '_\\"'
+# Inserts longer than this are parsed by batches of value tuples
+STREAM_SIZE = READ_BUFFER
+# Characters read at a time from long inserts
+CHUNK_SIZE = 1048576
+# Buffer size of the output files
+OUTPUT_BUFFER = 65536
+# Encoding of the output files
+OUTPUT_ENCODING = 'utf-8'
+# Characters of the inserts sent at a time to a worker process
+PARSE_BATCH = 1048576
+# Batches of inserts parsed or waiting to be parsed for each worker process
+BATCHES_PER_WORKER = 2
+
 # pyparsing patterns for matching/parsing SQL
 BACKTICK = Suppress(Optional('`'))
 
@@ -93,6 +135,8 @@ USER_NAME = Regex(r'((?:[a-z0-9]+_?)*?users?)', flags=re.IGNORECASE)
 MEMBER_NAME = Regex(r'((?:[a-z0-9]+_?)*?members?)', flags=re.IGNORECASE)
 ANY_NAME = Regex(r'((?:[a-z0-9]+_?)*)', flags=re.IGNORECASE)
 TABLE_NAME = (ANY_NAME)
+# Tables parsed by default, the ones USER_NAME or MEMBER_NAME match
+USER_TABLES = re.compile(r'[a-z0-9_]*(?:user|member)s?$', flags=re.IGNORECASE)
 USER_TABLE = Combine(BACKTICK + TABLE_NAME + BACKTICK) + (WordEnd() | Suppress("("))
 CREATE = CaselessKeyword('CREATE TABLE')
 CREATE_EXISTS = CaselessKeyword('IF NOT EXISTS')
@@ -129,7 +173,9 @@ def main(args):
     """Executes main code."""
     for filepath in args['SQLFILE']:
         try:
-            parse(filepath)
+            parse(filepath, resume=args['--resume'],
+                  user_table=args['--user-table'],
+                  workers=int(args['--workers']))
         except KeyboardInterrupt:
             print('Control-c pressed...')
             sys.exit(138)
@@ -143,127 +189,214 @@ def main(args):
             move(filepath, args['--completed'])
 
 
-def parse(filepath):
-    """Opens sql file and parses statements, outputing data into CSV."""
-    field_names = []
+def parse(filepath, ascii_only=False, resume=False, user_table=None,
+          workers=1):
+    """Opens sql file and parses statements, outputing data into CSV.
+
+    Every table matching the user_table regular expression, or the user and
+    member tables, is written to its own UTF-8 CSV file in one pass. The
+    encoding of the statements is detected while reading them, see
+    ChunkDecoder, unless ascii_only is set, in which case non printable
+    characters are removed from them. Checkpoints are saved while parsing,
+    with resume the parsing goes on from the last one. With more than one
+    worker, the values of the inserts are parsed by a pool of processes
+    and written in the order of the dump.
+    """
     bad_inserts = 0
     total_inserts = 0
     total_values = 0
-    table_name = None
-    last_read = 0
+    tables = table_pattern(user_table)
+    # Outputs of compressed files are named after the uncompressed file
+    base = strip_compression(filepath)
+    bad_path = base + '.bad_inserts.txt'
+    # Paths of the CSV files of the tables found
+    csv_paths = {}
+    # Create table statements of the tables found
+    creates = {}
+    # Table of the last statement, VALUES statements following it are its
+    # inserts
+    last_table = None
+
+    checkpoint = Checkpoint(filepath, 'sql')
+    resumed = None
+    if resume:
+        resumed = checkpoint.resume()
+        if not resumed:
+            print('{}: No checkpoint to resume from'.format(filepath))
 
     # Delete old bad_inserts file if exists
-    if os.path.exists(filepath + '.bad_inserts.txt'):
-        os.unlink(filepath + '.bad_inserts.txt')
-
-    # Not sure what the encoding is, will try iso-8859-1
-    encoding = 'iso-8859-1'
-    retry = False
-
-    # Determine encoding
-    print('{}: Determining encoding'.format(filepath))
-    try:
-        with io.open(filepath, 'Ur', encoding=encoding) as sqlfile:
-            sqlfile.read(READ_BUFFER)
-    except UnicodeDecodeError:
-        retry = True
-
-    if retry:
-        # Try detecting encoding
-        m = magic.Magic(mime_encoding=True)
-        encoding = m.from_file(filepath)
-        try:
-            with io.open(filepath, 'Ur', encoding=encoding) as sqlfile:
-                sqlfile.read(READ_BUFFER)
-        except UnicodeDecodeError:
-            print('{}: Unable to determine encoding of file'.format(filepath))
-            raise
-
-    print('{}: Using {} encoding'.format(filepath, encoding))
-
-    # Extract data from statements and write to csv file
-    with io.open(filepath, 'Ur', encoding=encoding) as sqlfile:
-        user_table = read_file(sqlfile)
-        create_table, table_name, insert, byte_num = user_table.next()
-        if create_table:
-            c_warning('Getting field names from create table')
-            match = parse_sql(create_table.statement, CREATE_FULL)
-            if match and isinstance(match, ParseResults):
-                field_names = match.asDict()['field_names']
-            elif isinstance(match, ParseException):
-                raise_error(match, encoding)
-            else:
-                raise_error(Exception('Unknown error has occurred'))
-        elif insert:
-            c_warning('Getting field names from first insert')
-            insert_fields = re.search('(\(`.*`\))', insert)
-            if not insert_fields:
-                raise_error(ParseException('Field names not found in insert'))
-            fields_only = insert_fields.group(1)
-            match = parse_sql(fields_only, INSERT_FIELDS)
-            if match and isinstance(match, ParseResults):
-                field_names = match.asDict().get('field_names')
-            elif isinstance(match, ParseException):
-                pass
-            else:
-                raise (Exception('Unknown error has occurred'))
-
-        with io.open(filepath + '.csv', 'w', encoding=encoding) as cf:
-            if field_names:
-                c_success('Found field names')
-                cf.write(','.join(field_names))
-                cf.write(u'\n')
-            else:
-                c_error('No field names found')
+    if not resumed and os.path.exists(bad_path):
+        os.unlink(bad_path)
+
+    # The encoding is detected while reading, from the evidence of the
+    # statements read
+    decoder = ChunkDecoder(resumed['scores'] if resumed else None)
+
+    def open_output(path, append):
+        return io.open(path, 'a' if append else 'w',
+                       encoding=OUTPUT_ENCODING, buffering=OUTPUT_BUFFER)
+
+    # Outputs are kept open, CSV files are created when their table is found
+    # and bad inserts are appended to
+    written = [bad_path]
+    skip = 0
+    if resumed:
+        print('{}: Resuming from offset {}'.format(
+            filepath, resumed['offset']))
+        for table_name in resumed['tables']:
+            csv_paths[table_name] = csv_path(base, table_name)
+        written.extend(csv_paths.values())
+        total_inserts = resumed['inserts']
+        total_values = resumed['values']
+        bad_inserts = resumed['bad_inserts']
+        skip = resumed['offset']
+        # Statements after the offset can go on with the last table
+        last_table = resumed['table']
+        creates = dict((name, statement.decode('utf-8'))
+                       for name, statement in resumed['creates'].items())
+
+    # Extract data from statements and write to csv files, the workers are
+    # started first so they don't keep the pipes of decompressors open
+    with worker_pool(workers) as pool, \
+            open_file(filepath) as sqlfile, \
+            OutputPool(open_output, written=written) as outputs:
+        read_creates = dict((name, CreateTable(statement))
+                            for name, statement in creates.items())
+        if compression(filepath):
+            statements = read_file(sqlfile, decoder, ascii_only, skip,
+                                   tables, last_table, read_creates)
+        else:
+            statements = read_mapped(filepath, decoder, ascii_only, skip,
+                                     tables, last_table, read_creates)
 
         read_pbar = TqdmUpTo(
             desc='read', unit=' bytes', total=os.path.getsize(filepath))
-        read_pbar.update_to(byte_num)
+        # Compressed files show the progress of the compressed bytes read
+        compressed = compressed_bytes(sqlfile) is not None
+        if compressed:
+            read_pbar.update_to(compressed_bytes(sqlfile))
+        else:
+            read_pbar.update_to(skip)
+        # Characters of the statements parsed so far, None in a long insert
+        last_read = skip
 
         values_pbar = TqdmUpTo(desc='processed', unit=' value lines')
+        values_pbar.update_to(total_values)
+
+        for create_table, table_name, insert, chars, lines, value_lines, \
+                error in parse_statements(statements, pool, workers):
+            # Outputs of the statements before this one are written
+            if checkpoint.due() and last_read is not None:
+                outputs.flush()
+                checkpoint.save(
+                    last_read, [bad_path] + csv_paths.values(),
+                    scores=decoder.scores, tables=sorted(csv_paths),
+                    table=last_table, creates=creates,
+                    inserts=total_inserts, values=total_values,
+                    bad_inserts=bad_inserts)
+            last_read = chars
+            last_table = table_name
+            if compressed:
+                read_pbar.update_to(compressed_bytes(sqlfile))
+            elif chars is not None:
+                read_pbar.update_to(chars)
+
+            if table_name not in csv_paths:
+                c_action_info('{}: Found table {}'.format(
+                    filepath, table_name))
+                csv_paths[table_name] = csv_path(base, table_name)
+                field_names = get_field_names(
+                    create_table, insert, decoder.describe())
+                if field_names:
+                    c_success('Found field names')
+                    cf = outputs.get(csv_paths[table_name])
+                    cf.write(','.join(field_names))
+                    cf.write(u'\n')
+                else:
+                    c_error('No field names found')
+            if insert is None:
+                # A create table
+                creates[table_name] = create_table.statement
+                continue
 
-        values = process_insert(insert)
-        if values:
-            values_list, error = process_values(values)
-            if values_list:
-                value_lines = write_values(values_list, filepath, encoding)
+            total_inserts += 1
+            if lines:
+                outputs.get(csv_paths[table_name]).write(lines)
                 total_values += value_lines
                 values_pbar.update_to(total_values)
-        total_inserts += 1
-
-        for _, _, insert, byte_num in user_table:
-            read_pbar.update_to(byte_num)
-            total_inserts += 1
-            values = process_insert(insert)
-            if values:
-                values_list, error = process_values(values)
-                if values_list:
-                    value_lines = write_values(values_list, filepath, encoding)
-                    total_values += value_lines
-                    values_pbar.update_to(total_values)
+            elif error is not None:
+                bad_inserts += 1
+                error_rate = bad_inserts / total_inserts
+                # Consider the processing failed if over max failure rate
+                if error_rate > MAX_FAILURE_RATE and total_inserts > 5:
+                    print('{}: Error rate is too high'.format(filepath))
+                    raise_error(error, decoder.describe())
                 else:
-                    error_rate = bad_inserts / total_inserts
-                    # Consider the processing failed if over max failure rate
-                    if error_rate > MAX_FAILURE_RATE and total_inserts > 5:
-                        print('{}: Error rate is too high'.format(filepath))
-                        raise_error(error, encoding)
-                    else:
-                        # write insert #, error msg, and insert
-                        write_bad(filepath, total_inserts, error, insert)
+                    # write insert #, error msg, and insert
+                    write_bad(outputs.get(bad_path), total_inserts,
+                              error, insert)
 
     read_pbar.close()
     values_pbar.close()
+    checkpoint.remove()
 
     if not total_inserts:
-        if not table_name:
+        if not csv_paths:
             error = 'No matching user table found'
         else:
             error = 'No matching INSERT statements found'
         raise_error(ValueError(error))
 
     print(
-        '{}: Processed {} insert(s) with {} value lines and skipped {} errors'.
-        format(filepath, total_inserts, total_values, bad_inserts))
+        '{}: Processed {} insert(s) of {} table(s) with {} value lines and '
+        'skipped {} errors'.format(filepath, total_inserts, len(csv_paths),
+                                   total_values, bad_inserts))
+    print('{}: Encodings read: {}'.format(filepath, decoder.describe()))
+
+
+def table_pattern(user_table=None):
+    """Return the regular expression matching the names of the tables to
+    parse: user_table, names separated by commas being alternatives, or
+    the names of user and member tables. Like USER_TABLES, it matches
+    whole table names."""
+    if not user_table:
+        return USER_TABLES
+    return re.compile(r'(?:%s)$' % user_table.replace(',', '|'),
+                      flags=re.IGNORECASE)
+
+
+def csv_path(base, table_name):
+    """Return the path of the CSV file of a table of the dump at base."""
+    return '{}.{}.csv'.format(base, table_name)
+
+
+def get_field_names(create_table, insert, encoding):
+    """Return the field names of a table, from its create table statement,
+    or from the field names of its insert."""
+    field_names = []
+    if create_table:
+        c_warning('Getting field names from create table')
+        match = parse_sql(create_table.statement, CREATE_FULL)
+        if match and isinstance(match, ParseResults):
+            field_names = match.asDict()['field_names']
+        elif isinstance(match, ParseException):
+            raise_error(match, encoding)
+        else:
+            raise_error(Exception('Unknown error has occurred'))
+    elif insert:
+        c_warning('Getting field names from first insert')
+        insert_fields = re.search('(\(`.*`\))', insert)
+        if not insert_fields:
+            raise_error(ParseException('Field names not found in insert'))
+        fields_only = insert_fields.group(1)
+        match = parse_sql(fields_only, INSERT_FIELDS)
+        if match and isinstance(match, ParseResults):
+            field_names = match.asDict().get('field_names')
+        elif isinstance(match, ParseException):
+            pass
+        else:
+            raise (Exception('Unknown error has occurred'))
+    return field_names
 
 
 def parse_sql(line, pattern):
@@ -273,6 +406,12 @@ def parse_sql(line, pattern):
         return pe
 
 
+def get_table_name(match):
+    """Return the table name of a statement matched by INSERT_BEGIN or
+    CREATE_BEGIN."""
+    return match.asDict()['table_name'][0]
+
+
 def process_insert(insert):
     match = re.search('^(?:.*)?(VALUES.*;)', insert)
     if match:
@@ -280,6 +419,18 @@ def process_insert(insert):
 
 
 def process_values(values):
+    """Return the value tuples of the VALUES part of an insert and None, or
+    None and the parse error.
+
+    Values are read by the fast scanner, and by the pyparsing grammar when
+    the scanner rejects them. pyparsing expands tabs before parsing, so the
+    scanner is given the same text.
+    """
+    if '\t' in values:
+        values = values.expandtabs()
+    values_list = scan_values(values)
+    if values_list is not None:
+        return values_list, None
     result = parse_sql(values, VALUES_ONLY)
     if result and isinstance(result, ParseResults):
         values_list = result.asDict()['values']
@@ -288,6 +439,100 @@ def process_values(values):
         return None, result
 
 
+def parse_insert(insert):
+    """Return the csv lines of the value tuples of insert, their number and
+    None, or None, 0 and the parse error. Inserts without values and create
+    table statements, None, have neither lines nor error."""
+    if insert is None:
+        return None, 0, None
+    values = process_insert(insert)
+    if not values:
+        return None, 0, None
+    values_list, error = process_values(values)
+    if not values_list:
+        return None, 0, error
+    return format_values(values_list), len(values_list), None
+
+
+def parse_inserts(inserts):
+    """Return the results of parse_insert for a list of inserts, in a
+    worker process."""
+    return [parse_insert(insert) for insert in inserts]
+
+
+def parse_statements(statements, pool=None, workers=1):
+    """Yield the statements of read_file or read_mapped followed by the
+    result of parse_insert for their insert, in the order of the dump.
+
+    With a pool of worker processes, see worker_pool, inserts are parsed
+    by the pool in batches of about PARSE_BATCH characters. At most
+    BATCHES_PER_WORKER batches for each worker are read ahead of the
+    statements yielded, so the memory used doesn't depend on the size of
+    the dump.
+    """
+    if pool is None:
+        for statement in statements:
+            yield statement + parse_insert(statement[2])
+        return
+    pending = collections.deque()
+    batches = batch_statements(statements)
+    while True:
+        batch = next(batches, None)
+        if batch is not None:
+            inserts = [statement[2] for statement in batch]
+            pending.append(
+                (batch, pool.apply_async(parse_inserts, (inserts,))))
+            if len(pending) < workers * BATCHES_PER_WORKER:
+                continue
+        elif not pending:
+            break
+        batch, result = pending.popleft()
+        # Waiting with a timeout keeps Control-C working
+        for statement, parsed in zip(batch, result.get(WAIT_TIMEOUT)):
+            yield statement + parsed
+
+
+@contextlib.contextmanager
+def worker_pool(workers):
+    """Return a pool of worker processes parsing inserts, None for a single
+    worker. The pool is stopped when leaving the context, at once on
+    errors."""
+    if workers <= 1:
+        yield None
+        return
+    pool = multiprocessing.Pool(workers, init_worker)
+    try:
+        yield pool
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def batch_statements(statements):
+    """Yield lists of statements with about PARSE_BATCH characters of
+    inserts each."""
+    batch = []
+    size = 0
+    for statement in statements:
+        batch.append(statement)
+        if statement[2] is not None:
+            size += len(statement[2])
+        if size >= PARSE_BATCH:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def init_worker():
+    """Leave Control-C to the parent process, which stops the pool."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
 def raise_error(exception, encoding=None):
     """Combine Exception error msg with last line processed."""
     line = getattr(exception, 'line', None)
@@ -300,92 +545,299 @@ def raise_error(exception, encoding=None):
     raise exception
 
 
-def read_file(sqlfile):
-    # Current CreateTable object
-    create_table = None
-    # List of insert statments
-    table_name = None
+def read_file(sqlfile, decoder, ascii_only=False, skip=0,
+              tables=USER_TABLES, table_name=None, creates=None):
+    """Yield the create table, table name, statement and bytes read for
+    each create table and insert of the tables whose names match the tables
+    regular expression, after the first skip bytes. The statement is None
+    for create tables, and the create table of the table of inserts is None
+    when it wasn't found.
+
+    table_name and creates are the table of the last statement and the
+    CreateTable objects of the tables found before skip, when resuming.
+
+    sqlfile is read in binary mode, lines are decoded by decoder, a
+    ChunkDecoder, or are filtered to printable ASCII with ascii_only.
+    Inserts longer than STREAM_SIZE are yielded by batches of their value
+    tuples, see split_insert, with no bytes read but for the last batch."""
+    # CreateTable objects of the tables
+    creates = dict(creates or {})
+    # table_name is the table of the current statement, or of the last insert
     parsing = None
-    # Estimate byte length based on line length
-    byte_num = 0
-    while True:
-        lines = sqlfile.readlines(READ_BUFFER)
-        if not lines:
-            break
-
-        for line in lines:
-            line = line.replace('\11\12\15\40-\176', '')
+    # Characters of the statement parsed
+    size = 0
+    # Lines are read by pieces, long lines aren't read at once
+    pieces = LinePieces(sqlfile, READ_BUFFER)
+    for line in pieces:
+        byte_num = pieces.position
+        if byte_num <= skip:
+            # Already parsed before the checkpoint resumed from
+            continue
+        if ascii_only:
+            line = filter_ascii(line)
+        line = decoder.decode(line, pieces.ends_line)
+        if ESCAPED_QUOTES in line:
             line = re.sub(r'\\\\\\"(\w*)\\\\\\"', r'\1', line)
-            byte_num += len(line)
-            valid_insert = None
-
-            # If not parsing a CREATE or INSERT statement, look for one
-            if parsing:
-                # Continue parsing the current statement
-                parsing.statement.append(line)
-                if parsing.ending in line:
-                    no_newlines = rm_newlines(parsing.statement)
-                    if isinstance(parsing, CreateTable):
-                        create_table.statement = ''.join(no_newlines)
-                    elif isinstance(parsing, InsertInto):
-                        valid_insert = ''.join(no_newlines)
-                    parsing = None
-            else:
+        valid_insert = None
+        valid_create = None
+
+        # If not parsing a CREATE or INSERT statement, look for one
+        if parsing:
+            # Continue parsing the current statement
+            parsing.statement.append(line)
+            size += len(line)
+            if parsing.ending in line:
+                no_newlines = rm_newlines(parsing.statement)
+                if isinstance(parsing, CreateTable):
+                    parsing.statement = ''.join(no_newlines)
+                    valid_create = parsing
+                elif isinstance(parsing, InsertInto):
+                    valid_insert = ''.join(no_newlines)
+                parsing = None
+        elif not pieces.starts_line:
+            # Statements start at the start of lines
+            continue
+        else:
+            insert = None
+            size = len(line)
+            if begins_with(line, 'INSERT INTO'):
                 insert = parse_sql(line, INSERT_BEGIN)
-                if insert and isinstance(insert, ParseResults):
-                    if not table_name:
-                        table_name = insert.asDict().get('table_name')
+            if insert and isinstance(insert, ParseResults):
+                table_name = get_table_name(insert)
+                if tables.match(table_name):
                     insert_into = InsertInto([line])
                     if insert_into.ending in line:
                         no_newlines = rm_newlines([line])
                         valid_insert = ''.join(no_newlines)
                     else:
                         parsing = insert_into
-                        continue
-                else:
+            else:
+                value = None
+                if table_name and tables.match(table_name) and \
+                        begins_with(line, 'VALUES'):
                     value = parse_sql(line, VALUES_ONLY)
-                    if value and isinstance(value, ParseResults):
-                        value_only = InsertInto([line])
-                        if value_only.ending in line:
-                            no_newlines = rm_newlines([line])
-                            valid_insert = ''.join(no_newlines)
-                        else:
-                            parsing = value_only
-                            continue
-                    elif not create_table:
-                        create = parse_sql(line, CREATE_BEGIN)
-                        if create and isinstance(create, ParseResults):
-                            if not table_name:
-                                table_name = create.asDict().get('table_name')
-                                create_table = CreateTable([line])
-                                if create_table.ending not in line:
-                                    parsing = create_table
-
-            if valid_insert:
-                yield create_table, table_name, valid_insert, byte_num
+                if value and isinstance(value, ParseResults):
+                    value_only = InsertInto([line])
+                    if value_only.ending in line:
+                        no_newlines = rm_newlines([line])
+                        valid_insert = ''.join(no_newlines)
+                    else:
+                        parsing = value_only
+                elif begins_with(line, 'CREATE TABLE'):
+                    create = parse_sql(line, CREATE_BEGIN)
+                    if create and isinstance(create, ParseResults):
+                        table_name = get_table_name(create)
+                        if tables.match(table_name) and \
+                                table_name not in creates:
+                            create_table = CreateTable([line])
+                            creates[table_name] = create_table
+                            if create_table.ending not in line:
+                                parsing = create_table
+                            else:
+                                create_table.statement = ''.join(
+                                    rm_newlines([line]))
+                                valid_create = create_table
+
+        if isinstance(parsing, InsertInto) and size >= STREAM_SIZE:
+            # The rest of the insert is read by chunks
+            head = ''.join(rm_newlines(parsing.statement))
+            parsing = None
+            chunks = pieces.chunks(CHUNK_SIZE)
+            if ascii_only:
+                chunks = (filter_ascii(chunk) for chunk in chunks)
+            chunks = (decoder.decode(chunk, pieces.ends_line)
+                      for chunk in chunks)
+            for insert, chars in split_insert(
+                    head, clean_chunks(chunks), pieces.skip_line):
+                yield creates.get(table_name), table_name, insert, chars
+            # The end of the line after the insert isn't decoded
+            decoder.reset()
+
+        if valid_create:
+            yield valid_create, table_name, None, byte_num
+        if valid_insert:
+            yield creates.get(table_name), table_name, valid_insert, byte_num
+
+
+def read_mapped(filepath, decoder, ascii_only=False, skip=0,
+                tables=USER_TABLES, table_name=None, creates=None):
+    """Yield the same as read_file for a file that isn't compressed.
+
+    The file is memory mapped and statements are found in it directly:
+    they start at the start of a line, or after the previous statement,
+    and end at the first semicolon outside of quoted strings. Only the
+    statements of interest are decoded, each one as a chunk of decoder.
+    Statement starts are matched with the grammars decoded as latin1,
+    which decodes any byte.
+    """
+    # CreateTable objects of the tables
+    creates = dict(creates or {})
+    # table_name is the table of the current statement, or of the last insert
+    # Whether inserts starting the same way match the grammar, and their
+    # table name
+    insert_tables = {}
+    if not os.path.getsize(filepath):
+        return
+    with open(filepath, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        pos = skip
+        while pos < len(data):
+            start = LEADING_SPACE.match(data, pos).end()
+            head = data[start:start + HEAD_SIZE]
+            keyword = head[:12].upper()
+            statement = None
+            if keyword.startswith('INSERT INTO'):
+                # The grammar reads up to the first parenthesis at most,
+                # inserts starting the same way are matched once
+                key = head[:head.find('(') + 1] or head
+                if key not in insert_tables:
+                    insert = parse_sql(key.decode('iso-8859-1'),
+                                       INSERT_BEGIN)
+                    if insert and isinstance(insert, ParseResults):
+                        insert_tables[key] = (
+                            True, get_table_name(insert))
+                    else:
+                        insert_tables[key] = (False, None)
+                matched, insert_table = insert_tables[key]
+                if matched:
+                    table_name = insert_table
+                    if tables.match(table_name):
+                        statement = InsertInto
+            elif keyword.startswith('VALUES') and table_name and \
+                    tables.match(table_name):
+                line_end = data.find('\n', start)
+                if line_end < 0:
+                    line_end = len(data)
+                value = parse_sql(
+                    data[start:line_end].decode('iso-8859-1'), VALUES_ONLY)
+                if value and isinstance(value, ParseResults):
+                    statement = InsertInto
+            elif keyword.startswith('CREATE TABLE'):
+                create = parse_sql(head.decode('iso-8859-1'),
+                                   CREATE_BEGIN)
+                if create and isinstance(create, ParseResults):
+                    table_name = get_table_name(create)
+                    if tables.match(table_name) and \
+                            table_name not in creates:
+                        statement = CreateTable
+
+            end = -1
+            if statement:
+                end = statement_end(data, start)
+            if end < 0:
+                # Not a statement of interest, go on with the next line
+                pos = data.find('\n', start)
+                if pos < 0:
+                    break
+                pos += 1
+                continue
+            pos = end
+
+            if statement is InsertInto and end - start > STREAM_SIZE:
+                # Long inserts are decoded by chunks
+                chunks = clean_chunks(decode_chunks(
+                    data, start, end, decoder, ascii_only))
+                for insert, chars in split_insert(
+                        next(chunks), chunks, lambda: end):
+                    yield creates.get(table_name), table_name, insert, chars
+                continue
+
+            text = data[start:end]
+            if ascii_only:
+                text = filter_ascii(text).decode('ascii')
+            else:
+                text = decoder.decode(text)
+            text = clean_text(text)
+            if statement is CreateTable:
+                creates[table_name] = CreateTable(text)
+                yield creates[table_name], table_name, None, end
+            else:
+                yield creates.get(table_name), table_name, text, end
+    finally:
+        data.close()
+
+
+def decode_chunks(data, start, end, decoder, ascii_only):
+    """Yield the text of data from start to end by chunks of CHUNK_SIZE
+    bytes, decoded like the statements of read_mapped."""
+    for pos in xrange(start, end, CHUNK_SIZE):
+        chunk = data[pos:min(pos + CHUNK_SIZE, end)]
+        if ascii_only:
+            yield filter_ascii(chunk).decode('ascii')
+        else:
+            yield decoder.decode(chunk, pos + CHUNK_SIZE >= end)
+
+
+def clean_chunks(chunks):
+    """Yield the chunks of text of a statement cleaned like by clean_text.
+
+    Escaped quotes around words are removed in whole: the end of a chunk
+    where some could start is kept for the next chunk."""
+    rest = ''
+    for chunk in chunks:
+        text = rest + chunk
+        end = len(text.rstrip(ESCAPED_CHARS))
+        if '\\' in text[end:]:
+            text, rest = text[:end], text[end:]
+        else:
+            rest = ''
+        yield clean_text(text)
+    if rest:
+        yield clean_text(rest)
+
+
+def clean_text(text):
+    """Return text without the escaped quotes around words and newlines."""
+    if ESCAPED_QUOTES in text:
+        text = re.sub(r'\\\\\\"(\w*)\\\\\\"', r'\1', text)
+    return text.replace('\n', '').replace('\r', '')
+
+
+def split_insert(head, chunks, finish):
+    """Yield the batches of value tuples of a long insert, see split_values,
+    with the characters read after the insert for the last batch, None for
+    the others, so no checkpoint is saved in the middle of the insert.
+
+    head is the start of the insert, chunks the parts of its text following
+    it, and finish is called once the insert is read, to return the
+    characters read.
+    """
+    batches = split_values(head, chunks)
+    batch = next(batches, None)
+    for following in batches:
+        yield batch, None
+        batch = following
+    chars = finish()
+    if batch is not None:
+        yield batch, chars
+
+
+def begins_with(line, keyword):
+    """Return True when line can begin with keyword, in any case, after
+    whitespace. Lines are tested like by the caseless keywords of the
+    grammars, so the grammars are only tried on lines that can match."""
+    start = LEADING_SPACE.match(line).end()
+    head = line[start:start + len(keyword)]
+    # pyparsing expands tabs, which could turn one into a single space
+    return head.upper() == keyword or '\t' in head
 
 
 def rm_newlines(lines):
     return [x.replace('\n', '').replace('\r', '') for x in lines]
 
 
-def write_bad(filepath, insert_num, error, insert):
-    with open(filepath + '.bad_inserts.txt', 'a') as bad:
-        bad.write('Insert #{}\n'.format(insert_num))
-        bad.write('Error:{}\n'.format(error))
-        bad.write('\nLine:\n{}\n\n'.format(insert))
-        bad.write('******\n')
+def write_bad(f, insert_num, error, insert):
+    f.write(u'Insert #{}\n'.format(insert_num))
+    f.write(u'Error:{}\n'.format(error))
+    f.write(u'\nLine:\n{}\n\n'.format(insert))
+    f.write(u'******\n')
 
 
-def write_values(values_list, path, encoding):
-    """Write values to csv and return number of lines written."""
-    lines = 0
-    with io.open(path + '.csv', 'a', encoding=encoding) as cf:
-        for values in values_list:
-            cf.write(','.join(['"%s"' % value for value in values]))
-            cf.write(u'\n')
-            lines += 1
-    return lines
+def format_values(values_list):
+    """Return the csv lines of values."""
+    return u''.join(u','.join([u'"%s"' % value for value in values]) + u'\n'
+                    for values in values_list)
 
 
 if __name__ == '__main__':
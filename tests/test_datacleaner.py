@@ -100,6 +100,19 @@ def test_parse_row_delimiter_in_column():
     assert not fail
 
 
+def test_record_plan():
+    """Validate a compiled plan prepares every row of a file."""
+    headers = ['e', 'fn', 'ln', 'a1', 'a2', 'x', 'doby', 'dobm']
+    plan = dc.RecordPlan(headers)
+    row = ['a@b.com', 'Bob', '', ' 1 St', 'null', 'z', '1990', '2']
+    assert plan.prep(dict(zip(headers, row))) == {
+        'a': ' 1 St', 'e': 'a@b.com', 'd': 'b.com', 'dob': '1990-02',
+        'n': 'Bob'}
+    row = ['bad@@b.com', '', '', '', '<N>', '', '', '']
+    assert plan.prep(dict(zip(headers, row))) == {
+        'e': 'bad@b.com', 'd': 'b.com', 'dob': ''}
+
+
 def test_get_headers_double_quoted():
     """Validate handling of double quoted header columns."""
     str_buffer = StringIO.StringIO()
@@ -122,9 +135,122 @@ def test_get_headers_single_quoted():
     assert found_headers == shortened_headers
 
 
+def test_get_headers_near_misses():
+    """Validate near-miss header names and their confidence."""
+    str_buffer = StringIO.StringIO('user-email;EmailAddr;unknown\n')
+    found_headers = dc.get_headers(str_buffer, ';', 3, with_confidence=True)
+    assert found_headers == (['e', 'e', 'x'], [0.9, 0.8, 0.0])
+
+
 def test_set_headers_sh():
     """Validate handling of headers provided."""
     dc.args.sh = 'e,fn,ln'
     headers = ['e', 'fn', 'ln']
     set_headers = dc.set_headers(None, None)
     assert set_headers == headers
+
+
+def test_parse_shards_matches_serial(tmpdir, monkeypatch):
+    """Validate parallel cleaning writes the same output as a serial run."""
+    source = tmpdir.join('source.csv')
+    lines = []
+    for i in range(500):
+        if i % 7:
+            lines.append('"{0}", user{0}@mail.com ,pass{0}\n'.format(i))
+        else:
+            lines.append('broken line {}\n'.format(i))
+    source.write(''.join(lines))
+
+    serial_csv = str(tmpdir.join('serial.csv'))
+    serial_err = str(tmpdir.join('serial.err'))
+    with open(str(source), 'rb') as F, open(serial_csv, 'wb') as out_file, \
+            open(serial_err, 'wb') as error_file:
+        writer = dc.csv_writer(out_file, dialect=dc.myDialect())
+        row_parser = dc.RowParser(csv.excel, 3)
+        for line in F:
+            row_parser.clean(line, writer, error_file)
+        writer.flush()
+
+    parallel_csv = str(tmpdir.join('parallel.csv'))
+    parallel_err = str(tmpdir.join('parallel.err'))
+    open(parallel_csv, 'wb').close()
+    monkeypatch.setattr(dc.args, 'workers', 3)
+    pbar = dc.TqdmUpTo(disable=True)
+    dc.parse_shards(str(source), 0, parallel_csv, parallel_err, 3,
+                    csv.excel, pbar)
+
+    assert open(parallel_csv, 'rb').read() == open(serial_csv, 'rb').read()
+    assert open(parallel_err, 'rb').read() == open(serial_err, 'rb').read()
+
+
+def test_byte_writer_matches_unicode_writer():
+    """Validate batched UTF-8 output is the same as the transcoding writer."""
+    rows = [['caf\xc3\xa9', 'a"b', 'c\\d'], ['1', '', 'x,y']] * 50
+    unicode_buffer = StringIO.StringIO()
+    unicode_writer = dc.UnicodeWriter(unicode_buffer, dialect=dc.myDialect())
+    for row in rows:
+        unicode_writer.writerow([field.decode('utf-8') for field in row])
+
+    byte_buffer = StringIO.StringIO()
+    byte_writer = dc.csv_writer(byte_buffer, dialect=dc.myDialect())
+    byte_writer.buffer_size = 100
+    byte_writer.writerows(rows)
+    byte_writer.flush()
+    assert byte_buffer.getvalue() == unicode_buffer.getvalue()
+
+
+def test_byte_reader_matches_unicode_reader():
+    """Validate UTF-8 rows are read as str without transcoding."""
+    data = '"caf\xc3\xa9",UNHEX(\'B960D2C0\')\r\nx,"multi\nline"\n'
+    byte_rows = list(dc.csv_reader(StringIO.StringIO(data)))
+    unicode_rows = list(dc.UnicodeReader(StringIO.StringIO(data)))
+    decoded_rows = [
+        [field.decode('utf-8') for field in row] for row in byte_rows
+    ]
+    assert decoded_rows == unicode_rows
+    assert isinstance(byte_rows[0][0], str)
+    assert byte_rows[0][1] == '185.96.210.192'
+
+
+def test_json_writer_matches_write_json(tmpdir):
+    """Validate cleaned rows written straight to JSON match write_json."""
+    rows = [['e', 'u', 'p']] + [
+        ['user{}@mail.com'.format(i), 'user{}'.format(i), 'p"{}'.format(i)]
+        for i in range(50)
+    ]
+    with tmpdir.as_cwd():
+        with open('two_pass_cleaned.csv', 'wb') as out_file:
+            writer = dc.csv_writer(out_file, dialect=dc.myDialect())
+            writer.writerows(rows)
+            writer.flush()
+        dc.write_json('two_pass_cleaned.csv')
+
+        with open('fused_cleaned.csv', 'wb') as out_file:
+            writer = dc.csv_writer(out_file, dialect=dc.myDialect())
+            json_writer = dc.JsonWriter('fused_cleaned.csv', writer)
+            for row in rows:
+                json_writer.writerow(row)
+            json_writer.close()
+
+        assert open('fused_cleaned.csv', 'rb').read() == \
+            open('two_pass_cleaned.csv', 'rb').read()
+        two_pass = open('success/two_pass.json', 'rb').read()
+        fused = open('success/fused.json', 'rb').read()
+        assert fused == two_pass.replace('two pass', 'fused')
+        assert len(fused.splitlines()) == 50
+
+
+def test_json_writer_all_duplicates(tmpdir, monkeypatch):
+    """Validate a file of duplicate records only is written as empty."""
+    rows = [['e', 'u'], ['a@b.com', 'a'], ['c@d.com', 'c']]
+    monkeypatch.setattr(dc.args, 'dedup', True)
+    with tmpdir.as_cwd():
+        for _ in range(2):
+            json_writer = dc.JsonWriter('dup_cleaned.csv', None)
+            for row in rows:
+                json_writer.writerow(row)
+            json_writer.close()
+        assert json_writer.line_count == 0
+        lines = open('success/dup.json', 'rb').read().split('\n')
+    assert len(lines) == 4
+    assert lines[2:] == ['', '']
@@ -0,0 +1,215 @@
+import json
+import os
+import StringIO
+
+from dbtools.charset import ChunkDecoder
+from dbtools.checkpoint import Checkpoint
+from dbtools.fileio import OutputPool, compressed_bytes, compression, \
+    open_file, open_output, strip_compression
+from dbtools.jsonio import JsonLinesWriter
+from dbtools import sqlsplit
+from dbtools.sqlsplit import LinePieces, split_values, statement_end
+from dbtools.sqlvalues import scan_values
+
+
+def test_json_lines_writer():
+    """Validate records are written like json.dumps, one per line."""
+    records = [{'_source': {'e': u'caf\xe9', 'r': 'a / b'}}, {'cid': 2}]
+    for separators in (None, (',', ':')):
+        f = StringIO.StringIO()
+        with JsonLinesWriter(f, separators=separators, buffer_size=10) as w:
+            for record in records:
+                w.write(record)
+        expected = [json.dumps(r, separators=separators) for r in records]
+        assert [json.loads(line) for line in f.getvalue().splitlines()] == \
+            [json.loads(line) for line in expected]
+        if separators is None:
+            assert f.getvalue() == '\n'.join(expected) + '\n'
+
+
+def test_compressed_files(tmpdir):
+    """Validate compressed files are read back as written, appended to and
+    rewound."""
+    lines = ['line {}\n'.format(i) for i in range(10000)]
+    for kind in ('gz', 'bz2'):
+        path = str(tmpdir.join('data.csv.' + kind))
+        with open_output(path) as f:
+            for line in lines[:5000]:
+                f.write(line)
+        with open_output(path, append=True) as f:
+            for line in lines[5000:]:
+                f.write(line)
+        assert compression(path) == kind
+        assert strip_compression(path) == str(tmpdir.join('data.csv'))
+
+        with open_file(path) as f:
+            assert f.readline() == lines[0]
+            assert list(f) == lines[1:]
+            assert compressed_bytes(f) == os.path.getsize(path)
+            f.seek(len(lines[0]))
+            assert f.readline() == lines[1]
+
+    plain = str(tmpdir.join('plain.csv'))
+    with open_output(plain) as f:
+        f.write(lines[0])
+    assert compression(plain) is None
+    with open_file(plain) as f:
+        assert compressed_bytes(f) is None
+        assert f.read() == lines[0]
+
+
+def test_plain_files_like_bzip2(tmpdir):
+    """Validate plain files starting with "BZh" aren't read as bzip2."""
+    for name, text in (('names.csv', 'BZhang,wei\n'),
+                       ('sizes.csv', 'BZh9,big\n'), ('short.csv', 'BZh')):
+        path = str(tmpdir.join(name))
+        with open(path, 'wb') as f:
+            f.write(text)
+        assert compression(path) is None
+        with open_file(path) as f:
+            assert f.read() == text
+
+
+def test_output_pool(tmpdir):
+    """Validate pooled outputs keep what was written to them when closed
+    to open others, and outputs already written to are appended to."""
+    paths = [str(tmpdir.join('{}.csv'.format(i))) for i in range(5)]
+    with open(paths[4], 'wb') as f:
+        f.write('old\n')
+    opened = []
+
+    def opener(path, append):
+        opened.append(path)
+        return open_output(path, append=append)
+
+    with OutputPool(opener, size=2, written=paths[4:]) as pool:
+        for i in range(3):
+            for path in paths:
+                pool.get(path).write('{}\n'.format(i))
+            pool.get(paths[0]).write('again\n')
+        assert list(pool.files) == [paths[4], paths[0]]
+    assert opened.count(paths[0]) == 4
+    with open(paths[0], 'rb') as f:
+        assert f.read() == '0\nagain\n1\nagain\n2\nagain\n'
+    with open(paths[4], 'rb') as f:
+        assert f.read() == 'old\n0\n1\n2\n'
+
+
+def test_checkpoint_resume(tmpdir):
+    """Validate resuming truncates outputs to their checkpointed sizes and
+    ignores checkpoints of other inputs or of lost output."""
+    source = str(tmpdir.join('dump.sql'))
+    output = str(tmpdir.join('dump.csv'))
+    with open(source, 'wb') as f:
+        f.write('INSERT INTO t VALUES (1);\n' * 10)
+    with open(output, 'wb') as f:
+        f.write('1\n')
+
+    checkpoint = Checkpoint(source, 'csv')
+    assert checkpoint.resume() is None
+    checkpoint.save(26, [output, str(tmpdir.join('missing.csv'))], lines=1)
+    with open(output, 'ab') as f:
+        f.write('2\n')
+
+    state = Checkpoint(source, 'csv').resume()
+    assert state['offset'] == 26
+    assert state['lines'] == 1
+    with open(output, 'rb') as f:
+        assert f.read() == '1\n'
+    assert Checkpoint(source, 'json').resume() is None
+
+    os.remove(output)
+    assert Checkpoint(source, 'csv').resume() is None
+    checkpoint.save(26, [])
+    checkpoint.remove()
+    assert Checkpoint(source, 'csv').load() is None
+
+
+def test_scan_values():
+    """Validate values are read like the VALUES grammar of parse_sql, and
+    syntax left to the grammar is rejected."""
+    assert scan_values(
+        u"VALUES (1,'it''s',NULL),( -2.5 , 'a\\'b\\\\' , \"q\" ,'') ;") == [
+            [u'1', u"it''s", u'NULL'], [u'-2.5', u"a\\'b\\\\", u'q', u'']]
+    assert scan_values(u"VALUES('a,b)', '(');") == [[u'a,b)', u'(']]
+    for statement in (u"VALUES (1e5);", u"VALUES (0x1F);", u"VALUES ();",
+                      u"VALUES (CONV('1', 10, 16) + 5);", u"VALUES (1 2);",
+                      u"VALUES (1)(2);", u"VALUES (1),;", u"VALUES (1)2);",
+                      u"VALUES ('a);", u"VALUES ('\\xZ');", u"VALUES (1)"):
+        assert scan_values(statement) is None
+
+
+def test_statement_end():
+    """Validate statements end at the first semicolon outside of quotes."""
+    data = ("INSERT INTO t VALUES (1,'a;b\\';c'),(2,\"d;\"),(3,'e'';f');"
+            "\nINSERT INTO t VALUES (4,'g");
+    end = statement_end(data, 0)
+    assert data[:end].endswith("'e'';f');")
+    assert statement_end(data, end + 1) == -1
+    assert statement_end("CREATE TABLE t (\n  a int\n);\n", 0) == 27
+
+
+def test_split_values(monkeypatch):
+    """Validate long inserts are split in inserts of whole tuples, whatever
+    the chunks they are read from, up to the end of the insert."""
+    monkeypatch.setattr(sqlsplit, 'BATCH_SIZE', 20)
+    tuples = ["(1,'a),(b')", "(2,\"c;\\\"\")", "(3,CONV('1', 2, 3) + 4)",
+              "(4,'d''e')", "(5,NULL)"]
+    text = ("INSERT INTO `t` (`a`) VALUES " + ',\n'.join(tuples) +
+            ";\nINSERT INTO `t` VALUES (6);\n")
+    for size in (1, 7, 100):
+        f = StringIO.StringIO(text)
+        pieces = LinePieces(f, size)
+        head = pieces.read(40)
+        batches = list(split_values(head, pieces.chunks(size)))
+        prefix = "INSERT INTO `t` (`a`) VALUES "
+        assert all(b.startswith(prefix) and b.endswith(');')
+                   for b in batches)
+        rows = ','.join(b[len(prefix):-1] for b in batches)
+        assert rows.replace('\n', '') == ','.join(tuples)
+        assert len(batches) > 1
+        assert pieces.skip_line() == text.index('INSERT', 1)
+
+
+def test_chunk_decoder():
+    """Validate chunks are decoded in the encoding their letters tell, or
+    in the one of the chunks before them, and mojibake is repaired."""
+    russian = u'\u041f\u0440\u0438\u0432\u0435\u0442 \u043c\u0438\u0440'
+    short = u'\u0434\u0430'
+    latin = u'caf\xe9 M\xfcller gar\xe7on'
+
+    def mojibake(text):
+        return text.encode('cp1251').decode('iso-8859-1').encode('utf-8')
+
+    decoder = ChunkDecoder()
+    assert decoder.decode('plain') == u'plain'
+    assert decoder.decode(latin.encode('utf-8')) == latin
+    assert decoder.decode(mojibake(russian)) == russian
+    assert decoder.decode(mojibake(short)) == short
+    assert decoder.decode(russian.encode('utf-8')) == russian
+    assert decoder.decode(latin.encode('iso-8859-1')) == latin
+    assert decoder.decode(russian.encode('cp1251')) == russian
+    assert decoder.decode(short.encode('cp1251')) == short
+    data = russian.encode('utf-8')
+    assert decoder.decode(data[:3], final=False) + \
+        decoder.decode(data[3:]) == russian
+
+    assert ChunkDecoder(decoder.scores).decode(
+        short.encode('cp1251')) == short
+    assert ChunkDecoder().decode(short.encode('cp1251')) == u'\xe4\xe0'
+
+
+def test_chunk_decoder_latin_names():
+    """Validate UTF-8 latin names aren't repaired as mojibake, on their own
+    or after other UTF-8 text."""
+    names = [u'\xd1o\xf1o \xd1\xfa\xf1ez', u'Jo\xe3o Sim\xf5es',
+             u'Fran\xe7ois Lef\xe8vre', u'H\xe9l\xe8ne C\xf4t\xe9',
+             u'Pe\xf1a Ib\xe1\xf1ez', u'Concei\xe7\xe3o']
+    for name in names:
+        assert ChunkDecoder().decode(name.encode('utf-8')) == name
+
+    decoder = ChunkDecoder()
+    for i in range(50):
+        decoder.decode(u"({},'Caf\xe9 M\xfcller')".format(i).encode('utf-8'))
+    for name in names + [u'\xc0\xcd\xd3\xda \xd1\xc3\xd5']:
+        assert decoder.decode(name.encode('utf-8')) == name
@@ -0,0 +1,291 @@
+import StringIO
+
+from dc.asciifilter import AsciiFile, filter_ascii
+from dc import file_fingerprint
+from dc.dedup import RecordSet, record_key
+from dc.detect import detect_dialect, sample_lines
+from dc.hashes import HashTyper
+from dc.jobs import run_jobs
+from dc.lineindex import LineIndex
+from dc.memo import DetectionMemo, line_signature
+from dc.parallel import iter_range, line_ranges
+from dc.plan import Plan
+from dc.releases import ReleaseCache
+from dc.sampling import reservoir_sample, seek_sample, selection_sample
+
+
+def test_filter_ascii():
+    """Validate only tab, newlines and printable ascii are kept."""
+    assert filter_ascii('a\x00b\tc\xe9\r\n\x7f') == 'ab\tc\r\n'
+
+
+def test_ascii_file_lines():
+    """Validate lines are filtered and a garbage-only last line is dropped."""
+    raw = StringIO.StringIO('one\x01\n\x02two\n\x03\x04')
+    assert list(AsciiFile(raw)) == ['one\n', 'two\n']
+
+
+def test_ascii_file_offsets():
+    """Validate tell() and seek() use the offsets of the wrapped file."""
+    f = AsciiFile(StringIO.StringIO('\x01first\nsecond\n'))
+    assert f.readline() == 'first\n'
+    position = f.tell()
+    assert position == 7
+    assert f.readline() == 'second\n'
+    f.seek(position)
+    assert f.readline() == 'second\n'
+    f.seek(0)
+    assert next(f) == 'first\n'
+    assert f.tell() == 7
+
+
+def test_ascii_file_offsets_while_iterating(tmpdir):
+    """Validate tell() is exact while iterating a file reading ahead, so
+    shards of the rest of the file start at the next line."""
+    path = tmpdir.join('source.csv')
+    lines = ['line\x01 {}\n'.format(i) for i in range(20000)]
+    path.write(''.join(lines))
+    with open(str(path), 'rb') as raw:
+        f = AsciiFile(raw)
+        for _ in range(3):
+            next(f)
+        start = f.tell()
+        assert start == len(''.join(lines[:3]))
+    ranges = line_ranges(str(path), start, 4)
+    with open(str(path), 'rb') as raw:
+        rest = [line for begin, end in ranges
+                for line in iter_range(raw, begin, end)]
+    assert rest == lines[3:]
+
+
+def test_sample_lines_bounded():
+    """Validate only complete lines from the start, middle and end are read."""
+    data = ''.join('line{}\n'.format(i) for i in range(10000))
+    f = StringIO.StringIO(data)
+    lines = sample_lines(f, size=100)
+    assert f.tell() == 0
+    assert lines[0] == 'line0\n'
+    assert lines[-1] == 'line9999\n'
+    assert all(line in data for line in lines)
+    assert sum(len(line) for line in lines) <= 300
+
+
+def test_detect_dialect():
+    """Validate the delimiter splitting most lines the same way wins."""
+    lines = ['{}|name {}|e{}@x.com\n'.format(i, i, i) for i in range(50)]
+    detection = detect_dialect(lines, [',', ' ', '|', ':'])
+    assert detection.dialect.delimiter == '|'
+    assert detection.column_count == 3
+    assert detection.confidence == 1
+    assert detect_dialect(['single\n'] * 5, [',', '|']) is None
+
+
+def test_detect_dialect_names_with_spaces():
+    """Validate spaces inside fields don't win over the real delimiter, and
+    are used when nothing else splits the lines."""
+    delimiters = ('\t', ' ', ';', ',', '|', ':')
+    samples = [
+        (['John Smith,j{}@m.com\n'.format(i) for i in range(50)], ',', 2),
+        (['j{}@m.com;Anna Lee\n'.format(i) for i in range(50)], ';', 2),
+        (['John Smith {0},j{0}@m.com,secret word\n'.format(i)
+          for i in range(50)], ',', 3),
+        (['j{0}@m.com pass{0}\n'.format(i) for i in range(50)], ' ', 2),
+    ]
+    for lines, delimiter, column_count in samples:
+        detection = detect_dialect(lines, delimiters)
+        assert detection.dialect.delimiter == delimiter
+        assert detection.column_count == column_count
+
+
+def test_file_fingerprint(tmpdir):
+    """Validate the fingerprint follows the content, not the path."""
+    path = tmpdir.join('a.csv')
+    path.write('x' * 200000)
+    fingerprint = file_fingerprint(str(path))
+    path.rename(tmpdir.join('b.csv'))
+    assert file_fingerprint(str(tmpdir.join('b.csv'))) == fingerprint
+    tmpdir.join('b.csv').write('x' * 199999 + 'y')
+    assert file_fingerprint(str(tmpdir.join('b.csv'))) != fingerprint
+
+
+def test_detection_memo(tmpdir):
+    """Validate signatures only match confirmed decisions."""
+    memo = DetectionMemo(str(tmpdir.join('memo.db')))
+    signature = line_signature('"Email";"Password"\r\n')
+    assert signature == line_signature("email; password\n")
+    memo.remember('dialect', 'f1', signature, {'delimiter': ';'}, False)
+    assert memo.recall('dialect', 'f1', signature) is None
+    assert memo.recall('dialect', 'f1', signature,
+                       confirmed_only=False) == {'delimiter': ';'}
+    assert memo.recall('dialect', 'f2', signature) is None
+    memo.remember('dialect', 'f1', signature, {'delimiter': ';'}, True)
+    assert memo.recall('dialect', 'f2', signature) == {'delimiter': ';'}
+    memo.close()
+
+
+def test_hash_typer():
+    """Validate prefilters and shape memo agree with hashID."""
+    typer = HashTyper()
+    assert typer.is_hash('5f4dcc3b5aa765d61d8327deb882cf99')
+    assert typer.is_hash('098f6bcd4621d373cade4e832627b4f6')
+    assert len(typer.shapes) == 1
+    assert typer.is_hash('$2y$10$abcdefghijklmnopqrstuv')
+    assert not typer.is_hash('user@mail.com')
+    assert not typer.is_hash('abc')
+    for value in ('john1985', 'abcdefghijklmnop', 'md5' + 'a' * 32, 'x' * 27):
+        assert typer.is_hash(value) == typer.identify(value)
+
+
+def upper_task(path):
+    if path == 'bad':
+        raise ValueError('bad file')
+    return path.upper()
+
+
+def test_run_jobs():
+    """Validate every task runs once and failures are returned."""
+    tasks = [('bad',), ('a',), ('bb',), ('ccc',)]
+    results = sorted(run_jobs(upper_task, tasks, 2, size=lambda t: len(t[0])))
+    assert results == [
+        ('a', True, 'A'), ('bad', False, 'bad file'), ('bb', True, 'BB'),
+        ('ccc', True, 'CCC')]
+
+
+def test_plan(tmpdir):
+    """Validate plans are saved, loaded and looked up by content."""
+    planned = tmpdir.join('a.csv')
+    planned.write('1;2\n')
+    plan = Plan()
+    plan.plan_file(str(planned), headers=['u', 'p'])
+    plan.save(str(tmpdir.join('plan.json')))
+
+    plan = Plan.load(str(tmpdir.join('plan.json')))
+    assert plan.paths() == [str(planned)]
+    planned.rename(tmpdir.join('b.csv'))
+    assert plan.lookup(str(tmpdir.join('b.csv')))['headers'] == ['u', 'p']
+    tmpdir.join('c.csv').write('3;4\n')
+    assert plan.lookup(str(tmpdir.join('c.csv'))) is None
+
+
+def test_release_cache(tmpdir):
+    """Validate releases are read once and remembered between merges."""
+    json_file = tmpdir.join('a.json')
+    json_file.write('{"_source": {"r": "some release"}}\n')
+    cache = ReleaseCache(str(tmpdir))
+    assert cache.release(str(json_file)) == 'some_release'
+    cache.save()
+
+    # The file keeps its inode, so its first record isn't read again
+    with open(str(json_file), 'r+b') as f:
+        f.write('{"_source": {"r": "other"}}\n')
+    cache = ReleaseCache(str(tmpdir))
+    assert cache.release(str(json_file)) == 'some_release'
+
+    # Files written by -j name the field "breach"
+    exported = tmpdir.join('b.json')
+    exported.write('{"_source": {"breach": "exported release"}}\n')
+    assert cache.release(str(exported)) == 'exported_release'
+
+
+def test_record_key():
+    """Validate records are identified by their normalized fields."""
+    fields = ('email', 'hash')
+    key = record_key(
+        {'email': u'A@b.com ', 'hash': ['y', 'x'], 'n': 'A'}, fields)
+    assert key == record_key({'email': 'a@b.com', 'hash': ['x', 'y']}, fields)
+    assert record_key({'email': u'A@b.com ', 'p': 'x'}) == \
+        record_key({'email': 'a@b.com', 'p': 'x'})
+    # The case of passwords matters
+    assert record_key({'email': 'a@b.com', 'password': 'Secret'}) != \
+        record_key({'email': 'a@b.com', 'password': 'secret'})
+    assert record_key({'n': 'A', 'importdate': '2020-01-01'}) == \
+        record_key({'n': 'A', 'importdate': '2021-01-01'})
+    assert record_key({'n': 'A'}) != record_key({'n': 'B'})
+
+
+def test_record_set_for_json(tmpdir):
+    """Validate records of a JSON file are seen, even if it changed."""
+    json_path = str(tmpdir.join('rel.json'))
+    records = RecordSet.for_json(json_path)
+    assert records.add({'email': 'a@b.com'})
+    assert not records.add({'email': 'A@B.com'})
+    assert records.duplicates == 1
+    # Records of the same email with other passwords are all kept
+    assert records.add({'email': 'a@b.com', 'password': 'secret'})
+    assert records.add({'email': 'a@b.com', 'password': 'other'})
+    assert not records.add({'email': 'a@b.com', 'password': 'other'})
+    assert records.duplicates == 2
+    with open(json_path, 'wb') as f:
+        f.write('{"_source": {"email": "a@b.com"}}\n')
+    records.close(json_path)
+
+    # Records added to the file by something else are read again
+    with open(json_path, 'ab') as f:
+        f.write('{"_source": {"email": "c@d.com"}}\n')
+    records = RecordSet.for_json(json_path)
+    assert not records.add({'email': 'c@d.com'})
+    assert records.add({'email': 'e@f.com'})
+    records.close(json_path)
+
+
+class NoProgress(object):
+    total = 0
+
+    def update_to(self, n):
+        pass
+
+
+def test_samples():
+    """Validate samples hold distinct lines of the file, in file order."""
+    lines = ['line {}\n'.format(i) for i in range(5000)]
+    sample, count = reservoir_sample(iter(lines), 100, NoProgress())
+    assert count == 5000 and len(sample) == 100
+    assert all(lines[index] == line for index, line in sample)
+    assert len(set(sample)) == 100
+
+    # Lines later in the file are drawn as often as the first ones
+    late = sum(index >= 2500 for _ in range(20) for index, _ in
+               reservoir_sample(iter(lines), 100, NoProgress())[0])
+    assert 800 < late < 1200
+
+    sample, count = reservoir_sample(iter(lines[:10]), 100, NoProgress())
+    assert count == 10 and sorted(sample) == list(enumerate(lines[:10]))
+
+    sample = selection_sample(iter(lines), 5000, 100, NoProgress())
+    assert len(sample) == 100
+    assert all(lines[index] == line for index, line in sample)
+
+
+def test_seek_sample(tmpdir):
+    """Validate approximate samples are complete lines of the file."""
+    lines = ['{},{}\n'.format(i, 'x' * (i % 7)) for i in range(20000)]
+    path = tmpdir.join('big.csv')
+    path.write('h1,h2\n' + ''.join(lines))
+    with open(str(path), 'rb') as f:
+        f.readline()
+        sample, count = seek_sample(f, path.size(), 95, 3.0, NoProgress())
+    assert 15000 < count < 25000
+    assert 500 < len(sample) < 1100
+    assert all(line in lines for _, line in sample)
+
+
+def test_line_index(tmpdir):
+    """Validate indexed lines are found by seeking, until the file changes."""
+    lines = ['line {}\n'.format(i) for i in range(2500)]
+    path = tmpdir.join('data.csv')
+    path.write(''.join(lines))
+    with tmpdir.as_cwd():
+        assert LineIndex.load(str(path)) is None
+        index = LineIndex.for_file(str(path))
+        assert index.line_count == 2500 and len(index.offsets) == 3
+
+        index = LineIndex.load(str(path))
+        with open(str(path), 'rb') as f:
+            numbers = [0, 5, 999, 1000, 1001, 2499, 2500]
+            assert list(index.read_lines(f, numbers)) == \
+                [(n, lines[n]) for n in numbers[:-1]]
+            index.seek(f, 1700)
+            assert f.readline() == lines[1700]
+
+        path.write('changed\n', mode='a')
+        assert LineIndex.load(str(path)) is None
@@ -0,0 +1,34 @@
+import json
+import os
+
+from headers.resolver import HeaderResolver, Resolution
+
+HEADER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'headers', 'headers.json')
+
+with open(HEADER_PATH) as f:
+    RESOLVER = HeaderResolver(json.load(f))
+
+
+def test_resolve_exact():
+    """Validate aliases, abbreviations and enumerated names are exact."""
+    assert RESOLVER.resolve('"first_name"') == Resolution('fn', 1.0)
+    assert RESOLVER.resolve('ln') == Resolution('ln', 1.0)
+    assert RESOLVER.resolve('e2') == Resolution('e', 1.0)
+
+
+def test_resolve_near_misses():
+    """Validate near-miss names resolve with a lower confidence."""
+    assert RESOLVER.resolve('user-email') == Resolution('e', 0.9)
+    assert RESOLVER.resolve('EmailAddr') == Resolution('e', 0.8)
+    assert RESOLVER.resolve('pwd_hash') == Resolution('h', 0.8)
+    assert RESOLVER.resolve('emial') == Resolution('e', 0.6)
+
+
+def test_resolve_not_a_header():
+    """Validate data fields stop the header row."""
+    assert RESOLVER.resolve('foo') == Resolution('x', 0.0)
+    assert RESOLVER.resolve('john smith') is None
+    assert RESOLVER.resolve_row(['email', 'j@x.com', 'pass']) == [
+        Resolution('e', 1.0)]
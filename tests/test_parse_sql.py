@@ -0,0 +1,148 @@
+import gzip
+
+import parse_sql
+from dbtools import checkpoint
+
+DUMP = """CREATE TABLE `users` (
+  `id` int(11) NOT NULL,
+  `name` varchar(64) NOT NULL
+);
+INSERT INTO `users` VALUES (1,'a'),
+(2,'b');
+VALUES (3,'c'),(4,'d');
+VALUES (5,'e');
+INSERT INTO `posts` VALUES (1,'x');
+INSERT INTO `users` VALUES (6,'f');
+VALUES (7,'g');
+"""
+
+
+def write_dumps(folder, text):
+    """Write a dump and a gzip copy of it in folders of their own, as their
+    outputs have the same names, return their paths."""
+    path = folder.mkdir('plain').join('dump.sql')
+    path.write(text, mode='wb')
+    compressed = str(folder.mkdir('gz').join('dump.sql.gz'))
+    with gzip.open(compressed, 'wb') as f:
+        f.write(text)
+    return str(path), compressed
+
+
+def read_csv(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_resume_values_statements(tmpdir, monkeypatch):
+    """Validate VALUES statements after the offset resumed from are still
+    inserts of the table before it."""
+    monkeypatch.setattr(checkpoint, 'INTERVAL', 0)
+    serial, _ = write_dumps(tmpdir.mkdir('serial'), DUMP)
+    parse_sql.parse(serial)
+    expected = read_csv(serial + '.users.csv')
+    assert expected.count('\n') == 8
+
+    parse_statements = parse_sql.parse_statements
+    for stop in range(2, 6):
+        for path in write_dumps(tmpdir.mkdir(str(stop)), DUMP):
+            def interrupted(*args):
+                for n, statement in enumerate(parse_statements(*args)):
+                    if n == stop:
+                        raise KeyboardInterrupt
+                    yield statement
+            monkeypatch.setattr(parse_sql, 'parse_statements', interrupted)
+            try:
+                parse_sql.parse(path)
+            except KeyboardInterrupt:
+                pass
+            monkeypatch.setattr(parse_sql, 'parse_statements',
+                                parse_statements)
+            parse_sql.parse(path, resume=True)
+            assert read_csv(
+                parse_sql.strip_compression(path) + '.users.csv') == expected
+
+
+def test_table_pattern():
+    """Validate --user-table matches whole table names."""
+    tables = parse_sql.table_pattern('users,Customers')
+    for name in ('users', 'USERS', 'customers'):
+        assert tables.match(name)
+    for name in ('users_log', 'old_users_backup', 'customers2'):
+        assert not tables.match(name)
+    assert parse_sql.table_pattern('wp_.*users').match('wp_2_users')
+    assert parse_sql.table_pattern() is parse_sql.USER_TABLES
+
+
+def make_dump(inserts):
+    """Return a dump of the users and members tables, with a broken insert
+    every hundred inserts."""
+    lines = []
+    for i in range(inserts):
+        table = 'members' if i % 3 else 'users'
+        if i % 100 == 50:
+            lines.append("INSERT INTO `{}` VALUES (1,,'a');".format(table))
+        else:
+            values = ','.join("({},'user{}@mail.com','p{}')".format(
+                i * 10 + j, j, i) for j in range(i % 7 + 1))
+            lines.append('INSERT INTO `{}` (`id`,`email`,`password`) '
+                         'VALUES {};'.format(table, values))
+    return '\n'.join(lines) + '\n'
+
+
+def test_parse_workers(tmpdir, monkeypatch):
+    """Validate a pool of workers writes the same files as a single one,
+    whatever the batches, for plain and compressed dumps."""
+    monkeypatch.setattr(parse_sql, 'PARSE_BATCH', 500)
+    dump = make_dump(1000)
+    outputs = {}
+    for workers in (1, 3):
+        for path in write_dumps(tmpdir.mkdir(str(workers)), dump):
+            parse_sql.parse(path, workers=workers)
+            base = parse_sql.strip_compression(path)
+            outputs[workers, path.endswith('.gz')] = [
+                read_csv(base + suffix) for suffix in
+                ('.users.csv', '.members.csv', '.bad_inserts.txt')]
+    expected = outputs.pop((1, False))
+    assert expected[0].count('\n') > 1000
+    assert expected[2]
+    for output in outputs.values():
+        assert output == expected
+
+
+def test_parse_statements_read_ahead(monkeypatch):
+    """Validate statements are read a bounded number of batches ahead of
+    the ones parsed, and come back in order."""
+    monkeypatch.setattr(parse_sql, 'PARSE_BATCH', 1)
+    read = []
+
+    def statements():
+        for i in range(200):
+            read.append(i)
+            yield (None, 'users', "INSERT INTO `users` VALUES ({});".format(i),
+                   i)
+
+    workers = 2
+    with parse_sql.worker_pool(workers) as pool:
+        for n, statement in enumerate(parse_sql.parse_statements(
+                statements(), pool, workers)):
+            assert statement[3] == n
+            assert statement[4] == u'"{}"\n'.format(n)
+            assert len(read) - n <= workers * parse_sql.BATCHES_PER_WORKER
+    assert n == 199
+
+
+def test_parse_utf8_names(tmpdir):
+    """Validate accented latin names of a UTF-8 dump are written as read."""
+    names = [u'\xd1o\xf1o \xd1\xfa\xf1ez', u'\xc0\xcd\xd3\xda \xd1\xc3\xd5',
+             u'Jo\xe3o Sim\xf5es', u'Fran\xe7ois Lef\xe8vre']
+    inserts = [u"INSERT INTO `users` (`id`,`name`) VALUES ({},'M\xfcller');"
+               .format(i) for i in range(50)]
+    inserts.extend(u"INSERT INTO `users` VALUES ({},'{}');".format(
+        100 + i, name) for i, name in enumerate(names))
+    dump = u'\n'.join(inserts).encode('utf-8') + '\n'
+    for path in write_dumps(tmpdir, dump):
+        parse_sql.parse(path)
+        rows = read_csv(parse_sql.strip_compression(path) + '.users.csv')
+        assert rows.decode('utf-8').splitlines()[-4:] == [
+            u'"{}","{}"'.format(100 + i, name)
+            for i, name in enumerate(names)]